@@ -2,6 +2,7 @@ import argparse
 import json
 import os
 import time
+import urllib.error
 import urllib.request
 import uuid
 import re
@@ -9,6 +10,7 @@ import hashlib
 
 from ai_ops import config
 from ai_ops.monitoring.log_monitor import start_monitoring
+from ai_ops.trace.features import ERROR_EXCERPT_CHARS, extract_features
 
 
 def _post_json(url, payload, api_key=None, timeout=15):
@@ -19,6 +21,8 @@ def _post_json(url, payload, api_key=None, timeout=15):
     }
     if api_key:
         headers["X-API-Key"] = api_key
+    if payload.get("event_id"):
+        headers["Idempotency-Key"] = str(payload["event_id"])
     req = urllib.request.Request(url, data=data, headers=headers, method="POST")
     with urllib.request.urlopen(req, timeout=timeout) as resp:
         raw = resp.read().decode("utf-8")
@@ -289,10 +293,11 @@ def run_agent(args):
             last_seen[fp] = now
 
         code_host = (args.code_host or "gitlab").strip().lower()
+        raw_excerpt = (excerpt or "")[: int(args.max_raw_excerpt)]
         payload = {
             "repo_url": repo_url,
             "code_host": code_host,
-            "error_content": (excerpt or "")[: int(args.max_raw_excerpt)],
+            "error_content": raw_excerpt,
             "schema_version": "1.0",
             "event_id": str(uuid.uuid4()),
             "occurred_at": int(time.time()),
@@ -310,10 +315,20 @@ def run_agent(args):
                 "message_key": message_key,
                 "fingerprint": fp,
                 "frames": frames,
-                "raw_excerpt": (excerpt or "")[: int(args.max_raw_excerpt)],
+                "raw_excerpt": raw_excerpt,
+                "features": extract_features(raw_excerpt[:ERROR_EXCERPT_CHARS]),
+                "features_chars": ERROR_EXCERPT_CHARS,
             },
         }
-        resp = _post_json(endpoint, payload, api_key=args.api_key, timeout=args.http_timeout_seconds)
+        try:
+            resp = _post_json(endpoint, payload, api_key=args.api_key, timeout=args.http_timeout_seconds)
+        except urllib.error.HTTPError as e:
+            if e.code != 429:
+                raise
+            if fp:
+                last_seen.pop(fp, None)
+            print(f"[agent] server busy, dropped report (retry after {e.headers.get('Retry-After') or '?'}s)")
+            return
         task_id = resp.get("task_id")
         print(f"[agent] reported error, task_id={task_id}")
 
@@ -55,6 +55,58 @@ HTTP_PORT = _env_int("HTTP_PORT", 8080)
 WORKSPACES_DIR = os.getenv("WORKSPACES_DIR", "workspaces")
 TRACE_DB_PATH = os.getenv("TRACE_DB_PATH", "data/traces.db")
 MAX_CONCURRENT_TASKS = _env_int("MAX_CONCURRENT_TASKS", 1)
+HTTP_SERVER_MODE = os.getenv("HTTP_SERVER_MODE", "threading").strip().lower()
+ASYNC_EXECUTOR_WORKERS = _env_int("ASYNC_EXECUTOR_WORKERS", 16)
+ASYNC_MAX_PENDING = _env_int("ASYNC_MAX_PENDING", 64)
+ASYNC_IDLE_TIMEOUT_SECONDS = _env_float("ASYNC_IDLE_TIMEOUT_SECONDS", 75.0)
+STATIC_RELOAD = os.getenv("STATIC_RELOAD", "false").strip().lower() in ("1", "true", "yes", "on")
+STATIC_MAX_AGE_SECONDS = _env_int("STATIC_MAX_AGE_SECONDS", 300)
+EXPORT_BATCH_SIZE = _env_int("EXPORT_BATCH_SIZE", 500)
+GZIP_MIN_BYTES = _env_int("GZIP_MIN_BYTES", 1024)
+SSE_BUFFER_SIZE = _env_int("SSE_BUFFER_SIZE", 1000)
+SSE_HEARTBEAT_SECONDS = _env_float("SSE_HEARTBEAT_SECONDS", 15.0)
+SHUTDOWN_DRAIN_SECONDS = _env_float("SHUTDOWN_DRAIN_SECONDS", 30.0)
+SHUTDOWN_CHECKPOINT_SECONDS = _env_float("SHUTDOWN_CHECKPOINT_SECONDS", 10.0)
+RECOVER_INTERRUPTED_JOBS = os.getenv("RECOVER_INTERRUPTED_JOBS", "true").strip().lower() in ("1", "true", "yes", "on")
+JOB_MAX_ATTEMPTS = _env_int("JOB_MAX_ATTEMPTS", 3)
+CLUSTER_MODE = os.getenv("CLUSTER_MODE", "false").strip().lower() in ("1", "true", "yes", "on")
+NODE_ID = os.getenv("NODE_ID", "").strip()
+JOB_LEASE_SECONDS = _env_float("JOB_LEASE_SECONDS", 60.0)
+JOB_HEARTBEAT_SECONDS = _env_float("JOB_HEARTBEAT_SECONDS", 15.0)
+JOB_POLL_SECONDS = _env_float("JOB_POLL_SECONDS", 1.0)
+AFFINITY_ROUTING = os.getenv("AFFINITY_ROUTING", "true").strip().lower() in ("1", "true", "yes", "on")
+AFFINITY_LOAD_FACTOR = _env_float("AFFINITY_LOAD_FACTOR", 1.25)
+AFFINITY_STEAL_SECONDS = _env_float("AFFINITY_STEAL_SECONDS", 30.0)
+AFFINITY_VNODES = _env_int("AFFINITY_VNODES", 64)
+REPO_CACHE_ENABLED = os.getenv("REPO_CACHE_ENABLED", "false").strip().lower() in ("1", "true", "yes", "on")
+REPO_CACHE_REFRESH_SECONDS = _env_float("REPO_CACHE_REFRESH_SECONDS", 3600.0)
+GITHUB_WEBHOOK_SECRET = os.getenv("GITHUB_WEBHOOK_SECRET", "")
+GITLAB_WEBHOOK_TOKEN = os.getenv("GITLAB_WEBHOOK_TOKEN", "")
+PR_COMMENT_COMMAND_PREFIX = os.getenv("PR_COMMENT_COMMAND_PREFIX", "")
+PR_COMMENT_COALESCE_SECONDS = _env_float("PR_COMMENT_COALESCE_SECONDS", 5.0)
+PR_COMMENT_COALESCE_MAX_SECONDS = _env_float("PR_COMMENT_COALESCE_MAX_SECONDS", 30.0)
+ACCEPT_CLIENT_FEATURES = os.getenv("ACCEPT_CLIENT_FEATURES", "true").strip().lower() in ("1", "true", "yes", "on")
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "safe").strip().lower()
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "").strip().upper()
+SQLITE_CACHE_SIZE = _env_int("SQLITE_CACHE_SIZE", 0)
+SQLITE_MMAP_SIZE = _env_int("SQLITE_MMAP_SIZE", -1)
+TRACE_WRITE_MODE = os.getenv("TRACE_WRITE_MODE", "direct").strip().lower()
+TRACE_GROUP_COMMIT_MS = _env_float("TRACE_GROUP_COMMIT_MS", 0.0)
+TRACE_WRITE_BATCH = _env_int("TRACE_WRITE_BATCH", 256)
+TRACE_FLUSH_ON_READ = os.getenv("TRACE_FLUSH_ON_READ", "true").strip().lower() in ("1", "true", "yes", "on")
+TRACE_BLOB_CODEC = os.getenv("TRACE_BLOB_CODEC", "auto").strip().lower()
+TRACE_FEATURE_CACHE_SIZE = _env_int("TRACE_FEATURE_CACHE_SIZE", 1024)
+TRACE_RETENTION_DAYS = _env_float("TRACE_RETENTION_DAYS", 0.0)
+TRACE_RETENTION_RULES = os.getenv("TRACE_RETENTION_RULES", "")
+TRACE_ARCHIVE_DIR = os.getenv("TRACE_ARCHIVE_DIR", "")
+TRACE_RETENTION_BATCH = _env_int("TRACE_RETENTION_BATCH", 200)
+TRACE_MAINTENANCE_SECONDS = _env_float("TRACE_MAINTENANCE_SECONDS", 3600.0)
+IDEMPOTENCY_TTL_SECONDS = _env_int("IDEMPOTENCY_TTL_SECONDS", 86400)
+ADMISSION_QUEUE_RETRY_SECONDS = _env_int("ADMISSION_QUEUE_RETRY_SECONDS", 30)
+ADMISSION_REPO_RATE = _env_float("ADMISSION_REPO_RATE", 0.2)
+ADMISSION_REPO_BURST = _env_int("ADMISSION_REPO_BURST", 10)
+ADMISSION_API_KEY_RATE = _env_float("ADMISSION_API_KEY_RATE", 1.0)
+ADMISSION_API_KEY_BURST = _env_int("ADMISSION_API_KEY_BURST", 30)
 
 AGENT_SERVER_URL = os.getenv("AGENT_SERVER_URL", f"http://{HTTP_HOST}:{HTTP_PORT}")
 AGENT_API_KEY = os.getenv("AGENT_API_KEY")
@@ -4,9 +4,13 @@ import subprocess
 import time
 
 from ai_ops import config
+from ai_ops.trace.features import ERROR_EXCERPT_CHARS
 from ai_ops.trace.trace_store import StepScope
 
 
+RETRY_UNSAFE_STEPS = ("GIT_COMMIT_PUSH", "CREATE_PR", "NOTIFY", "CLEANUP")
+
+
 def require_non_empty(name, value):
     if value is None:
         raise ValueError(f"{name} is required.")
@@ -25,15 +29,17 @@ def build_error_signature(error_content):
 
 
 class AutoRepairOrchestrator:
-    def __init__(self, claude, email, code_host, repo_root=None, trace_store=None, code_host_name=None):
+    def __init__(self, claude, email, code_host, repo_root=None, trace_store=None, code_host_name=None, cancel_event=None, fence=None):
         self.claude = claude
         self.email = email
         self.code_host = code_host
         self.repo_root = os.path.abspath(repo_root or os.getcwd())
         self.trace_store = trace_store
         self.code_host_name = (code_host_name or config.CODE_HOST or "").strip().lower()
+        self.cancel_event = cancel_event
+        self.fence = fence
 
-    def handle_error(self, error_content, repo_url=None, trace_id=None):
+    def handle_error(self, error_content, repo_url=None, trace_id=None, features=None):
         print("\n[!] 检测到错误，开始代理式自动修复流程...")
 
         if getattr(config, "EMAIL_ENABLED", True):
@@ -63,7 +69,8 @@ class AutoRepairOrchestrator:
                     repo_url=repo_url or "",
                     code_host=self.code_host_name,
                     error_signature=signature,
-                    error_excerpt=(error_content or "")[:2000],
+                    error_excerpt=(error_content or "")[:ERROR_EXCERPT_CHARS],
+                    features=features,
                 )
 
         print("正在准备修复分支...")
@@ -132,6 +139,7 @@ class AutoRepairOrchestrator:
                     changed_files_json="",
                     diff_text="",
                     preflight_ok=1,
+                    features=features,
                 )
             except Exception:
                 pass
@@ -154,7 +162,9 @@ class AutoRepairOrchestrator:
     def _step(self, trace_id, step_name):
         if not self.trace_store or not trace_id:
             return _NullScope()
-        return StepScope(self.trace_store, trace_id, step_name)
+        # Steps with external side effects always run to completion once the pipeline reaches them.
+        cancel_event = None if step_name in RETRY_UNSAFE_STEPS else self.cancel_event
+        return StepScope(self.trace_store, trace_id, step_name, cancel_event=cancel_event, fence=self.fence)
 
     def _run_preflight_checks(self):
         subprocess.run(
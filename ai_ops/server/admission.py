@@ -0,0 +1,84 @@
+import math
+import threading
+import time
+
+
+class TokenBucket:
+    def __init__(self, rate, burst, now=None):
+        self.rate = float(rate)
+        self.burst = max(float(burst), 1.0)
+        self.tokens = self.burst
+        self.updated = now if now is not None else time.monotonic()
+
+    def refill(self, now):
+        elapsed = max(now - self.updated, 0.0)
+        self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+        self.updated = now
+
+    def retry_after(self):
+        if self.tokens >= 1.0 or self.rate <= 0:
+            return 0
+        return max(int(math.ceil((1.0 - self.tokens) / self.rate)), 1)
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_queue_depth=0,
+        queue_retry_seconds=30,
+        repo_rate=0.0,
+        repo_burst=1,
+        key_rate=0.0,
+        key_burst=1,
+        max_buckets=10000,
+    ):
+        self.max_queue_depth = int(max_queue_depth)
+        self.queue_retry_seconds = max(int(queue_retry_seconds), 1)
+        self.repo_rate = float(repo_rate)
+        self.repo_burst = repo_burst
+        self.key_rate = float(key_rate)
+        self.key_burst = key_burst
+        self.max_buckets = max(int(max_buckets), 1)
+        self._lock = threading.Lock()
+        self._repo_buckets = {}
+        self._key_buckets = {}
+
+    def check(self, repo_url, api_key, queue_depth, priority=False):
+        if priority:
+            return None
+        if self.max_queue_depth > 0 and int(queue_depth) >= self.max_queue_depth:
+            return "queue_full", self.queue_retry_seconds
+
+        now = time.monotonic()
+        with self._lock:
+            buckets = []
+            if self.repo_rate > 0 and repo_url:
+                buckets.append(("repo_rate_limited", self._bucket(self._repo_buckets, repo_url, self.repo_rate, self.repo_burst, now)))
+            if self.key_rate > 0 and api_key:
+                buckets.append(("api_key_rate_limited", self._bucket(self._key_buckets, api_key, self.key_rate, self.key_burst, now)))
+            for reason, bucket in buckets:
+                bucket.refill(now)
+                if bucket.tokens < 1.0:
+                    return reason, bucket.retry_after()
+            for _reason, bucket in buckets:
+                bucket.tokens -= 1.0
+        return None
+
+    def _bucket(self, buckets, key, rate, burst, now):
+        bucket = buckets.get(key)
+        if bucket is None:
+            if len(buckets) >= self.max_buckets:
+                self._evict_full(buckets, now)
+            bucket = TokenBucket(rate, burst, now=now)
+            buckets[key] = bucket
+        return bucket
+
+    def _evict_full(self, buckets, now):
+        # A bucket that has refilled completely is indistinguishable from a new one.
+        for key in list(buckets.keys()):
+            bucket = buckets[key]
+            bucket.refill(now)
+            if bucket.tokens >= bucket.burst:
+                del buckets[key]
+        while len(buckets) >= self.max_buckets:
+            buckets.pop(next(iter(buckets)))
@@ -0,0 +1,82 @@
+import bisect
+import hashlib
+import math
+import threading
+import time
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.sha1(value.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    def __init__(self, nodes, vnodes=64):
+        self.nodes = sorted(set(nodes))
+        points = []
+        for node in self.nodes:
+            for i in range(max(int(vnodes), 1)):
+                points.append((_hash(f"{node}#{i}"), node))
+        points.sort()
+        self._keys = [p[0] for p in points]
+        self._owners = [p[1] for p in points]
+
+    def owner(self, key, loads=None, load_factor=1.25):
+        if not self.nodes:
+            return ""
+        loads = loads or {}
+        capacity = None
+        if load_factor:
+            total = sum(loads.get(node, 0) for node in self.nodes) + 1
+            capacity = math.ceil(float(load_factor) * total / len(self.nodes))
+        start = bisect.bisect(self._keys, _hash(key)) % len(self._keys)
+        seen = set()
+        for offset in range(len(self._keys)):
+            node = self._owners[(start + offset) % len(self._keys)]
+            if node in seen:
+                continue
+            seen.add(node)
+            if capacity is None or loads.get(node, 0) < capacity:
+                return node
+            if len(seen) == len(self.nodes):
+                break
+        return self._owners[start]
+
+
+class JobRouter:
+    def __init__(self, store, node_ttl=60.0, vnodes=64, load_factor=1.25, refresh_seconds=2.0):
+        self.store = store
+        self.node_ttl = float(node_ttl)
+        self.vnodes = int(vnodes)
+        self.load_factor = float(load_factor)
+        self.refresh_seconds = float(refresh_seconds)
+        self._lock = threading.Lock()
+        self._ring = HashRing([], self.vnodes)
+        self._refreshed_at = 0.0
+
+    def live_nodes(self):
+        return self._current_ring().nodes
+
+    def route(self, repo_url):
+        ring = self._current_ring()
+        if not ring.nodes:
+            return ""
+        return ring.owner(repo_key(repo_url), loads=self.store.job_loads(), load_factor=self.load_factor)
+
+    def _current_ring(self):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._refreshed_at < self.refresh_seconds:
+                return self._ring
+        nodes = self.store.live_nodes(self.node_ttl)
+        with self._lock:
+            if nodes != self._ring.nodes:
+                self._ring = HashRing(nodes, self.vnodes)
+            self._refreshed_at = now
+            return self._ring
+
+
+def repo_key(repo_url):
+    url = (repo_url or "").strip().lower()
+    if url.endswith(".git"):
+        url = url[: -len(".git")]
+    return url.rstrip("/")
@@ -0,0 +1,354 @@
+import asyncio
+import contextlib
+import io
+import itertools
+import json
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from http.client import parse_headers
+from urllib.parse import parse_qs, urlparse
+
+from ai_ops import config
+from ai_ops.server.event_bus import KEEPALIVE_FRAME, EventStreamFilter, format_event, parse_last_event_id
+from ai_ops.server.export import EXPORT_LINES_PER_CHUNK, LAST_CHUNK, export_target, frame_chunk, iter_export_rows, iter_ndjson_chunks
+from ai_ops.server.metrics import route_label
+from ai_ops.server.http_server import (
+    EVENT_STREAM_HEADERS,
+    ApiHandler,
+    _api_key_ok,
+    _event_stream_target,
+    _export_headers,
+    _stream_opening,
+)
+from ai_ops.server.static_assets import accepted_encodings
+
+
+class _BadRequest(Exception):
+    def __init__(self, code, error):
+        super().__init__(error)
+        self.code = code
+        self.error = error
+
+
+class AsyncApiServer:
+    def __init__(
+        self,
+        runner,
+        host,
+        port,
+        handler_class=ApiHandler,
+        max_workers=16,
+        max_pending=64,
+        idle_timeout=75.0,
+        max_header_bytes=65536,
+        max_body_bytes=10 * 1024 * 1024,
+    ):
+        self.runner = runner
+        self.host = host
+        self.port = int(port)
+        self.handler_class = handler_class
+        self.executor = ThreadPoolExecutor(max_workers=max(int(max_workers), 1), thread_name_prefix="api")
+        self.max_pending = max(int(max_pending), 1)
+        self.idle_timeout = float(idle_timeout)
+        self.max_header_bytes = int(max_header_bytes)
+        self.max_body_bytes = int(max_body_bytes)
+        self.server_address = (host, self.port)
+        self._loop = None
+        self._server = None
+        self._pending = None
+        self._wakeup = None
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._pending = asyncio.Semaphore(self.max_pending)
+        self._wakeup = asyncio.Event()
+        self.runner.events.add_listener(self._on_event)
+        self._server = await asyncio.start_server(
+            self._handle_connection,
+            self.host,
+            self.port,
+            limit=self.max_header_bytes,
+            backlog=1024,
+        )
+        sock = self._server.sockets[0] if self._server.sockets else None
+        if sock is not None:
+            self.server_address = sock.getsockname()[:2]
+        return self
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+        self.executor.shutdown(wait=False)
+
+    def _on_event(self, _event):
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._wake_streams)
+
+    def _wake_streams(self):
+        waiter = self._wakeup
+        self._wakeup = asyncio.Event()
+        waiter.set()
+
+    async def _handle_connection(self, reader, writer):
+        peer = writer.get_extra_info("peername") or ("", 0)
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader, writer), timeout=self.idle_timeout)
+                except _BadRequest as e:
+                    writer.write(self._simple_response(e.code, {"error": e.error}))
+                    await writer.drain()
+                    return
+                if request is None:
+                    return
+
+                url = urlparse(request["path"])
+                qs = parse_qs(url.query or "", keep_blank_values=True)
+                stream = _event_stream_target(url.path, qs) if request["method"] == "GET" else None
+                if stream:
+                    async with self._observed(request, url.path):
+                        await self._stream_events(writer, request, stream, qs)
+                    return
+                try:
+                    export = export_target(url.path, qs) if request["method"] == "GET" else None
+                except ValueError:
+                    export = None
+                if export:
+                    async with self._observed(request, url.path):
+                        keep_alive = await self._stream_export(writer, request, export)
+                    if not keep_alive:
+                        return
+                    continue
+
+                async with self._pending:
+                    response, keep_alive = await self._loop.run_in_executor(self.executor, self._dispatch, request, peer)
+                writer.write(response)
+                await writer.drain()
+                if not keep_alive:
+                    return
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            return
+        finally:
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    async def _read_request(self, reader, writer):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError as e:
+            if not e.partial.strip():
+                return None
+            raise
+        except asyncio.LimitOverrunError:
+            raise _BadRequest(431, "request_header_too_large")
+
+        request_line, _, header_bytes = head.partition(b"\r\n")
+        parts = request_line.decode("iso-8859-1").split()
+        if len(parts) != 3 or not parts[2].startswith("HTTP/1."):
+            raise _BadRequest(400, "bad_request")
+        method, target, version = parts
+        headers = parse_headers(io.BytesIO(header_bytes))
+
+        if "chunked" in (headers.get("Transfer-Encoding") or "").lower():
+            raise _BadRequest(411, "length_required")
+        raw_length = (headers.get("Content-Length") or "0").strip()
+        if not raw_length.isdigit():
+            raise _BadRequest(400, "bad_content_length")
+        length = int(raw_length)
+        if length > self.max_body_bytes:
+            raise _BadRequest(413, "request_body_too_large")
+        if length and (headers.get("Expect") or "").lower() == "100-continue":
+            writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+            await writer.drain()
+        body = await reader.readexactly(length) if length else b""
+
+        connection = (headers.get("Connection") or "").lower()
+        if version == "HTTP/1.0":
+            keep_alive = "keep-alive" in connection
+        else:
+            keep_alive = "close" not in connection
+        return {
+            "method": method,
+            "path": target,
+            "version": version,
+            "request_line": request_line.decode("iso-8859-1"),
+            "headers": headers,
+            "body": body,
+            "keep_alive": keep_alive,
+        }
+
+    def _dispatch(self, request, peer):
+        handler = self.handler_class.__new__(self.handler_class)
+        handler.server = self
+        handler.client_address = peer
+        handler.rfile = io.BytesIO(request["body"])
+        handler.wfile = io.BytesIO()
+        handler.command = request["method"]
+        handler.path = request["path"]
+        handler.request_version = request["version"]
+        handler.requestline = request["request_line"]
+        handler.headers = request["headers"]
+        handler.protocol_version = "HTTP/1.1"
+        handler.close_connection = not request["keep_alive"]
+        try:
+            method = getattr(handler, f"do_{request['method']}", None)
+            if method is None:
+                handler.send_error(501, f"Unsupported method ({request['method']!r})")
+            else:
+                method()
+            if hasattr(handler, "_headers_buffer"):
+                handler.flush_headers()
+        except Exception:
+            return self._simple_response(500, {"error": "internal_server_error"}), False
+        return handler.wfile.getvalue(), request["keep_alive"] and not handler.close_connection
+
+    @contextlib.asynccontextmanager
+    async def _observed(self, request, path):
+        started = time.monotonic()
+        request["status"] = 200
+        try:
+            yield
+        finally:
+            seconds = time.monotonic() - started
+            self.runner.metrics.observe_request(route_label(path), request["method"], request["status"], seconds)
+
+    async def _stream_export(self, writer, request, export):
+        if not _api_key_ok(request["headers"]):
+            request["status"] = 401
+            writer.write(self._simple_response(401, {"error": "unauthorized"}))
+            await writer.drain()
+            return False
+        accepts_gzip = "gzip" in accepted_encodings(request["headers"].get("Accept-Encoding"))
+        transparent, headers = _export_headers(export, accepts_gzip)
+        keep_alive = request["keep_alive"]
+        head = ["HTTP/1.1 200 OK", f"Date: {formatdate(usegmt=True)}"]
+        head.extend(f"{key}: {value}" for key, value in headers)
+        if not keep_alive:
+            head.append("Connection: close")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("iso-8859-1"))
+
+        rows = iter_export_rows(self.runner.store, export, batch_size=config.EXPORT_BATCH_SIZE)
+        chunks = iter_ndjson_chunks(rows, lines_per_chunk=EXPORT_LINES_PER_CHUNK, compress=export["gzip"] or transparent)
+        per_call = max(config.EXPORT_BATCH_SIZE // EXPORT_LINES_PER_CHUNK, 1)
+
+        def next_batch():
+            return list(itertools.islice(chunks, per_call))
+
+        # One short executor call per batch: a slow client or a long export does not hold a worker
+        # while the socket drains.
+        try:
+            while True:
+                try:
+                    batch = await self._loop.run_in_executor(self.executor, next_batch)
+                except Exception:
+                    return False
+                if not batch:
+                    break
+                for chunk in batch:
+                    writer.write(frame_chunk(chunk))
+                await writer.drain()
+        finally:
+            await self._loop.run_in_executor(self.executor, rows.close)
+        writer.write(LAST_CHUNK)
+        await writer.drain()
+        return keep_alive
+
+    async def _stream_events(self, writer, request, stream, qs):
+        bus = self.runner.events
+        trace_id = stream["trace_id"]
+        task_id = stream["task_id"]
+        last_id = parse_last_event_id(request["headers"], qs)
+        if stream["per_trace"]:
+            trace = await self._loop.run_in_executor(self.executor, self.runner.store.get_trace, trace_id)
+            if not trace:
+                request["status"] = 404
+                writer.write(self._simple_response(404, {"error": "not_found"}))
+                await writer.drain()
+                return
+        task_trace_id = ((self.runner.get(task_id) or {}).get("trace_id") or "") if task_id else ""
+        stream_filter = EventStreamFilter(trace_id=trace_id, task_id=task_id, task_trace_id=task_trace_id)
+
+        head = ["HTTP/1.1 200 OK", f"Date: {formatdate(usegmt=True)}", "Connection: close"]
+        head.extend(f"{key}: {value}" for key, value in EVENT_STREAM_HEADERS)
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("iso-8859-1"))
+
+        frames, last_id, done = await self._loop.run_in_executor(self.executor, _stream_opening, self.runner, stream, last_id)
+        for frame in frames:
+            writer.write(frame)
+        await writer.drain()
+        if done:
+            return
+
+        while True:
+            waiter = self._wakeup
+            events = bus.since(last_id)
+            if not events:
+                try:
+                    await asyncio.wait_for(waiter.wait(), timeout=config.SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    writer.write(KEEPALIVE_FRAME)
+                    await writer.drain()
+                continue
+            finished = False
+            for event in events:
+                last_id = event["id"]
+                if not stream_filter.accept(event):
+                    continue
+                writer.write(format_event(event["id"], event["event"], event["data"]))
+                finished = finished or stream_filter.is_terminal(event)
+            await writer.drain()
+            if finished:
+                return
+
+    def _simple_response(self, code, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        reason = {400: "Bad Request", 401: "Unauthorized", 404: "Not Found", 411: "Length Required", 413: "Payload Too Large", 431: "Request Header Fields Too Large"}
+        head = (
+            f"HTTP/1.1 {code} {reason.get(code, 'Internal Server Error')}\r\n"
+            f"Date: {formatdate(usegmt=True)}\r\n"
+            "Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            "Connection: close\r\n\r\n"
+        )
+        return head.encode("iso-8859-1") + data
+
+
+def serve_async(runner):
+    server = AsyncApiServer(
+        runner,
+        config.HTTP_HOST,
+        config.HTTP_PORT,
+        max_workers=config.ASYNC_EXECUTOR_WORKERS,
+        max_pending=config.ASYNC_MAX_PENDING,
+        idle_timeout=config.ASYNC_IDLE_TIMEOUT_SECONDS,
+    )
+
+    async def main():
+        await server.start()
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        try:
+            loop.add_signal_handler(signal.SIGTERM, stop.set)
+        except (NotImplementedError, RuntimeError, ValueError):
+            pass
+        await stop.wait()
+        await loop.run_in_executor(None, runner.shutdown)
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        runner.shutdown()
+    finally:
+        server.close()
@@ -0,0 +1,102 @@
+import collections
+import json
+import threading
+import time
+
+
+TERMINAL_TRACE_EVENTS = ("trace_finished",)
+TERMINAL_TRACE_STATUSES = ("DONE", "FAILED", "INTERRUPTED")
+
+
+class EventBus:
+    def __init__(self, capacity=1000):
+        self._cond = threading.Condition()
+        self._events = collections.deque(maxlen=max(int(capacity), 1))
+        self._last_id = 0
+        self._listeners = []
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+    def publish(self, event_type, data):
+        with self._cond:
+            self._last_id += 1
+            event = {"id": self._last_id, "event": event_type, "data": dict(data or {})}
+            self._events.append(event)
+            self._cond.notify_all()
+        for callback in list(self._listeners):
+            try:
+                callback(event)
+            except Exception:
+                pass
+        return event
+
+    def last_id(self):
+        with self._cond:
+            return self._last_id
+
+    def covers(self, last_id):
+        # True when every event after last_id is still buffered; ids from before a restart or already
+        # evicted from the ring are not.
+        with self._cond:
+            last_id = int(last_id or 0)
+            first_id = self._events[0]["id"] if self._events else self._last_id + 1
+            return first_id - 1 <= last_id <= self._last_id
+
+    def since(self, last_id):
+        with self._cond:
+            return self._since_locked(last_id)
+
+    def wait(self, last_id, timeout):
+        deadline = time.monotonic() + max(float(timeout), 0.0)
+        with self._cond:
+            while True:
+                events = self._since_locked(last_id)
+                if events:
+                    return events
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                self._cond.wait(remaining)
+
+    def _since_locked(self, last_id):
+        last_id = int(last_id or 0)
+        if last_id > self._last_id:
+            # Event ids restart with the process; treat a newer id as a fresh subscriber.
+            last_id = 0
+        if not self._events or self._events[-1]["id"] <= last_id:
+            return []
+        return [e for e in self._events if e["id"] > last_id]
+
+
+class EventStreamFilter:
+    def __init__(self, trace_id="", task_id="", task_trace_id=""):
+        self.trace_id = trace_id or ""
+        self.task_id = task_id or ""
+        self.task_trace_id = task_trace_id or ""
+
+    def accept(self, event):
+        data = event.get("data") or {}
+        if self.task_id and data.get("task_id") == self.task_id and data.get("trace_id"):
+            self.task_trace_id = data["trace_id"]
+        if self.trace_id and data.get("trace_id") != self.trace_id:
+            return False
+        if self.task_id and data.get("task_id") != self.task_id:
+            return bool(self.task_trace_id) and data.get("trace_id") == self.task_trace_id
+        return True
+
+    def is_terminal(self, event):
+        return bool(self.trace_id) and event.get("event") in TERMINAL_TRACE_EVENTS
+
+
+def parse_last_event_id(headers, qs):
+    raw = (headers.get("Last-Event-ID") or (qs.get("last_event_id") or [""])[0] or "").strip()
+    return int(raw) if raw.isdigit() else 0
+
+
+def format_event(event_id, event_type, data):
+    body = json.dumps(data, ensure_ascii=False)
+    return f"id: {event_id}\nevent: {event_type}\ndata: {body}\n\n".encode("utf-8")
+
+
+KEEPALIVE_FRAME = b": keepalive\n\n"
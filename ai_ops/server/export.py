@@ -0,0 +1,78 @@
+import json
+import zlib
+
+
+EXPORT_PREFIX = "/v1/export/"
+EXPORT_KINDS = ("traces", "steps", "bug-cases")
+EXPORT_LINES_PER_CHUNK = 200
+
+
+def export_target(path, qs):
+    if not path.startswith(EXPORT_PREFIX):
+        return None
+    kind = path[len(EXPORT_PREFIX) :].strip("/")
+    if kind.endswith(".ndjson"):
+        kind = kind[: -len(".ndjson")]
+    if kind not in EXPORT_KINDS:
+        return None
+
+    def first(key):
+        return (qs.get(key) or [""])[0].strip()
+
+    def as_int(key):
+        raw = first(key)
+        if not raw:
+            return None
+        if not raw.lstrip("-").isdigit():
+            raise ValueError(key)
+        return int(raw)
+
+    return {
+        "kind": kind,
+        "repo_url": first("repo_url"),
+        "status": first("status"),
+        "since": as_int("since"),
+        "until": as_int("until"),
+        "include_steps": first("include_steps").lower() in ("1", "true", "yes", "on"),
+        "gzip": first("gzip").lower() in ("1", "true", "yes", "on"),
+    }
+
+
+def iter_export_rows(store, spec, batch_size=500):
+    filters = {
+        "repo_url": spec["repo_url"],
+        "status": spec["status"],
+        "since": spec["since"],
+        "until": spec["until"],
+        "batch_size": batch_size,
+    }
+    if spec["kind"] == "traces":
+        return store.iter_traces(include_steps=spec["include_steps"], **filters)
+    if spec["kind"] == "steps":
+        return store.iter_steps(**filters)
+    return store.iter_bug_cases(**filters)
+
+
+def iter_ndjson_chunks(rows, lines_per_chunk=EXPORT_LINES_PER_CHUNK, compress=False):
+    encoder = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(row, ensure_ascii=False))
+        if len(lines) >= lines_per_chunk:
+            chunk = ("\n".join(lines) + "\n").encode("utf-8")
+            lines = []
+            chunk = encoder.compress(chunk) if encoder else chunk
+            if chunk:
+                yield chunk
+    tail = ("\n".join(lines) + "\n").encode("utf-8") if lines else b""
+    if encoder:
+        tail = encoder.compress(tail) + encoder.flush()
+    if tail:
+        yield tail
+
+
+def frame_chunk(data):
+    return f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n"
+
+
+LAST_CHUNK = b"0\r\n\r\n"
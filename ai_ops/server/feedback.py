@@ -0,0 +1,101 @@
+import threading
+import time
+import uuid
+
+
+class FeedbackCoalescer:
+    def __init__(self, flush, window_seconds=5.0, max_wait_seconds=30.0, on_new=None):
+        self.flush = flush
+        self.on_new = on_new
+        self.window_seconds = max(float(window_seconds), 0.0)
+        self.max_wait_seconds = max(float(max_wait_seconds), self.window_seconds)
+        self._cond = threading.Condition()
+        self._pending = {}
+        self._closed = False
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def add(self, repo_url, pr_url, pr_number, comment, code_host=None, persist=None):
+        # persist(batch) sees the batch with the new comment and returns (owning task id, staged); a
+        # comment that was not staged leaves the batch untouched and is returned with a count of 0.
+        # It runs under the batch's own lock rather than the coalescer's, so a slow write only holds
+        # up comments on the same PR, and the flush thread waits for it before sending the batch.
+        key = ((code_host or "").lower(), repo_url, str(pr_number))
+        while True:
+            now = time.monotonic()
+            with self._cond:
+                if self._closed:
+                    raise RuntimeError("feedback coalescer is closed")
+                batch = self._pending.get(key)
+                if batch is None:
+                    batch = {
+                        "task_id": str(uuid.uuid4()),
+                        "repo_url": repo_url,
+                        "pr_url": pr_url,
+                        "pr_number": pr_number,
+                        "code_host": code_host,
+                        "comments": [],
+                        "first_at": now,
+                        "last_at": now,
+                        "lock": threading.Lock(),
+                        "flushed": False,
+                    }
+                    self._pending[key] = batch
+            with batch["lock"]:
+                if batch["flushed"]:
+                    continue
+                if persist is not None:
+                    accepted, staged = persist(dict(batch, comments=batch["comments"] + [comment]))
+                    if not staged:
+                        if not batch["comments"]:
+                            self._discard(key, batch)
+                        return accepted, 0
+                if not batch["comments"] and self.on_new is not None:
+                    self.on_new(batch)
+                with self._cond:
+                    batch["comments"].append(comment)
+                    batch["last_at"] = now
+                    self._cond.notify()
+                    return batch["task_id"], len(batch["comments"])
+
+    def _discard(self, key, batch):
+        batch["flushed"] = True
+        with self._cond:
+            if self._pending.get(key) is batch:
+                del self._pending[key]
+
+    def pending(self):
+        with self._cond:
+            return len(self._pending)
+
+    def close(self, timeout=10.0):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout)
+
+    def _due_at(self, batch):
+        return min(batch["last_at"] + self.window_seconds, batch["first_at"] + self.max_wait_seconds)
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                due = [k for k, b in self._pending.items() if self._closed or self._due_at(b) <= now]
+                batches = [self._pending.pop(k) for k in due]
+                if not batches:
+                    if self._closed:
+                        return
+                    deadlines = [self._due_at(b) for b in self._pending.values()]
+                    self._cond.wait(max(min(deadlines) - now, 0.0) if deadlines else None)
+                    continue
+            for batch in batches:
+                with batch["lock"]:
+                    batch["flushed"] = True
+                    comments = list(batch["comments"])
+                if not comments:
+                    continue
+                try:
+                    self.flush(dict(batch, comments=comments))
+                except Exception:
+                    pass
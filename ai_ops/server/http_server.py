@@ -1,8 +1,12 @@
+import gzip
 import json
 import hashlib
 import hmac
+import itertools
 import os
 import queue
+import signal
+import socket
 import threading
 import time
 import uuid
@@ -10,10 +14,28 @@ from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from urllib.parse import parse_qs, urlparse
 
 from ai_ops import config
-from ai_ops.core.orchestrator import AutoRepairOrchestrator, build_error_signature
+from ai_ops.core.orchestrator import RETRY_UNSAFE_STEPS, AutoRepairOrchestrator, build_error_signature
 from ai_ops.integrations.claude_interface import ClaudeInterface
 from ai_ops.integrations.email_service import EmailSender
-from ai_ops.trace.trace_store import TraceStore
+from ai_ops.server.admission import AdmissionController
+from ai_ops.server.affinity import JobRouter
+from ai_ops.server.event_bus import (
+    KEEPALIVE_FRAME,
+    TERMINAL_TRACE_EVENTS,
+    TERMINAL_TRACE_STATUSES,
+    EventBus,
+    EventStreamFilter,
+    format_event,
+    parse_last_event_id,
+)
+from ai_ops.server.export import LAST_CHUNK, export_target, frame_chunk, iter_export_rows, iter_ndjson_chunks
+from ai_ops.server.feedback import FeedbackCoalescer
+from ai_ops.server.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from ai_ops.server.metrics import ServerMetrics, route_label
+from ai_ops.server.static_assets import StaticAssetCache, accepted_encodings
+from ai_ops.trace.features import ERROR_EXCERPT_CHARS, extract_features, trusted_features
+from ai_ops.trace.retention import RetentionPolicy, TraceArchiver
+from ai_ops.trace.trace_store import JobInterrupted, LeaseLost, TraceStore, sqlite_pragmas
 from ai_ops.vcs.github_service import GitHubService
 from ai_ops.vcs.gitlab_service import GitLabService
 from ai_ops.workspace.workspace_manager import WorkspaceManager
@@ -59,45 +81,202 @@ def _gitlab_project_from_url(repo_url):
     return ""
 
 
+def _event_stream_target(path, qs):
+    if path == "/v1/events":
+        return {
+            "trace_id": (qs.get("trace_id") or [""])[0].strip(),
+            "task_id": (qs.get("task_id") or [""])[0].strip(),
+            "per_trace": False,
+        }
+    if path.startswith("/v1/traces/") and path.endswith("/events"):
+        trace_id = path[len("/v1/traces/") : -len("/events")].strip("/")
+        return {"trace_id": trace_id, "task_id": "", "per_trace": True}
+    return None
+
+
+def _stream_opening(runner, stream, last_id):
+    # Frames sent before live events, as (frames, last_id, done). A new per-trace subscriber, or any
+    # subscriber whose Last-Event-ID is no longer buffered (evicted, or from before a restart), gets a
+    # snapshot; a trace that has already finished gets its terminal event and the stream ends.
+    bus = runner.events
+    resumed = bool(last_id) and bus.covers(last_id)
+    mark = last_id if resumed else bus.last_id()
+    task = runner.get(stream["task_id"]) if stream["task_id"] else None
+    trace_id = stream["trace_id"] or ((task or {}).get("trace_id") or "")
+    trace = runner.store.get_trace(trace_id) if trace_id else None
+    frames = []
+    if not resumed and (last_id or stream["per_trace"]):
+        snapshot = {"trace": trace, "steps": runner.store.list_steps(trace_id) if trace else []}
+        if stream["task_id"]:
+            snapshot["task"] = task
+        frames.append(format_event(mark, "snapshot", snapshot))
+    done = False
+    if stream["trace_id"] and trace and trace.get("status") in TERMINAL_TRACE_STATUSES:
+        replay = bus.since(mark) if resumed else []
+        if not any(e["event"] in TERMINAL_TRACE_EVENTS and e["data"].get("trace_id") == trace_id for e in replay):
+            data = {
+                "trace_id": trace_id,
+                "status": trace["status"],
+                "failure_step": trace.get("failure_step") or "",
+                "failure_message": trace.get("failure_message") or "",
+                "mr_url": trace.get("mr_url") or "",
+                "commit_sha": trace.get("commit_sha") or "",
+                "at": trace.get("finished_at"),
+            }
+            frames.append(format_event(mark, "trace_finished", data))
+            done = True
+    return frames, mark, done
+
+
+def _optional_int(qs, key):
+    raw = (qs.get(key) or [""])[0].strip()
+    if not raw:
+        return None
+    if not raw.lstrip("-").isdigit():
+        raise ValueError(key)
+    return int(raw)
+
+
+def _api_key_ok(headers):
+    expected = (config.SERVER_API_KEY or "").strip()
+    if not expected:
+        return True
+    actual = (headers.get("X-API-Key") or "").strip()
+    return actual == expected
+
+
+def _export_headers(export, accepts_gzip):
+    name = export["kind"].replace("-", "_")
+    headers = [("Transfer-Encoding", "chunked"), ("Cache-Control", "no-store")]
+    if export["gzip"]:
+        headers.append(("Content-Type", "application/gzip"))
+        headers.append(("Content-Disposition", f'attachment; filename="{name}.ndjson.gz"'))
+        return False, headers
+    headers.append(("Content-Type", "application/x-ndjson; charset=utf-8"))
+    headers.append(("Content-Disposition", f'attachment; filename="{name}.ndjson"'))
+    if accepts_gzip:
+        headers.append(("Content-Encoding", "gzip"))
+        headers.append(("Vary", "Accept-Encoding"))
+    return accepts_gzip, headers
+
+
+UI_DIR = os.path.join(os.path.dirname(__file__), "ui")
+
+
+def _gzip_etag(etag):
+    return f'{etag[:-1]}-gz"' if etag.endswith('"') else f"{etag}-gz"
+
+
+def _etag_resources(path):
+    # Detail pages are versioned by what they show, so unrelated writes do not invalidate them: a trace
+    # by its own rows plus bug cases (its top match), a bug case by its own rows plus archiving (its
+    # revisions). Lists and everything else use the global version.
+    for prefix, kind, extra in (("/v1/traces/", "trace", "cases"), ("/v1/bug-cases/", "case", "archive")):
+        if path.startswith(prefix) and path[len(prefix) :].strip():
+            return (kind, path[len(prefix) :].strip()), (extra,)
+    return ()
+
+
+EVENT_STREAM_HEADERS = (
+    ("Content-Type", "text/event-stream; charset=utf-8"),
+    ("Cache-Control", "no-cache"),
+    ("X-Accel-Buffering", "no"),
+)
+
+JOB_PRIORITY_PR_COMMENT = 0
+JOB_PRIORITY_ERROR = 1
+
+
 class TaskRunner:
     def __init__(self):
         self.tasks = {}
         self.lock = threading.Lock()
-        self.queue = queue.Queue()
-        self.store = TraceStore(config.TRACE_DB_PATH)
+        self.instance_id = uuid.uuid4().hex[:8]
+        self.clustered = config.CLUSTER_MODE
+        self.node_id = config.NODE_ID or f"{socket.gethostname()}-{os.getpid()}"
+        self._task_version = 0
+        self.queue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self.events = EventBus(capacity=config.SSE_BUFFER_SIZE)
+        self.store = TraceStore(
+            config.TRACE_DB_PATH,
+            pragmas=sqlite_pragmas(
+                config.SQLITE_PROFILE,
+                synchronous=config.SQLITE_SYNCHRONOUS,
+                cache_size=config.SQLITE_CACHE_SIZE,
+                mmap_size=config.SQLITE_MMAP_SIZE,
+            ),
+            write_mode=config.TRACE_WRITE_MODE,
+            group_commit_ms=config.TRACE_GROUP_COMMIT_MS,
+            max_write_batch=config.TRACE_WRITE_BATCH,
+            flush_on_read=config.TRACE_FLUSH_ON_READ,
+            blob_codec=config.TRACE_BLOB_CODEC,
+            feature_cache_size=config.TRACE_FEATURE_CACHE_SIZE,
+        )
+        self.store.add_listener(self.events.publish)
+        self.admission = AdmissionController(
+            max_queue_depth=config.MAX_ERROR_QUEUE_SIZE,
+            queue_retry_seconds=config.ADMISSION_QUEUE_RETRY_SECONDS,
+            repo_rate=config.ADMISSION_REPO_RATE,
+            repo_burst=config.ADMISSION_REPO_BURST,
+            key_rate=config.ADMISSION_API_KEY_RATE,
+            key_burst=config.ADMISSION_API_KEY_BURST,
+        )
+        self._running = {}
+        self._leases = {}
+        self._stopping = threading.Event()
+        self._cancel = threading.Event()
+        self.metrics = ServerMetrics(
+            queue_depth=self.queue_depth,
+            busy_workers=self.busy_workers,
+            total_workers=lambda: max(1, config.MAX_CONCURRENT_TASKS),
+        )
+        self.store.add_listener(self.metrics.on_store_event)
+        self.router = None
+        if self.clustered and config.AFFINITY_ROUTING:
+            self.router = JobRouter(
+                self.store,
+                node_ttl=config.JOB_LEASE_SECONDS,
+                vnodes=config.AFFINITY_VNODES,
+                load_factor=config.AFFINITY_LOAD_FACTOR,
+            )
+        self.feedback = FeedbackCoalescer(
+            self._flush_feedback,
+            window_seconds=config.PR_COMMENT_COALESCE_SECONDS,
+            max_wait_seconds=config.PR_COMMENT_COALESCE_MAX_SECONDS,
+            on_new=self._feedback_queued,
+        )
+        self.archiver = TraceArchiver(
+            self.store,
+            RetentionPolicy.parse(config.TRACE_RETENTION_DAYS, config.TRACE_RETENTION_RULES),
+            archive_dir=config.TRACE_ARCHIVE_DIR,
+            batch_size=config.TRACE_RETENTION_BATCH,
+        )
         self.workspace = WorkspaceManager()
+        self.recover()
         self._start_workers()
 
-    def submit(self, repo_url, error_content, code_host=None):
-        task_id = str(uuid.uuid4())
-        with self.lock:
-            self.tasks[task_id] = {
-                "task_id": task_id,
-                "status": "QUEUED",
-                "created_at": int(time.time()),
-            }
-        self.queue.put(
+    def submit(self, repo_url, error_content, code_host=None, task_id=None, features=None):
+        task_id = task_id or str(uuid.uuid4())
+        self._update_task(task_id, status="QUEUED", kind="ERROR", created_at=int(time.time()))
+        self._enqueue(
+            JOB_PRIORITY_ERROR,
             {
                 "kind": "ERROR",
                 "task_id": task_id,
                 "repo_url": repo_url,
                 "error_content": error_content,
                 "code_host": code_host,
-            }
+                "features": features,
+            },
         )
         return task_id
 
-    def submit_pr_feedback(self, repo_url, pr_url, pr_number, comment, code_host=None):
-        task_id = str(uuid.uuid4())
-        with self.lock:
-            self.tasks[task_id] = {
-                "task_id": task_id,
-                "status": "QUEUED",
-                "created_at": int(time.time()),
-                "mr_url": pr_url,
-                "pr_number": pr_number,
-            }
-        self.queue.put(
+    def submit_pr_feedback(self, repo_url, pr_url, pr_number, comment, code_host=None, task_id=None):
+        task_id = task_id or str(uuid.uuid4())
+        self._update_task(task_id, status="QUEUED", kind="PR_COMMENT", created_at=int(time.time()), mr_url=pr_url, pr_number=pr_number)
+        self._enqueue(
+            JOB_PRIORITY_PR_COMMENT,
             {
                 "kind": "PR_COMMENT",
                 "task_id": task_id,
@@ -106,23 +285,363 @@ class TaskRunner:
                 "pr_number": pr_number,
                 "comment": comment,
                 "code_host": code_host,
-            }
+            },
         )
         return task_id
 
+    def queue_pr_feedback(self, delivery_key, repo_url, pr_url, pr_number, comment, code_host=None):
+        original = self.replayed_task(delivery_key)
+        if original:
+            return original, True
+
+        # The batch is written as a PENDING job before the webhook is acknowledged, so a restart
+        # inside the coalesce window re-queues it instead of losing it to the claimed delivery key.
+        # Claiming the key in the same transaction also turns away a concurrent redelivery.
+        def persist(batch):
+            return self.store.stage_job(
+                batch["task_id"],
+                "PR_COMMENT",
+                JOB_PRIORITY_PR_COMMENT,
+                self._feedback_job(batch),
+                key=delivery_key,
+                ttl_seconds=config.IDEMPOTENCY_TTL_SECONDS,
+                owner=self.node_id if self.clustered else "",
+            )
+
+        task_id, count = self.feedback.add(repo_url, pr_url, pr_number, comment, code_host=code_host, persist=persist)
+        return task_id, count == 0
+
+    def _feedback_job(self, batch):
+        return {
+            "kind": "PR_COMMENT",
+            "task_id": batch["task_id"],
+            "repo_url": batch["repo_url"],
+            "pr_url": batch["pr_url"],
+            "pr_number": batch["pr_number"],
+            "comment": "\n\n---\n\n".join(batch["comments"]),
+            "code_host": batch["code_host"],
+        }
+
+    def _feedback_queued(self, batch):
+        self._update_task(
+            batch["task_id"],
+            status="QUEUED",
+            kind="PR_COMMENT",
+            created_at=int(time.time()),
+            mr_url=batch["pr_url"],
+            pr_number=batch["pr_number"],
+        )
+
+    def _flush_feedback(self, batch):
+        job = self._feedback_job(batch)
+        try:
+            self.submit_pr_feedback(
+                repo_url=job["repo_url"],
+                pr_url=job["pr_url"],
+                pr_number=job["pr_number"],
+                comment=job["comment"],
+                code_host=job["code_host"],
+                task_id=job["task_id"],
+            )
+        except Exception as e:
+            self._update_task(batch["task_id"], status="FAILED", error=str(e))
+
+    def replayed_task(self, key):
+        if not key:
+            return None
+        return self.store.find_idempotency_key(key)
+
+    def submit_once(self, key, submit, **kwargs):
+        task_id = str(uuid.uuid4())
+        if key:
+            original = self.store.claim_idempotency_key(key, task_id, config.IDEMPOTENCY_TTL_SECONDS)
+            if original != task_id:
+                return original, True
+        try:
+            submit(task_id=task_id, **kwargs)
+        except Exception:
+            if key:
+                self.store.release_idempotency_key(key, task_id)
+            raise
+        return task_id, False
+
+    def _enqueue(self, priority, job, persist=True):
+        if persist:
+            target_node = self.router.route(job["repo_url"]) if self.router else ""
+            self.store.save_job(job["task_id"], job["kind"], priority, job, target_node=target_node)
+        if not self.clustered:
+            self.queue.put((priority, next(self._seq), job))
+
+    def queue_depth(self):
+        if self.clustered:
+            return self.store.count_jobs(("QUEUED", "INTERRUPTED"))
+        return self.queue.qsize()
+
+    def admit(self, repo_url, api_key="", priority=False):
+        if self._stopping.is_set():
+            rejected = ("shutting_down", config.ADMISSION_QUEUE_RETRY_SECONDS)
+        else:
+            rejected = self.admission.check(repo_url, api_key, self.queue_depth(), priority=priority)
+        if rejected:
+            self.metrics.admission_rejected.inc(rejected[0])
+        return rejected
+
+    def busy_workers(self):
+        with self.lock:
+            return len(self._running)
+
+    def recover(self):
+        if self.clustered:
+            # Other nodes may own RUNNING jobs; expired leases are reclaimed in _claim_job instead.
+            return
+        recoverable = config.RECOVER_INTERRUPTED_JOBS
+        # PR comment batches staged before the restart are queued as they are.
+        self.store.promote_pending_jobs()
+        for trace_id in self.store.running_trace_ids():
+            self.store.interrupt_trace(
+                trace_id,
+                message="server stopped while the job was running",
+                unsafe_steps=RETRY_UNSAFE_STEPS,
+                recoverable=recoverable,
+            )
+        for job in self.store.list_jobs(("QUEUED", "RUNNING", "INTERRUPTED")):
+            task_id = job["job_id"]
+            if job["trace_status"] == "DONE":
+                self.store.mark_job(task_id, "DONE")
+                continue
+            retry = job["status"] == "QUEUED" or (
+                recoverable and job["trace_status"] != "FAILED" and job["attempts"] < config.JOB_MAX_ATTEMPTS
+            )
+            if not retry or not job["payload"]:
+                self.store.mark_job(task_id, "FAILED")
+                continue
+            self.store.mark_job(task_id, "QUEUED")
+            self._update_task(
+                task_id,
+                status="QUEUED",
+                kind=job["kind"],
+                created_at=job["created_at"],
+                recovered_from=job["trace_id"] or "",
+            )
+            self._enqueue(job["priority"], job["payload"], persist=False)
+        self.workspace.sweep()
+
+    def shutdown(self, drain_seconds=None, checkpoint_seconds=None):
+        if drain_seconds is None:
+            drain_seconds = config.SHUTDOWN_DRAIN_SECONDS
+        if checkpoint_seconds is None:
+            checkpoint_seconds = config.SHUTDOWN_CHECKPOINT_SECONDS
+        self._stopping.set()
+        self.feedback.close()
+        if self.clustered:
+            self.store.remove_node(self.node_id)
+        if not self._wait_idle(drain_seconds):
+            self._cancel.set()
+            self._wait_idle(checkpoint_seconds)
+        with self.lock:
+            running = dict(self._running)
+        for task_id, trace_id in running.items():
+            if trace_id:
+                self._interrupt(task_id, trace_id, "", "server shut down before the job finished")
+            elif self.clustered:
+                self._mark_job(task_id, "QUEUED")
+        self.store.flush()
+        return not running
+
+    def is_stopping(self):
+        return self._stopping.is_set()
+
+    def _wait_idle(self, timeout):
+        deadline = time.monotonic() + max(float(timeout), 0.0)
+        while self.busy_workers():
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.2)
+        return True
+
+    def _job_started(self, task_id, trace_id):
+        with self.lock:
+            self._running[task_id] = trace_id
+            fence = self._leases.get(task_id)
+        if fence is None:
+            self.store.mark_job(task_id, "RUNNING", trace_id=trace_id)
+        else:
+            self.store.attach_job_trace(task_id, trace_id, fence)
+
+    def _mark_job(self, task_id, status):
+        with self.lock:
+            fence = self._leases.get(task_id)
+        return self.store.mark_job(task_id, status, fence=fence)
+
+    def _fence_check(self, task_id):
+        with self.lock:
+            fence = self._leases.get(task_id)
+        if fence is None:
+            return None
+        return lambda: self.store.job_fence_ok(task_id, fence)
+
+    def _interrupt(self, task_id, trace_id, failure_step, message):
+        status = self.store.interrupt_trace(
+            trace_id,
+            failure_step=failure_step,
+            message=message,
+            unsafe_steps=RETRY_UNSAFE_STEPS,
+            recoverable=config.RECOVER_INTERRUPTED_JOBS,
+        )
+        if status is None:
+            return
+        self._mark_job(task_id, status)
+        self._update_task(task_id, status=status, trace_id=trace_id, error=message)
+
     def get(self, task_id):
         with self.lock:
-            return self.tasks.get(task_id)
+            task = self.tasks.get(task_id)
+        if task is not None:
+            return task
+        job = self.store.get_job(task_id)
+        if not job:
+            return None
+        return {
+            "task_id": task_id,
+            "kind": job["kind"],
+            "status": job["status"],
+            "trace_id": job["trace_id"] or "",
+            "created_at": job["created_at"],
+            "node": job["lease_owner"] or "",
+            "target_node": job["target_node"] or "",
+        }
+
+    def data_version(self, *resources):
+        if resources:
+            version = f"{self.instance_id}-r{self.store.data_version(*resources)}"
+        else:
+            with self.lock:
+                task_version = self._task_version
+            version = f"{self.instance_id}-{self.store.data_version()}-{task_version}"
+        if self.clustered:
+            version = f"{version}-{self.store.db_data_version()}"
+        return version
+
+    def _update_task(self, task_id, **fields):
+        with self.lock:
+            task = self.tasks.setdefault(task_id, {"task_id": task_id})
+            task.update(fields)
+            snapshot = dict(task)
+            self._task_version += 1
+        if fields.get("status") in ("DONE", "FAILED", "INTERRUPTED"):
+            self.metrics.tasks.inc(snapshot.get("kind") or "", fields["status"])
+        self.events.publish("task", snapshot)
 
     def _start_workers(self):
+        target = self._cluster_worker_loop if self.clustered else self._worker_loop
         for _ in range(max(1, config.MAX_CONCURRENT_TASKS)):
-            t = threading.Thread(target=self._worker_loop, daemon=True)
+            t = threading.Thread(target=target, daemon=True)
             t.start()
+        if self.clustered:
+            self.store.heartbeat_node(self.node_id)
+            threading.Thread(target=self._heartbeat_loop, daemon=True).start()
+        if config.TRACE_MAINTENANCE_SECONDS > 0 or self.store.pending_backfills():
+            threading.Thread(target=self._maintenance_loop, daemon=True).start()
 
     def _worker_loop(self):
-        while True:
-            job = self.queue.get()
+        while not self._stopping.is_set():
+            try:
+                _priority, _seq, job = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if self._stopping.is_set():
+                # Still QUEUED in the jobs table; the next start picks it up.
+                break
+            self._execute(job)
+
+    def _cluster_worker_loop(self):
+        while not self._stopping.is_set():
+            job = self._claim_job()
+            if job is None:
+                self._stopping.wait(config.JOB_POLL_SECONDS)
+                continue
+            self._execute(job)
+
+    def _execute(self, job):
+        task_id = job["task_id"]
+        with self.lock:
+            self._running[task_id] = ""
+        try:
             self._run_job(job)
+        finally:
+            with self.lock:
+                self._running.pop(task_id, None)
+                self._leases.pop(task_id, None)
+
+    def _claim_job(self):
+        while True:
+            live_nodes = self.router.live_nodes() if self.router else None
+            claimed = self.store.claim_job(
+                self.node_id,
+                config.JOB_LEASE_SECONDS,
+                live_nodes=live_nodes,
+                steal_after=config.AFFINITY_STEAL_SECONDS,
+            )
+            if not claimed:
+                return None
+            task_id = claimed["job_id"]
+            fence = claimed["fence"]
+            trace_status = claimed["trace_status"]
+            if trace_status == "RUNNING":
+                trace_status = self.store.interrupt_trace(
+                    claimed["trace_id"],
+                    message=f"lease held by {claimed['previous_owner'] or 'unknown'} expired",
+                    unsafe_steps=RETRY_UNSAFE_STEPS,
+                    recoverable=config.RECOVER_INTERRUPTED_JOBS,
+                )
+            if trace_status == "DONE":
+                self.store.mark_job(task_id, "DONE", fence=fence)
+                continue
+            if trace_status == "FAILED" or claimed["attempts"] > config.JOB_MAX_ATTEMPTS or not claimed["payload"]:
+                self.store.mark_job(task_id, "FAILED", fence=fence)
+                continue
+            with self.lock:
+                self._leases[task_id] = fence
+            target_node = claimed["target_node"] or ""
+            self.metrics.jobs_claimed.inc("owner" if target_node == self.node_id else ("stolen" if target_node else "unrouted"))
+            self._update_task(task_id, kind=claimed["kind"], created_at=claimed["created_at"], node=self.node_id)
+            return claimed["payload"]
+
+    def _maintenance_loop(self):
+        # Backfills queued by a schema upgrade start right away; reads work around them until they finish.
+        try:
+            self.store.run_backfills(stop=self._stopping, pause_seconds=self.archiver.pause_seconds)
+        except Exception:
+            pass
+        if config.TRACE_MAINTENANCE_SECONDS <= 0:
+            return
+        while not self._stopping.wait(config.TRACE_MAINTENANCE_SECONDS):
+            try:
+                self.store.run_backfills(stop=self._stopping, pause_seconds=self.archiver.pause_seconds)
+            except Exception:
+                pass
+            try:
+                self.archiver.run(stop=self._stopping)
+            except Exception:
+                pass
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(config.JOB_HEARTBEAT_SECONDS)
+            if not self._stopping.is_set():
+                try:
+                    self.store.heartbeat_node(self.node_id)
+                    # Comment batches staged by a node that died inside the coalesce window.
+                    self.store.promote_pending_jobs(live_owners=self.store.live_nodes(config.JOB_LEASE_SECONDS))
+                except Exception:
+                    pass
+            with self.lock:
+                leases = dict(self._leases)
+            for task_id, fence in leases.items():
+                try:
+                    self.store.renew_job_lease(task_id, self.node_id, fence, config.JOB_LEASE_SECONDS)
+                except Exception:
+                    pass
 
     def _run_job(self, job):
         kind = (job.get("kind") or "ERROR").strip().upper()
@@ -132,9 +651,10 @@ class TaskRunner:
         repo_url = job["repo_url"]
         error_content = job["error_content"]
         code_host = (job.get("code_host") or config.CODE_HOST).strip().lower()
+        excerpt = (error_content or "")[:ERROR_EXCERPT_CHARS]
+        features = trusted_features(job.get("features")) or extract_features(excerpt)
 
-        with self.lock:
-            self.tasks[task_id]["status"] = "RUNNING"
+        self._update_task(task_id, status="RUNNING")
 
         trace_id = self.store.new_trace_id()
         self.store.create_trace(
@@ -142,13 +662,14 @@ class TaskRunner:
             repo_url=repo_url,
             code_host=code_host,
             error_signature=build_error_signature(error_content),
-            error_excerpt=(error_content or "")[:2000],
+            error_excerpt=excerpt,
+            features=features,
         )
 
+        self._job_started(task_id, trace_id)
         ws_root = self.workspace.allocate(repo_url=repo_url, trace_id=trace_id)
         repo_dir = os.path.join(ws_root, "repo")
-        with self.lock:
-            self.tasks[task_id]["workspace_dir"] = ws_root
+        self._update_task(task_id, trace_id=trace_id, workspace_dir=ws_root)
 
         try:
             self.workspace.clone_into(repo_url, repo_dir, code_host=code_host)
@@ -170,19 +691,21 @@ class TaskRunner:
                 repo_root=repo_dir,
                 trace_store=self.store,
                 code_host_name=code_host,
+                cancel_event=self._cancel,
+                fence=self._fence_check(task_id),
             )
-            mr_url = orchestrator.handle_error(error_content, repo_url=repo_url, trace_id=trace_id)
+            mr_url = orchestrator.handle_error(error_content, repo_url=repo_url, trace_id=trace_id, features=features)
 
-            with self.lock:
-                self.tasks[task_id]["status"] = "DONE"
-                self.tasks[task_id]["trace_id"] = trace_id
-                self.tasks[task_id]["mr_url"] = mr_url
+            self._mark_job(task_id, "DONE")
+            self._update_task(task_id, status="DONE", trace_id=trace_id, mr_url=mr_url)
+        except LeaseLost as e:
+            self._update_task(task_id, status="LEASE_LOST", trace_id=trace_id, error=str(e))
+        except JobInterrupted as e:
+            self._interrupt(task_id, trace_id, e.step_name, str(e))
         except Exception as e:
             self.store.finish_trace_fail(trace_id, "RUN_JOB", str(e))
-            with self.lock:
-                self.tasks[task_id]["status"] = "FAILED"
-                self.tasks[task_id]["trace_id"] = trace_id
-                self.tasks[task_id]["error"] = str(e)
+            self._mark_job(task_id, "FAILED")
+            self._update_task(task_id, status="FAILED", trace_id=trace_id, error=str(e))
         finally:
             try:
                 self.workspace.release(ws_root)
@@ -197,8 +720,7 @@ class TaskRunner:
         comment = job.get("comment") or ""
         code_host = (job.get("code_host") or config.CODE_HOST).strip().lower()
 
-        with self.lock:
-            self.tasks[task_id]["status"] = "RUNNING"
+        self._update_task(task_id, status="RUNNING")
 
         trace_id = self.store.new_trace_id()
         self.store.create_trace(
@@ -206,13 +728,13 @@ class TaskRunner:
             repo_url=repo_url,
             code_host=code_host,
             error_signature=build_error_signature(comment),
-            error_excerpt=(comment or "")[:2000],
+            error_excerpt=(comment or "")[:ERROR_EXCERPT_CHARS],
         )
 
+        self._job_started(task_id, trace_id)
         ws_root = self.workspace.allocate(repo_url=repo_url, trace_id=trace_id)
         repo_dir = os.path.join(ws_root, "repo")
-        with self.lock:
-            self.tasks[task_id]["workspace_dir"] = ws_root
+        self._update_task(task_id, trace_id=trace_id, workspace_dir=ws_root)
 
         try:
             self.workspace.clone_into(repo_url, repo_dir, code_host=code_host)
@@ -234,6 +756,8 @@ class TaskRunner:
                 repo_root=repo_dir,
                 trace_store=self.store,
                 code_host_name=code_host,
+                cancel_event=self._cancel,
+                fence=self._fence_check(task_id),
             )
             result = orchestrator.handle_pr_feedback(
                 pr_url=pr_url,
@@ -243,18 +767,23 @@ class TaskRunner:
                 trace_id=trace_id,
             )
 
-            with self.lock:
-                self.tasks[task_id]["status"] = "DONE"
-                self.tasks[task_id]["trace_id"] = trace_id
-                self.tasks[task_id]["mr_url"] = result.get("mr_url") or pr_url
-                self.tasks[task_id]["commit_sha"] = result.get("commit_sha") or ""
-                self.tasks[task_id]["branch"] = result.get("branch") or ""
+            self._mark_job(task_id, "DONE")
+            self._update_task(
+                task_id,
+                status="DONE",
+                trace_id=trace_id,
+                mr_url=result.get("mr_url") or pr_url,
+                commit_sha=result.get("commit_sha") or "",
+                branch=result.get("branch") or "",
+            )
+        except LeaseLost as e:
+            self._update_task(task_id, status="LEASE_LOST", trace_id=trace_id, error=str(e))
+        except JobInterrupted as e:
+            self._interrupt(task_id, trace_id, e.step_name, str(e))
         except Exception as e:
             self.store.finish_trace_fail(trace_id, "RUN_PR_COMMENT_JOB", str(e))
-            with self.lock:
-                self.tasks[task_id]["status"] = "FAILED"
-                self.tasks[task_id]["trace_id"] = trace_id
-                self.tasks[task_id]["error"] = str(e)
+            self._mark_job(task_id, "FAILED")
+            self._update_task(task_id, status="FAILED", trace_id=trace_id, error=str(e))
         finally:
             try:
                 self.workspace.release(ws_root)
@@ -264,6 +793,8 @@ class TaskRunner:
 
 class ApiHandler(BaseHTTPRequestHandler):
     runner = None
+    static_assets = None
+    disable_nagle_algorithm = True
 
     def _get_int_param(self, qs, key, default, minimum=None, maximum=None):
         raw = (qs.get(key) or [None])[0]
@@ -278,25 +809,67 @@ class ApiHandler(BaseHTTPRequestHandler):
         return val
 
     def do_POST(self):
+        self._observed(self._handle_post)
+
+    def do_GET(self):
+        self._observed(self._handle_get)
+
+    def _observed(self, handler):
+        started = time.monotonic()
+        self._status = 0
+        try:
+            handler()
+        finally:
+            if self.runner is not None:
+                route = route_label(urlparse(self.path).path)
+                self.runner.metrics.observe_request(route, self.command, self._status or 500, time.monotonic() - started)
+
+    def send_response(self, code, message=None):
+        self._status = code
+        super().send_response(code, message)
+
+    def _handle_post(self):
         path = urlparse(self.path).path
         if path == "/v1/tasks":
             if not self._check_auth():
                 self._send_json(401, {"error": "unauthorized"})
                 return
             body = self._read_json()
+            key = self._idempotency_key("tasks", body)
+            if key is None:
+                return
+            if self._send_replay("/v1/tasks", key):
+                return
             repo = body.get("repo") or {}
             err = body.get("error") or {}
             repo_url = (body.get("repo_url") or repo.get("repo_url") or "").strip()
             error_content = body.get("error_content") or err.get("raw_excerpt") or ""
             code_host = body.get("code_host") or repo.get("code_host")
+            # Precomputed features decide which cases a trace is matched with, so they are only taken
+            # from callers that proved the API key.
+            trust = config.ACCEPT_CLIENT_FEATURES and bool((config.SERVER_API_KEY or "").strip())
+            # Stored features must describe the stored excerpt, so longer reports only keep them when
+            # the agent extracted them from that same prefix.
+            if len(str(error_content)) > ERROR_EXCERPT_CHARS and err.get("features_chars") != ERROR_EXCERPT_CHARS:
+                trust = False
+            features = trusted_features(err.get("features")) if trust else None
             if not repo_url:
                 self._send_json(400, {"error": "repo_url_required"})
                 return
             if not str(error_content).strip():
                 self._send_json(400, {"error": "error_content_required"})
                 return
-            task_id = self.runner.submit(repo_url, str(error_content), code_host=code_host)
-            self._send_json(200, {"task_id": task_id})
+            if not self._admit(repo_url):
+                return
+            task_id, replayed = self.runner.submit_once(
+                key,
+                self.runner.submit,
+                repo_url=repo_url,
+                error_content=str(error_content),
+                code_host=code_host,
+                features=features,
+            )
+            self._send_task_id("/v1/tasks", task_id, replayed)
             return
 
         if path == "/v1/pr-comments":
@@ -304,6 +877,11 @@ class ApiHandler(BaseHTTPRequestHandler):
                 self._send_json(401, {"error": "unauthorized"})
                 return
             body = self._read_json()
+            key = self._idempotency_key("pr-comments", body)
+            if key is None:
+                return
+            if self._send_replay("/v1/pr-comments", key):
+                return
             repo_url = (body.get("repo_url") or "").strip()
             pr_url = (body.get("pr_url") or "").strip()
             pr_number = body.get("pr_number")
@@ -321,14 +899,18 @@ class ApiHandler(BaseHTTPRequestHandler):
             if not str(comment).strip():
                 self._send_json(400, {"error": "comment_required"})
                 return
-            task_id = self.runner.submit_pr_feedback(
+            if not self._admit(repo_url, priority=True):
+                return
+            task_id, replayed = self.runner.submit_once(
+                key,
+                self.runner.submit_pr_feedback,
                 repo_url=repo_url,
                 pr_url=pr_url,
                 pr_number=int(pr_number),
                 comment=str(comment),
                 code_host=code_host,
             )
-            self._send_json(200, {"task_id": task_id})
+            self._send_task_id("/v1/pr-comments", task_id, replayed)
             return
 
         if path == "/v1/webhooks/github":
@@ -336,33 +918,40 @@ class ApiHandler(BaseHTTPRequestHandler):
             if not self._check_github_webhook(raw):
                 self._send_json(401, {"error": "unauthorized"})
                 return
+            if self.runner.is_stopping():
+                self._send_json(503, {"error": "shutting_down"})
+                return
             body = json.loads((raw or b"{}").decode("utf-8") or "{}")
             event = (self.headers.get("X-GitHub-Event") or "").strip()
             extracted = self._extract_github_pr_comment(event, body)
-            if not extracted:
-                self._send_json(200, {"ok": True, "ignored": True})
+            feedback = self._command_text(extracted[3]) if extracted else ""
+            if not feedback:
+                self._send_webhook_ignored("github")
                 return
-            repo_url, pr_url, pr_number, comment = extracted
-
-            prefix = (config.PR_COMMENT_COMMAND_PREFIX or "").strip()
-            feedback = (comment or "").strip()
-            if prefix:
-                if not feedback.startswith(prefix):
-                    self._send_json(200, {"ok": True, "ignored": True})
-                    return
-                feedback = feedback[len(prefix) :].strip()
-                if not feedback:
-                    self._send_json(200, {"ok": True, "ignored": True})
-                    return
+            repo_url, pr_url, pr_number, _comment = extracted
+            delivery = (self.headers.get("X-GitHub-Delivery") or "").strip()
+            self._queue_feedback("github", delivery, repo_url, pr_url, pr_number, feedback)
+            return
 
-            task_id = self.runner.submit_pr_feedback(
-                repo_url=repo_url,
-                pr_url=pr_url,
-                pr_number=int(pr_number),
-                comment=feedback,
-                code_host="github",
-            )
-            self._send_json(200, {"ok": True, "task_id": task_id})
+        if path == "/v1/webhooks/gitlab":
+            raw = self._read_body_bytes()
+            if not self._check_gitlab_webhook():
+                self._send_json(401, {"error": "unauthorized"})
+                return
+            if self.runner.is_stopping():
+                self._send_json(503, {"error": "shutting_down"})
+                return
+            body = json.loads((raw or b"{}").decode("utf-8") or "{}")
+            event = (self.headers.get("X-Gitlab-Event") or "").strip()
+            extracted = self._extract_gitlab_mr_note(event, body)
+            feedback = self._command_text(extracted[3]) if extracted else ""
+            if not feedback:
+                self._send_webhook_ignored("gitlab")
+                return
+            repo_url, pr_url, pr_number, _comment = extracted
+            note_id = (body.get("object_attributes") or {}).get("id")
+            delivery = (self.headers.get("X-Gitlab-Event-UUID") or "").strip() or (f"note-{note_id}" if note_id else "")
+            self._queue_feedback("gitlab", delivery, repo_url, pr_url, pr_number, feedback)
             return
 
         if path == "/v1/debug/retrieval":
@@ -379,10 +968,46 @@ class ApiHandler(BaseHTTPRequestHandler):
             self._send_json(404, {"error": "not_found"})
             return
 
-    def do_GET(self):
+    def _handle_get(self):
         url = urlparse(self.path)
         path = url.path
-        qs = parse_qs(url.query or "")
+        qs = parse_qs(url.query or "", keep_blank_values=True)
+        self._etag = None
+
+        if path == "/metrics":
+            self._send_metrics()
+            return
+
+        try:
+            export = export_target(path, qs)
+        except ValueError:
+            self._send_json(400, {"error": "invalid_time_range"})
+            return
+        if export:
+            if not self._check_auth():
+                self._send_json(401, {"error": "unauthorized"})
+                return
+            self._send_export(export)
+            return
+
+        stream = _event_stream_target(path, qs)
+        if path.startswith("/v1/") and not stream:
+            self._etag = f'"{self.runner.data_version(*_etag_resources(path))}"'
+            # A gzip tag only stands for this response when the client still accepts gzip.
+            matched = self._match_etag(*((self._etag, _gzip_etag(self._etag)) if self._accepts_gzip() else (self._etag,)))
+            if matched:
+                self.send_response(304)
+                self.send_header("ETag", matched)
+                self.send_header("Vary", "Accept-Encoding")
+                self.end_headers()
+                return
+
+        if stream:
+            if stream["per_trace"] and not self.runner.store.get_trace(stream["trace_id"]):
+                self._send_json(404, {"error": "not_found"})
+                return
+            self._send_event_stream(qs, stream)
+            return
 
         if path.startswith("/v1/tasks/"):
             task_id = path[len("/v1/tasks/") :].strip()
@@ -399,6 +1024,9 @@ class ApiHandler(BaseHTTPRequestHandler):
             repo_url = (qs.get("repo_url") or [""])[0]
             q = (qs.get("q") or [""])[0]
             fmt = (qs.get("format") or [""])[0].strip().lower()
+            if "cursor" in qs:
+                self._send_page(qs, fmt, limit, self.runner.store.page_bug_cases, repo_url=repo_url, q=q)
+                return
             items, total = self.runner.store.query_bug_cases(repo_url=repo_url, q=q, limit=limit, offset=offset)
             if fmt == "array":
                 self._send_json(200, items)
@@ -416,12 +1044,27 @@ class ApiHandler(BaseHTTPRequestHandler):
             self._send_json(200, case)
             return
 
+        if path == "/v1/stats":
+            try:
+                since = _optional_int(qs, "since")
+                until = _optional_int(qs, "until")
+            except ValueError:
+                self._send_json(400, {"error": "invalid_time_range"})
+                return
+            top = self._get_int_param(qs, "top", 20, minimum=0, maximum=200)
+            repo_url = (qs.get("repo_url") or [""])[0]
+            self._send_json(200, self.runner.store.stats(repo_url=repo_url, since=since, until=until, top_signatures=top))
+            return
+
         if path == "/v1/traces":
             limit = self._get_int_param(qs, "limit", 50, minimum=1, maximum=200)
             offset = self._get_int_param(qs, "offset", 0, minimum=0)
             repo_url = (qs.get("repo_url") or [""])[0]
             status = (qs.get("status") or [""])[0]
             fmt = (qs.get("format") or [""])[0].strip().lower()
+            if "cursor" in qs:
+                self._send_page(qs, fmt, limit, self.runner.store.page_traces, repo_url=repo_url, status=status)
+                return
             items, total = self.runner.store.query_traces(repo_url=repo_url, status=status, limit=limit, offset=offset)
             if fmt == "array":
                 self._send_json(200, items)
@@ -436,53 +1079,132 @@ class ApiHandler(BaseHTTPRequestHandler):
                 self._send_json(404, {"error": "not_found"})
                 return
             steps = self.runner.store.list_steps(trace_id)
-            top_matches = self.runner.store.search_similar_cases(trace.get("repo_url") or "", trace.get("error_excerpt") or "", limit=1)
+            top_matches = self.runner.store.get_trace_matches(trace, limit=1)
             self._send_json(200, {"trace": trace, "steps": steps, "top_match": (top_matches[0] if top_matches else None)})
             return
 
         # Static UI Serving
-        ui_dir = os.path.join(os.path.dirname(__file__), "ui")
         if path == "/":
             path = "/index.html"
-
-        file_path = os.path.join(ui_dir, path.lstrip("/"))
-        if os.path.exists(file_path) and os.path.isfile(file_path):
-            # Security: ensure file is inside ui_dir
-            if os.path.abspath(file_path).startswith(os.path.abspath(ui_dir)):
-                self._send_file(file_path)
-                return
-
+        assets = self._static_assets()
+        asset = assets.get(path)
         # Fallback for SPA
-        index_path = os.path.join(ui_dir, "index.html")
-        if not path.startswith("/v1/") and os.path.exists(index_path):
-            self._send_file(index_path)
+        if asset is None and not path.startswith("/v1/"):
+            asset = assets.get("/index.html")
+        if asset is not None:
+            self._send_asset(asset)
             return
 
         self._send_json(404, {"error": "not_found"})
 
-    def _send_file(self, file_path):
-        content_type = "text/plain"
-        if file_path.endswith(".html"):
-            content_type = "text/html"
-        elif file_path.endswith(".js"):
-            content_type = "application/javascript"
-        elif file_path.endswith(".css"):
-            content_type = "text/css"
-        elif file_path.endswith(".png"):
-            content_type = "image/png"
-        elif file_path.endswith(".svg"):
-            content_type = "image/svg+xml"
+    def _send_page(self, qs, fmt, limit, fetch, **filters):
+        cursor = (qs.get("cursor") or [""])[0].strip()
+        total = (qs.get("total") or ["approx"])[0].strip().lower()
+        if total not in ("exact", "approx", "none"):
+            total = "approx"
+        try:
+            page = fetch(limit=limit, cursor=cursor or None, total=total, **filters)
+        except ValueError:
+            self._send_json(400, {"error": "invalid_cursor"})
+            return
+        if fmt == "array":
+            self._send_json(200, page["items"])
+            return
+        self._send_json(200, {"items": page["items"], "total": page["total"], "limit": limit, "next_cursor": page["next_cursor"]})
+
+    def _send_metrics(self):
+        data = self.runner.metrics.render()
+        self.send_response(200)
+        self.send_header("Content-Type", METRICS_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(data)
 
+    def _send_export(self, export):
+        transparent, headers = _export_headers(export, self._accepts_gzip())
+        self.protocol_version = "HTTP/1.1"
+        self.send_response(200)
+        for key, value in headers:
+            self.send_header(key, value)
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        rows = iter_export_rows(self.runner.store, export, batch_size=config.EXPORT_BATCH_SIZE)
         try:
-            with open(file_path, "rb") as f:
-                data = f.read()
-                self.send_response(200)
-                self.send_header("Content-Type", content_type)
-                self.send_header("Content-Length", str(len(data)))
-                self.end_headers()
-                self.wfile.write(data)
-        except Exception:
-            self._send_json(500, {"error": "internal_server_error"})
+            for chunk in iter_ndjson_chunks(rows, compress=export["gzip"] or transparent):
+                self.wfile.write(frame_chunk(chunk))
+            self.wfile.write(LAST_CHUNK)
+        except (BrokenPipeError, ConnectionResetError):
+            return
+        finally:
+            rows.close()
+
+    def _send_event_stream(self, qs, stream):
+        bus = self.runner.events
+        last_id = parse_last_event_id(self.headers, qs)
+        task_id = stream["task_id"]
+        task_trace_id = ((self.runner.get(task_id) or {}).get("trace_id") or "") if task_id else ""
+        stream_filter = EventStreamFilter(trace_id=stream["trace_id"], task_id=task_id, task_trace_id=task_trace_id)
+
+        self.send_response(200)
+        for key, value in EVENT_STREAM_HEADERS:
+            self.send_header(key, value)
+        self.end_headers()
+
+        try:
+            frames, last_id, done = _stream_opening(self.runner, stream, last_id)
+            for frame in frames:
+                self._write_chunk(frame)
+            if done:
+                return
+            while True:
+                events = bus.wait(last_id, timeout=config.SSE_HEARTBEAT_SECONDS)
+                if not events:
+                    self._write_chunk(KEEPALIVE_FRAME)
+                    continue
+                finished = False
+                for event in events:
+                    last_id = event["id"]
+                    if not stream_filter.accept(event):
+                        continue
+                    self._write_chunk(format_event(event["id"], event["event"], event["data"]))
+                    finished = finished or stream_filter.is_terminal(event)
+                if finished:
+                    return
+        except (BrokenPipeError, ConnectionResetError):
+            return
+
+    def _write_chunk(self, data):
+        self.wfile.write(data)
+        self.wfile.flush()
+
+    @classmethod
+    def _static_assets(cls):
+        if cls.static_assets is None:
+            cls.static_assets = StaticAssetCache(UI_DIR, reload=config.STATIC_RELOAD, max_age=config.STATIC_MAX_AGE_SECONDS)
+        return cls.static_assets
+
+    def _send_asset(self, asset):
+        encoding, data, etag = asset.select(self.headers.get("Accept-Encoding"))
+        # Only the variant this request would be served counts; a tag for another encoding gets a 200.
+        if self._match_etag(etag):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", asset.cache_control)
+            self.send_header("Vary", "Accept-Encoding")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", asset.content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Cache-Control", asset.cache_control)
+        self.send_header("ETag", etag)
+        self.send_header("Vary", "Accept-Encoding")
+        if encoding != "identity":
+            self.send_header("Content-Encoding", encoding)
+        self.end_headers()
+        self.wfile.write(data)
 
     def _read_body_bytes(self):
         length = int(self.headers.get("Content-Length", "0"))
@@ -492,12 +1214,38 @@ class ApiHandler(BaseHTTPRequestHandler):
         raw = self._read_body_bytes() or b"{}"
         return json.loads(raw.decode("utf-8"))
 
-    def _check_auth(self):
-        expected = (config.SERVER_API_KEY or "").strip()
-        if not expected:
+    def _idempotency_key(self, scope, body):
+        key = (self.headers.get("Idempotency-Key") or "").strip() or str(body.get("event_id") or "").strip()
+        if len(key) > 255:
+            self._send_json(400, {"error": "idempotency_key_too_long"})
+            return None
+        return f"{scope}:{key}" if key else ""
+
+    def _send_replay(self, route, key):
+        task_id = self.runner.replayed_task(key)
+        if not task_id:
+            return False
+        self._send_task_id(route, task_id, True)
+        return True
+
+    def _send_task_id(self, route, task_id, replayed):
+        if not replayed:
+            self._send_json(200, {"task_id": task_id})
+            return
+        self.runner.metrics.idempotent_replays.inc(route)
+        self._send_json(200, {"task_id": task_id, "replayed": True}, headers={"Idempotent-Replayed": "true"})
+
+    def _admit(self, repo_url, priority=False):
+        api_key = (self.headers.get("X-API-Key") or "").strip()
+        rejected = self.runner.admit(repo_url, api_key=api_key, priority=priority)
+        if not rejected:
             return True
-        actual = (self.headers.get("X-API-Key") or "").strip()
-        return actual == expected
+        reason, retry_after = rejected
+        self._send_json(503 if reason == "shutting_down" else 429, {"error": reason, "retry_after": retry_after}, headers={"Retry-After": str(retry_after)})
+        return False
+
+    def _check_auth(self):
+        return _api_key_ok(self.headers)
 
     def _check_github_webhook(self, raw_body):
         secret = (config.GITHUB_WEBHOOK_SECRET or "").encode("utf-8")
@@ -510,6 +1258,53 @@ class ApiHandler(BaseHTTPRequestHandler):
         actual = sig[len("sha256=") :]
         return hmac.compare_digest(expected, actual)
 
+    def _command_text(self, comment):
+        prefix = (config.PR_COMMENT_COMMAND_PREFIX or "").strip()
+        feedback = (comment or "").strip()
+        if prefix:
+            if not feedback.startswith(prefix):
+                return ""
+            feedback = feedback[len(prefix) :].strip()
+        return feedback
+
+    def _send_webhook_ignored(self, source):
+        self.runner.metrics.webhook_deliveries.inc(source, "ignored")
+        self._send_json(200, {"ok": True, "ignored": True})
+
+    def _queue_feedback(self, source, delivery, repo_url, pr_url, pr_number, comment):
+        key = f"{source}-delivery:{delivery[:255]}" if delivery else ""
+        task_id, duplicate = self.runner.queue_pr_feedback(key, repo_url, pr_url, int(pr_number), comment, code_host=source)
+        self.runner.metrics.webhook_deliveries.inc(source, "duplicate" if duplicate else "queued")
+        if duplicate:
+            self._send_json(200, {"ok": True, "task_id": task_id, "duplicate": True})
+            return
+        self._send_json(202, {"ok": True, "task_id": task_id})
+
+    def _check_gitlab_webhook(self):
+        token = (config.GITLAB_WEBHOOK_TOKEN or "").encode("utf-8")
+        if not token:
+            return True
+        actual = (self.headers.get("X-Gitlab-Token") or "").strip().encode("utf-8")
+        return hmac.compare_digest(token, actual)
+
+    def _extract_gitlab_mr_note(self, event, payload):
+        if event != "Note Hook" or payload.get("object_kind") != "note":
+            return None
+        note = payload.get("object_attributes") or {}
+        if note.get("noteable_type") != "MergeRequest" or note.get("system"):
+            return None
+        project = payload.get("project") or {}
+        repo_url = (project.get("git_http_url") or (payload.get("repository") or {}).get("git_http_url") or "").strip()
+        if not repo_url:
+            return None
+        mr = payload.get("merge_request") or {}
+        pr_number = mr.get("iid")
+        pr_url = (mr.get("url") or "").strip()
+        comment = (note.get("note") or "").strip()
+        if not pr_url or pr_number is None or not comment:
+            return None
+        return repo_url, pr_url, pr_number, comment
+
     def _extract_github_pr_comment(self, event, payload):
         repo = (payload.get("repository") or {})
         repo_url = (repo.get("clone_url") or "").strip()
@@ -548,11 +1343,38 @@ class ApiHandler(BaseHTTPRequestHandler):
 
         return None
 
-    def _send_json(self, code, payload):
+    def _match_etag(self, *etags):
+        header = (self.headers.get("If-None-Match") or "").strip()
+        if not header:
+            return None
+        if header == "*":
+            return etags[0]
+        candidates = [t.strip() for t in header.split(",") if t.strip()]
+        for candidate in etags:
+            if candidate in candidates:
+                return candidate
+        return None
+
+    def _accepts_gzip(self):
+        return "gzip" in accepted_encodings(self.headers.get("Accept-Encoding"))
+
+    def _send_json(self, code, payload, headers=None):
         data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        etag = getattr(self, "_etag", None) if code == 200 else None
+        encoded = len(data) >= config.GZIP_MIN_BYTES and self._accepts_gzip()
+        if encoded:
+            data = gzip.compress(data, compresslevel=5)
+            etag = _gzip_etag(etag) if etag else None
         self.send_response(code)
         self.send_header("Content-Type", "application/json; charset=utf-8")
         self.send_header("Content-Length", str(len(data)))
+        self.send_header("Vary", "Accept-Encoding")
+        if encoded:
+            self.send_header("Content-Encoding", "gzip")
+        if etag:
+            self.send_header("ETag", etag)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
         self.end_headers()
         self.wfile.write(data)
 
@@ -563,8 +1385,32 @@ class ApiHandler(BaseHTTPRequestHandler):
 def serve():
     runner = TaskRunner()
     ApiHandler.runner = runner
+    ApiHandler.static_assets = StaticAssetCache(UI_DIR, reload=config.STATIC_RELOAD, max_age=config.STATIC_MAX_AGE_SECONDS)
+    if config.HTTP_SERVER_MODE == "asyncio":
+        from ai_ops.server.async_server import serve_async
+
+        serve_async(runner)
+        return
     server = ThreadingHTTPServer((config.HTTP_HOST, config.HTTP_PORT), ApiHandler)
-    server.serve_forever()
+
+    def drain_and_stop():
+        runner.shutdown()
+        server.shutdown()
+
+    def on_sigterm(_signum, _frame):
+        if not runner.is_stopping():
+            threading.Thread(target=drain_and_stop, daemon=True).start()
+
+    try:
+        signal.signal(signal.SIGTERM, on_sigterm)
+    except ValueError:
+        pass
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        runner.shutdown()
+    finally:
+        server.server_close()
 
 
 if __name__ == "__main__":
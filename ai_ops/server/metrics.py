@@ -0,0 +1,206 @@
+import bisect
+import threading
+
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STEP_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+
+KNOWN_ROUTES = ("tasks", "traces", "bug-cases", "events", "pr-comments", "stats")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *labels, amount=1.0):
+        key = tuple(str(v) for v in labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [(self.name, _labels(self.label_names, key), value) for key, value in items]
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labels=(), func=None):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self.func = func
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def set(self, value, *labels):
+        key = tuple(str(v) for v in labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, *labels, amount=1.0):
+        key = tuple(str(v) for v in labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, *labels, amount=1.0):
+        self.inc(*labels, amount=-amount)
+
+    def samples(self):
+        if self.func is not None:
+            try:
+                return [(self.name, "", float(self.func()))]
+            except Exception:
+                return []
+        with self._lock:
+            items = sorted(self._values.items())
+        return [(self.name, _labels(self.label_names, key), value) for key, value in items]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=REQUEST_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def observe(self, value, *labels):
+        key = tuple(str(v) for v in labels)
+        value = max(float(value), 0.0)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, (list(s[0]), s[1], s[2])) for key, s in self._values.items())
+        out = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                out.append((f"{self.name}_bucket", _labels(self.label_names, key, [("le", _number(bound))]), cumulative))
+            out.append((f"{self.name}_bucket", _labels(self.label_names, key, [("le", "+Inf")]), count))
+            out.append((f"{self.name}_sum", _labels(self.label_names, key), total))
+            out.append((f"{self.name}_count", _labels(self.label_names, key), count))
+        return out
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_number(value)}")
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class ServerMetrics:
+    def __init__(self, queue_depth=None, busy_workers=None, total_workers=None):
+        self.registry = MetricsRegistry()
+        r = self.registry
+        self.requests = r.register(Counter("ai_ops_http_requests_total", "HTTP requests by route, method and status.", ("route", "method", "status")))
+        self.request_seconds = r.register(
+            Histogram("ai_ops_http_request_duration_seconds", "HTTP request latency by route.", ("route", "method"), REQUEST_BUCKETS)
+        )
+        self.queue_depth = r.register(Gauge("ai_ops_task_queue_depth", "Jobs waiting in the task queue.", func=queue_depth))
+        self.busy_workers = r.register(Gauge("ai_ops_workers_busy", "Workers currently running a job.", func=busy_workers))
+        self.total_workers = r.register(Gauge("ai_ops_workers_total", "Configured task workers.", func=total_workers))
+        self.tasks = r.register(Counter("ai_ops_tasks_total", "Finished tasks by kind and outcome.", ("kind", "status")))
+        self.jobs_claimed = r.register(Counter("ai_ops_jobs_claimed_total", "Clustered job claims by routing outcome.", ("affinity",)))
+        self.idempotent_replays = r.register(
+            Counter("ai_ops_idempotent_replays_total", "Submissions answered with an earlier task_id.", ("route",))
+        )
+        self.webhook_deliveries = r.register(
+            Counter("ai_ops_webhook_deliveries_total", "Code-host webhook deliveries by source and outcome.", ("source", "outcome"))
+        )
+        self.admission_rejected = r.register(Counter("ai_ops_admission_rejected_total", "Requests rejected by admission control.", ("reason",)))
+        self.traces = r.register(Counter("ai_ops_traces_finished_total", "Finished traces by status and failure step.", ("status", "failure_step")))
+        self.step_seconds = r.register(
+            Histogram("ai_ops_step_duration_seconds", "Orchestrator step latency by step and outcome.", ("step", "status"), STEP_BUCKETS)
+        )
+
+    def observe_request(self, route, method, status, seconds):
+        self.requests.inc(route, method, status)
+        self.request_seconds.observe(seconds, route, method)
+
+    def on_store_event(self, event_type, data):
+        if event_type == "step_finished" and data.get("duration") is not None:
+            self.step_seconds.observe(data["duration"], data.get("step_name") or "", data.get("status") or "")
+        elif event_type == "trace_finished":
+            self.traces.inc(data.get("status") or "", data.get("failure_step") or "")
+
+    def render(self):
+        return self.registry.render()
+
+
+def route_label(path):
+    path = path or "/"
+    if path == "/metrics":
+        return path
+    if not path.startswith("/v1/"):
+        return "static"
+    parts = [p for p in path.split("/") if p]
+    if len(parts) >= 3 and parts[1] in ("tasks", "traces", "bug-cases"):
+        if parts[1] == "traces" and len(parts) >= 4 and parts[3] == "events":
+            return "/v1/traces/{id}/events"
+        return f"/v1/{parts[1]}/{{id}}"
+    if len(parts) >= 3 and parts[1] == "export":
+        kind = parts[2]
+        if kind.endswith(".ndjson"):
+            kind = kind[: -len(".ndjson")]
+        return f"/v1/export/{kind}" if kind in ("traces", "steps", "bug-cases") else "other"
+    if len(parts) >= 3 and parts[1] == "webhooks" and parts[2] in ("github", "gitlab"):
+        return f"/v1/webhooks/{parts[2]}"
+    if parts[1:] == ["debug", "retrieval"]:
+        return "/v1/debug/retrieval"
+    if len(parts) == 2 and parts[1] in KNOWN_ROUTES:
+        return f"/v1/{parts[1]}"
+    return "other"
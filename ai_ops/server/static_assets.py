@@ -0,0 +1,138 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+import time
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+MIME_TYPES = {
+    ".html": "text/html; charset=utf-8",
+    ".js": "application/javascript; charset=utf-8",
+    ".mjs": "application/javascript; charset=utf-8",
+    ".css": "text/css; charset=utf-8",
+    ".json": "application/json; charset=utf-8",
+    ".map": "application/json; charset=utf-8",
+    ".txt": "text/plain; charset=utf-8",
+    ".svg": "image/svg+xml",
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".gif": "image/gif",
+    ".ico": "image/x-icon",
+    ".webp": "image/webp",
+    ".woff": "font/woff",
+    ".woff2": "font/woff2",
+}
+
+COMPRESSIBLE_PREFIXES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+
+
+class StaticAsset:
+    def __init__(self, rel_path, data, mtime, max_age):
+        ext = os.path.splitext(rel_path)[1].lower()
+        self.rel_path = rel_path
+        self.mtime = mtime
+        self.content_type = MIME_TYPES.get(ext) or mimetypes.guess_type(rel_path)[0] or "application/octet-stream"
+        digest = hashlib.sha256(data).hexdigest()[:16]
+        self.variants = {"identity": (data, f'"{digest}"')}
+        if self.content_type.startswith(COMPRESSIBLE_PREFIXES):
+            gz = gzip.compress(data, compresslevel=9, mtime=0)
+            if len(gz) < len(data):
+                self.variants["gzip"] = (gz, f'"{digest}-gz"')
+            if brotli is not None:
+                br = brotli.compress(data, quality=11)
+                if len(br) < len(data):
+                    self.variants["br"] = (br, f'"{digest}-br"')
+        if ext == ".html":
+            self.cache_control = "no-cache"
+        else:
+            self.cache_control = f"public, max-age={int(max_age)}"
+
+    def etags(self):
+        return [etag for _data, etag in self.variants.values()]
+
+    def select(self, accept_encoding):
+        accepted = accepted_encodings(accept_encoding)
+        for encoding in ("br", "gzip"):
+            if encoding in self.variants and encoding in accepted:
+                data, etag = self.variants[encoding]
+                return encoding, data, etag
+        data, etag = self.variants["identity"]
+        return "identity", data, etag
+
+
+class StaticAssetCache:
+    def __init__(self, root, reload=False, max_age=300, reload_interval=1.0):
+        self.root = os.path.abspath(root)
+        self.reload = bool(reload)
+        self.max_age = int(max_age)
+        self.reload_interval = float(reload_interval)
+        self._lock = threading.Lock()
+        self._assets = {}
+        self._checked_at = 0.0
+        self.load()
+
+    def load(self):
+        assets = {}
+        for dirpath, _dirnames, filenames in os.walk(self.root):
+            for name in filenames:
+                abs_path = os.path.join(dirpath, name)
+                rel_path = os.path.relpath(abs_path, self.root).replace(os.sep, "/")
+                try:
+                    mtime = os.path.getmtime(abs_path)
+                    with open(abs_path, "rb") as f:
+                        data = f.read()
+                except OSError:
+                    continue
+                assets[rel_path] = StaticAsset(rel_path, data, mtime, self.max_age)
+        with self._lock:
+            self._assets = assets
+            self._checked_at = time.monotonic()
+
+    def get(self, url_path):
+        rel_path = (url_path or "").lstrip("/")
+        if self.reload:
+            self._maybe_reload()
+        with self._lock:
+            return self._assets.get(rel_path)
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._checked_at < self.reload_interval:
+                return
+            self._checked_at = now
+            known = {rel: asset.mtime for rel, asset in self._assets.items()}
+        current = {}
+        for dirpath, _dirnames, filenames in os.walk(self.root):
+            for name in filenames:
+                abs_path = os.path.join(dirpath, name)
+                try:
+                    current[os.path.relpath(abs_path, self.root).replace(os.sep, "/")] = os.path.getmtime(abs_path)
+                except OSError:
+                    continue
+        if current != known:
+            self.load()
+
+
+def accepted_encodings(header):
+    accepted = set()
+    for part in (header or "").split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = params.replace(" ", "").lower()
+        if q.startswith("q=") and q[2:] in ("0", "0.0", "0.00", "0.000"):
+            continue
+        if token == "*":
+            accepted.update(("br", "gzip"))
+        else:
+            accepted.add(token)
+    return accepted
@@ -9,23 +9,26 @@ const App = () => {
     const [selectedCase, setSelectedCase] = useState(null);
     const [cases, setCases] = useState([]);
     const [traces, setTraces] = useState([]);
-    const [casePaging, setCasePaging] = useState({ limit: 50, offset: 0, total: 0 });
-    const [tracePaging, setTracePaging] = useState({ limit: 50, offset: 0, total: 0 });
+    const [casePaging, setCasePaging] = useState({ limit: 50, cursor: '', history: [], nextCursor: null, total: 0 });
+    const [tracePaging, setTracePaging] = useState({ limit: 50, cursor: '', history: [], nextCursor: null, total: 0 });
+
+    const nextPage = (p) => p.nextCursor ? { ...p, history: [...p.history, p.cursor], cursor: p.nextCursor } : p;
+    const prevPage = (p) => p.history.length ? { ...p, cursor: p.history[p.history.length - 1], history: p.history.slice(0, -1) } : p;
 
     const fetchCases = async () => {
         try {
             const params = new URLSearchParams();
             params.set('limit', casePaging.limit);
-            params.set('offset', casePaging.offset);
+            params.set('cursor', casePaging.cursor);
             if (searchQuery.trim()) params.set('q', searchQuery.trim());
             const res = await fetch(`/v1/bug-cases?${params.toString()}`);
             const data = await res.json();
             const items = Array.isArray(data) ? data : (data.items || []);
             setCases(items);
             if (!Array.isArray(data)) {
-                setCasePaging(p => ({ ...p, limit: data.limit || p.limit, offset: data.offset || p.offset, total: data.total || 0 }));
+                setCasePaging(p => ({ ...p, limit: data.limit || p.limit, nextCursor: data.next_cursor || null, total: data.total || 0 }));
             } else {
-                setCasePaging(p => ({ ...p, offset: 0, total: items.length }));
+                setCasePaging(p => ({ ...p, nextCursor: null, total: items.length }));
             }
         } catch (e) {
             console.error('Error fetching cases:', e);
@@ -37,15 +40,15 @@ const App = () => {
         try {
             const params = new URLSearchParams();
             params.set('limit', tracePaging.limit);
-            params.set('offset', tracePaging.offset);
+            params.set('cursor', tracePaging.cursor);
             const res = await fetch(`/v1/traces?${params.toString()}`);
             const data = await res.json();
             const items = Array.isArray(data) ? data : (data.items || []);
             setTraces(items.map(t => ({ ...t, showDetail: false })));
             if (!Array.isArray(data)) {
-                setTracePaging(p => ({ ...p, limit: data.limit || p.limit, offset: data.offset || p.offset, total: data.total || 0 }));
+                setTracePaging(p => ({ ...p, limit: data.limit || p.limit, nextCursor: data.next_cursor || null, total: data.total || 0 }));
             } else {
-                setTracePaging(p => ({ ...p, offset: 0, total: items.length }));
+                setTracePaging(p => ({ ...p, nextCursor: null, total: items.length }));
             }
         } catch (e) {
             console.error('Error fetching traces:', e);
@@ -66,14 +69,14 @@ const App = () => {
 
     useEffect(() => {
         if (view === 'library') fetchCases();
-    }, [view, casePaging.offset, searchQuery]);
+    }, [view, casePaging.cursor, searchQuery]);
 
     useEffect(() => {
         if (view === 'history') fetchTraces();
-    }, [view, tracePaging.offset]);
+    }, [view, tracePaging.cursor]);
 
     useEffect(() => {
-        if (view === 'library') setCasePaging(p => ({ ...p, offset: 0 }));
+        if (view === 'library') setCasePaging(p => ({ ...p, cursor: '', history: [], nextCursor: null }));
     }, [searchQuery]);
 
     const formatDate = (ts) => {
@@ -182,15 +185,15 @@ const App = () => {
                         <div className="action-btns" style={{ marginTop: '1.25rem', justifyContent: 'flex-end' }}>
                             <button
                                 className="btn-outline"
-                                onClick={() => setCasePaging(p => ({ ...p, offset: Math.max(0, p.offset - p.limit) }))}
-                                disabled={casePaging.offset <= 0}
+                                onClick={() => setCasePaging(prevPage)}
+                                disabled={casePaging.history.length === 0}
                             >
                                 Prev
                             </button>
                             <button
                                 className="btn-outline"
-                                onClick={() => setCasePaging(p => ({ ...p, offset: p.offset + p.limit }))}
-                                disabled={casePaging.total > 0 ? (casePaging.offset + casePaging.limit) >= casePaging.total : cases.length < casePaging.limit}
+                                onClick={() => setCasePaging(nextPage)}
+                                disabled={!casePaging.nextCursor}
                             >
                                 Next
                             </button>
@@ -285,15 +288,15 @@ const App = () => {
                         <div className="action-btns" style={{ marginTop: '1.25rem', justifyContent: 'flex-end' }}>
                             <button
                                 className="btn-outline"
-                                onClick={() => setTracePaging(p => ({ ...p, offset: Math.max(0, p.offset - p.limit) }))}
-                                disabled={tracePaging.offset <= 0}
+                                onClick={() => setTracePaging(prevPage)}
+                                disabled={tracePaging.history.length === 0}
                             >
                                 Prev
                             </button>
                             <button
                                 className="btn-outline"
-                                onClick={() => setTracePaging(p => ({ ...p, offset: p.offset + p.limit }))}
-                                disabled={tracePaging.total > 0 ? (tracePaging.offset + tracePaging.limit) >= tracePaging.total : traces.length < tracePaging.limit}
+                                onClick={() => setTracePaging(nextPage)}
+                                disabled={!tracePaging.nextCursor}
                             >
                                 Next
                             </button>
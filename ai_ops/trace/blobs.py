@@ -0,0 +1,95 @@
+import hashlib
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+BLOB_CODECS = ("zstd", "zlib", "none")
+
+# Large bug_case_revisions text columns; each has a "<field>_blob" column holding the blob key.
+REVISION_BLOB_FIELDS = ("trigger_text", "pr_body", "changed_files_json", "diff_text")
+
+# Text shorter than this stays inline: a blob row plus its index entry would cost more than it saves.
+BLOB_MIN_BYTES = 512
+
+
+def resolve_codec(codec="auto"):
+    codec = (codec or "auto").strip().lower()
+    if codec == "auto":
+        return "zstd" if zstandard is not None else "zlib"
+    if codec not in BLOB_CODECS:
+        raise ValueError(f"invalid blob codec: {codec}")
+    if codec == "zstd" and zstandard is None:
+        raise ValueError("blob codec zstd requires the zstandard package")
+    return codec
+
+
+def blob_key(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def encode_blob(text, codec):
+    data = (text or "").encode("utf-8", errors="replace")
+    if codec == "zstd":
+        payload = zstandard.ZstdCompressor(level=6).compress(data)
+    elif codec == "zlib":
+        payload = zlib.compress(data, 6)
+    else:
+        payload = data
+    if len(payload) >= len(data):
+        codec, payload = "none", data
+    return blob_key(data), codec, len(data), payload
+
+
+def decode_blob(codec, payload):
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("blob stored with zstd but the zstandard package is not installed")
+        data = zstandard.ZstdDecompressor().decompress(payload)
+    elif codec == "zlib":
+        data = zlib.decompress(payload)
+    else:
+        data = bytes(payload)
+    return data.decode("utf-8", errors="replace")
+
+
+def prepare_text(text, codec):
+    # Split a value into (inline text, encoded blob); compression runs before any write lock is taken.
+    text = text or ""
+    if len(text.encode("utf-8", errors="replace")) < BLOB_MIN_BYTES:
+        return text, None
+    return "", encode_blob(text, codec)
+
+
+def put_blob(conn, encoded):
+    key, codec, size, payload = encoded
+    conn.execute(
+        """
+        INSERT INTO blobs(key, codec, size, data, refcount, created_at) VALUES(?, ?, ?, ?, 1, ?)
+        ON CONFLICT(key) DO UPDATE SET refcount=refcount+1
+        """,
+        (key, codec, size, payload, int(time.time())),
+    )
+    return key
+
+
+def release_blob(conn, key):
+    if not key:
+        return
+    conn.execute("UPDATE blobs SET refcount=refcount-1 WHERE key=?", (key,))
+    conn.execute("DELETE FROM blobs WHERE key=? AND refcount<=0", (key,))
+
+
+def load_blobs(conn, keys):
+    keys = sorted({k for k in keys if k})
+    out = {}
+    for i in range(0, len(keys), 500):
+        chunk = keys[i : i + 500]
+        marks = ",".join("?" for _ in chunk)
+        for key, codec, data in conn.execute(f"SELECT key, codec, data FROM blobs WHERE key IN ({marks})", chunk):
+            out[key] = decode_blob(codec, data)
+    return out
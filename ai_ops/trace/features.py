@@ -0,0 +1,139 @@
+import hashlib
+import os
+import re
+
+
+FEATURES_VERSION = 1
+ERROR_EXCERPT_CHARS = 2000
+
+FEATURE_FIELDS = ("exception_type", "message_key", "top_frames", "signature", "normalized_query")
+FEATURE_LIMITS = {"exception_type": 200, "message_key": 160, "top_frames": 2000, "signature": 64, "normalized_query": 500}
+
+
+def extract_features(text):
+    raw = text or ""
+    normalized = normalize_text(raw)
+    exception_type, message = _extract_exception_line(normalized)
+    message_key = _message_key(message)
+    frames = _extract_frames(raw)
+    top_frames = " | ".join(frames[:5])
+    fingerprint = " ".join(frames[:8])
+    signature_base = f"{exception_type}\n{message_key}\n{fingerprint}".strip()
+    signature = hashlib.sha256(signature_base.encode("utf-8", errors="ignore")).hexdigest() if signature_base else ""
+    normalized_query = _normalize_query_text(exception_type, message_key, frames)
+    if not normalized_query:
+        normalized_query = re.sub(r"\s+", " ", normalized).strip()[:500]
+    if not signature and normalized_query:
+        signature = hashlib.sha256(normalized_query.encode("utf-8", errors="ignore")).hexdigest()
+    return {
+        "version": FEATURES_VERSION,
+        "exception_type": exception_type,
+        "message_key": message_key,
+        "top_frames": top_frames,
+        "signature": signature,
+        "normalized_query": normalized_query,
+    }
+
+
+def trusted_features(value):
+    if not isinstance(value, dict) or value.get("version") != FEATURES_VERSION:
+        return None
+    out = {"version": FEATURES_VERSION}
+    for field in FEATURE_FIELDS:
+        item = value.get(field, "")
+        if not isinstance(item, str) or len(item) > FEATURE_LIMITS[field]:
+            return None
+        out[field] = item
+    if out["signature"] and not re.fullmatch(r"[0-9a-f]{64}", out["signature"]):
+        return None
+    if not out["signature"] and not out["normalized_query"]:
+        return None
+    return out
+
+
+def normalize_text(text):
+    s = text or ""
+    s = s.replace("\r\n", "\n").replace("\r", "\n")
+    s = re.sub(r"\b[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\b", "<uuid>", s, flags=re.IGNORECASE)
+    s = re.sub(r"\b0x[0-9a-f]+\b", "<hex>", s, flags=re.IGNORECASE)
+    s = re.sub(r"\b\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?\b", "<ts>", s)
+    s = re.sub(r"[A-Za-z]:\\\\[^\s\"']+", "<path>", s)
+    s = re.sub(r"(/[^ \n\t\"']+)+", "<path>", s)
+    s = re.sub(r"\b\d{3,}\b", "<num>", s)
+    return s
+
+
+def _exception_simple_name(exception_type):
+    s = (exception_type or "").strip()
+    if not s:
+        return ""
+    s = s.split(":", 1)[0].strip()
+    s = s.split(".")[-1]
+    s = s.split("$")[-1]
+    return s.strip()
+
+
+def _extract_exception_line(normalized_text):
+    lines = [ln.strip() for ln in (normalized_text or "").splitlines() if ln.strip()]
+    if not lines:
+        return "", ""
+    for ln in reversed(lines[-50:]):
+        m = re.match(r"^([A-Za-z_][A-Za-z0-9_.$]*(?:Error|Exception))\s*:\s*(.*)$", ln)
+        if m:
+            return _exception_simple_name(m.group(1)), (m.group(2) or "").strip()
+    for ln in reversed(lines[-50:]):
+        m = re.search(r"([A-Za-z_][A-Za-z0-9_.$]*(?:Error|Exception))\s*:\s*(.*)$", ln)
+        if m:
+            return _exception_simple_name(m.group(1)), (m.group(2) or "").strip()
+    last = lines[-1]
+    m = re.search(r"([A-Za-z_][A-Za-z0-9_.$]*(?:Error|Exception))\b", last)
+    if m:
+        return _exception_simple_name(m.group(1)), ""
+    return "", ""
+
+
+def _extract_frames(raw_text):
+    frames = []
+    raw = raw_text or ""
+    pattern = re.compile(r'File\s+"([^"]+)",\s+line\s+(\d+),\s+in\s+([A-Za-z_][A-Za-z0-9_]*)')
+    for m in pattern.finditer(raw):
+        file_path = m.group(1) or ""
+        func = m.group(3) or ""
+        file_name = os.path.basename(file_path.replace("\\", "/"))
+        if not file_name:
+            continue
+        frames.append(f"{file_name}:{func}")
+    java_pattern = re.compile(r"^\s*at\s+([A-Za-z0-9_.$]+)\(([A-Za-z0-9_.+$-]+):(\d+)\)\s*$", re.MULTILINE)
+    for m in java_pattern.finditer(raw):
+        full = (m.group(1) or "").strip()
+        file_name = (m.group(2) or "").strip()
+        if file_name.lower() in ("unknown source", "native method"):
+            continue
+        func = full.split(".")[-1] if full else ""
+        if not file_name or not func:
+            continue
+        frames.append(f"{file_name}:{func}")
+    return frames
+
+
+def _message_key(message):
+    s = (message or "").strip()
+    if not s:
+        return ""
+    s = normalize_text(s)
+    s = re.sub(r"['\"].*?['\"]", "<str>", s)
+    s = re.sub(r"\s+", " ", s).strip()
+    return s[:160]
+
+
+def _normalize_query_text(exception_type, message_key, frames):
+    parts = []
+    if exception_type:
+        parts.append(exception_type)
+    if message_key:
+        parts.append(message_key)
+    if frames:
+        parts.append(" ".join(frames[:3]))
+    text = " ".join(parts)
+    text = re.sub(r"\s+", " ", text).strip()
+    return text[:500]
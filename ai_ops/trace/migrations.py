@@ -0,0 +1,713 @@
+import json
+import sqlite3
+import time
+
+from ai_ops.trace.blobs import REVISION_BLOB_FIELDS, prepare_text, put_blob, resolve_codec
+from ai_ops.trace.features import extract_features
+from ai_ops.trace.minhash import case_shingles, lsh_buckets, minhash_signature
+
+
+def _ensure_column(conn, table, column, col_type):
+    rows = conn.execute(f"PRAGMA table_info({table})").fetchall()
+    existing = {r[1] for r in rows} if rows else set()
+    if column in existing:
+        return
+    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {col_type}")
+
+
+def _baseline(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS traces(
+            trace_id TEXT PRIMARY KEY,
+            created_at INTEGER NOT NULL,
+            finished_at INTEGER,
+            repo_url TEXT NOT NULL,
+            code_host TEXT NOT NULL,
+            error_signature TEXT,
+            error_excerpt TEXT,
+            status TEXT NOT NULL,
+            failure_step TEXT,
+            failure_message TEXT,
+            mr_url TEXT,
+            commit_sha TEXT
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_traces_created ON traces(created_at, trace_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_traces_repo_created ON traces(repo_url, created_at, trace_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_traces_status_created ON traces(status, created_at, trace_id)")
+    _ensure_column(conn, "traces", "features", "TEXT")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS steps(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            trace_id TEXT NOT NULL,
+            step_name TEXT NOT NULL,
+            started_at INTEGER NOT NULL,
+            finished_at INTEGER,
+            status TEXT NOT NULL,
+            message TEXT,
+            FOREIGN KEY(trace_id) REFERENCES traces(trace_id)
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_steps_trace ON steps(trace_id)")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS jobs(
+            job_id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            priority INTEGER NOT NULL DEFAULT 0,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL,
+            trace_id TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at INTEGER NOT NULL,
+            updated_at INTEGER NOT NULL
+        )
+        """
+    )
+    _ensure_column(conn, "jobs", "lease_owner", "TEXT")
+    _ensure_column(conn, "jobs", "lease_expires_at", "REAL")
+    _ensure_column(conn, "jobs", "fence", "INTEGER NOT NULL DEFAULT 0")
+    _ensure_column(conn, "jobs", "target_node", "TEXT NOT NULL DEFAULT ''")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS idempotency_keys(
+            key TEXT PRIMARY KEY,
+            task_id TEXT NOT NULL,
+            created_at INTEGER NOT NULL,
+            expires_at INTEGER NOT NULL
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_idempotency_expires ON idempotency_keys(expires_at)")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS nodes(
+            node_id TEXT PRIMARY KEY,
+            started_at REAL NOT NULL,
+            last_seen REAL NOT NULL
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, priority, created_at)")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS bug_cases(
+            case_id TEXT PRIMARY KEY,
+            repo_url TEXT NOT NULL,
+            code_host TEXT NOT NULL,
+            signature TEXT NOT NULL,
+            exception_type TEXT,
+            message_key TEXT,
+            top_frames TEXT,
+            status TEXT NOT NULL,
+            quality_score REAL NOT NULL DEFAULT 0,
+            created_at INTEGER NOT NULL,
+            updated_at INTEGER NOT NULL
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_bug_cases_repo_sig
+        ON bug_cases(repo_url, signature)
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_bug_cases_updated ON bug_cases(updated_at, case_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_bug_cases_repo_updated ON bug_cases(repo_url, updated_at, case_id)")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS bug_case_revisions(
+            revision_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            case_id TEXT NOT NULL,
+            trace_id TEXT,
+            trigger_type TEXT NOT NULL,
+            trigger_text TEXT,
+            pr_url TEXT,
+            pr_title TEXT,
+            pr_body TEXT,
+            commit_sha TEXT,
+            changed_files_json TEXT,
+            diff_text TEXT,
+            preflight_ok INTEGER NOT NULL DEFAULT 0,
+            created_at INTEGER NOT NULL,
+            FOREIGN KEY(case_id) REFERENCES bug_cases(case_id)
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS bug_cases_fts
+        USING fts5(case_id UNINDEXED, text)
+        """
+    )
+    _ensure_column(conn, "bug_case_revisions", "pr_title", "TEXT")
+    _ensure_column(conn, "bug_case_revisions", "pr_body", "TEXT")
+
+
+def _blob_schema(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS blobs(
+            key TEXT PRIMARY KEY,
+            codec TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            refcount INTEGER NOT NULL DEFAULT 0,
+            created_at INTEGER NOT NULL
+        )
+        """
+    )
+    for field in REVISION_BLOB_FIELDS:
+        _ensure_column(conn, "bug_case_revisions", f"{field}_blob", "TEXT")
+
+
+def _move_revision_text_to_blobs(conn, after_id=0, batch_size=200):
+    fields = ", ".join(REVISION_BLOB_FIELDS)
+    rows = conn.execute(
+        f"SELECT revision_id, {fields} FROM bug_case_revisions WHERE revision_id > ? ORDER BY revision_id LIMIT ?",
+        (after_id, batch_size),
+    ).fetchall()
+    codec = resolve_codec()
+    for row in rows:
+        sets = []
+        params = []
+        for field, text in zip(REVISION_BLOB_FIELDS, row[1:]):
+            inline, encoded = prepare_text(text, codec)
+            if encoded is None:
+                continue
+            sets.extend([f"{field}=?", f"{field}_blob=?"])
+            params.extend([inline, put_blob(conn, encoded)])
+        if sets:
+            conn.execute(f"UPDATE bug_case_revisions SET {', '.join(sets)} WHERE revision_id=?", params + [row[0]])
+    return rows[-1][0] if len(rows) == batch_size else None
+
+
+def _minhash_schema(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS case_minhash(
+            case_id TEXT PRIMARY KEY,
+            repo_url TEXT NOT NULL,
+            signature BLOB NOT NULL
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS case_lsh(
+            bucket INTEGER NOT NULL,
+            case_id TEXT NOT NULL,
+            PRIMARY KEY(bucket, case_id)
+        ) WITHOUT ROWID
+        """
+    )
+
+
+def _index_existing_cases(conn, after_id="", batch_size=500):
+    rows = conn.execute(
+        """
+        SELECT case_id, repo_url, exception_type, message_key, top_frames FROM bug_cases
+        WHERE case_id > ? ORDER BY case_id LIMIT ?
+        """,
+        (after_id, batch_size),
+    ).fetchall()
+    for case_id, repo_url, exception_type, message_key, top_frames in rows:
+        signature = minhash_signature(case_shingles(exception_type, message_key, top_frames))
+        if signature is None:
+            continue
+        conn.execute("INSERT OR REPLACE INTO case_minhash(case_id, repo_url, signature) VALUES(?, ?, ?)", (case_id, repo_url, signature))
+        conn.executemany(
+            "INSERT OR IGNORE INTO case_lsh(bucket, case_id) VALUES(?, ?)",
+            [(bucket, case_id) for bucket in lsh_buckets(repo_url, signature)],
+        )
+    if len(rows) == batch_size:
+        return rows[-1][0]
+    # Matches computed while the index was incomplete were stored as full-text fallbacks; recompute
+    # them now that near duplicates can be found.
+    conn.execute("DELETE FROM trace_match_state WHERE via_fts = 1")
+    return None
+
+
+def _trigram_schema(conn):
+    # Rows share the bug_cases rowid so updates replace in place. The trigram tokenizer needs
+    # SQLite 3.34+; older builds keep using word search and LIKE.
+    try:
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS bug_cases_trigram USING fts5(case_id UNINDEXED, text, tokenize='trigram')")
+    except sqlite3.OperationalError:
+        pass
+
+
+def trigram_text(exception_type, message_key, top_frames):
+    return "\n".join([exception_type or "", message_key or "", top_frames or ""])
+
+
+def _index_existing_trigrams(conn, after_rowid=0, batch_size=1000):
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE name='bug_cases_trigram'").fetchone():
+        return None
+    rows = conn.execute(
+        "SELECT rowid, case_id, exception_type, message_key, top_frames FROM bug_cases WHERE rowid > ? ORDER BY rowid LIMIT ?",
+        (after_rowid, batch_size),
+    ).fetchall()
+    conn.executemany(
+        "INSERT OR REPLACE INTO bug_cases_trigram(rowid, case_id, text) VALUES(?, ?, ?)",
+        [(r[0], r[1], trigram_text(r[2], r[3], r[4])) for r in rows],
+    )
+    return rows[-1][0] if len(rows) == batch_size else None
+
+
+def _extract_missing_trace_features(conn, after_rowid=0, batch_size=500):
+    # Traces written before every creation path stored features get them once here, so reads never
+    # have to run the extraction regexes on the excerpt.
+    rows = conn.execute(
+        "SELECT rowid, error_excerpt FROM traces WHERE rowid > ? AND features IS NULL ORDER BY rowid LIMIT ?",
+        (after_rowid, batch_size),
+    ).fetchall()
+    conn.executemany(
+        "UPDATE traces SET features=? WHERE rowid=?",
+        [(json.dumps(extract_features(r[1]), ensure_ascii=False), r[0]) for r in rows if r[1]],
+    )
+    return rows[-1][0] if len(rows) == batch_size else None
+
+
+def _trace_match_schema(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS trace_match_state(
+            trace_id TEXT PRIMARY KEY,
+            repo_url TEXT NOT NULL,
+            signature TEXT NOT NULL DEFAULT '',
+            via_fts INTEGER NOT NULL DEFAULT 0,
+            computed_at INTEGER NOT NULL
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_trace_match_state_sig ON trace_match_state(repo_url, signature)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_trace_match_state_fts ON trace_match_state(repo_url) WHERE via_fts = 1")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS trace_matches(
+            trace_id TEXT NOT NULL,
+            rank INTEGER NOT NULL,
+            case_id TEXT NOT NULL,
+            PRIMARY KEY(trace_id, rank)
+        ) WITHOUT ROWID
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_trace_matches_case ON trace_matches(case_id)")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS trace_lsh(
+            bucket INTEGER NOT NULL,
+            trace_id TEXT NOT NULL,
+            PRIMARY KEY(bucket, trace_id)
+        ) WITHOUT ROWID
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_trace_lsh_trace ON trace_lsh(trace_id)")
+
+
+def _backfill_schema(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS backfills(
+            name TEXT PRIMARY KEY,
+            cursor TEXT,
+            updated_at INTEGER NOT NULL
+        )
+        """
+    )
+
+
+def _queue_backfill(name):
+    def step(conn):
+        _backfill_schema(conn)
+        conn.execute("INSERT OR IGNORE INTO backfills(name, cursor, updated_at) VALUES(?, NULL, ?)", (name, int(time.time())))
+
+    step.backfill = name
+    return step
+
+
+STATS_DAY = "strftime('%Y-%m-%d', {}, 'unixepoch')"
+
+# Rollups are maintained by triggers, so every writer (direct, the group-commit writer, interrupt_trace)
+# updates them in the same transaction as the trace or step row. Rows between the backfill cursor and
+# the watermark in stats_watermark are left to _count_existing_rollups, which counts their state when
+# it reaches them; everything it has passed or that came after the migration is counted here.
+_TRACE_UNCOUNTED = "NOT EXISTS (SELECT 1 FROM stats_watermark WHERE NEW.rowid > traces_done AND NEW.rowid <= traces_max)"
+_STEP_UNCOUNTED = "NOT EXISTS (SELECT 1 FROM stats_watermark WHERE NEW.id > steps_done AND NEW.id <= steps_max)"
+
+_ROLLUP_TRIGGERS = [
+    f"""
+    CREATE TRIGGER trg_stats_trace_started AFTER INSERT ON traces
+    WHEN {_TRACE_UNCOUNTED}
+    BEGIN
+        INSERT INTO stats_daily(repo_url, day, started) VALUES(NEW.repo_url, {STATS_DAY.format("NEW.created_at")}, 1)
+        ON CONFLICT(repo_url, day) DO UPDATE SET started=started+1;
+    END
+    """,
+    f"""
+    CREATE TRIGGER trg_stats_trace_finished AFTER UPDATE OF status ON traces
+    WHEN NEW.status IN ('DONE', 'FAILED', 'INTERRUPTED') AND NEW.status IS NOT OLD.status AND {_TRACE_UNCOUNTED}
+    BEGIN
+        INSERT INTO stats_daily(repo_url, day, done, failed, interrupted, resolve_seconds)
+        VALUES(
+            NEW.repo_url,
+            {STATS_DAY.format("COALESCE(NEW.finished_at, NEW.created_at)")},
+            NEW.status = 'DONE',
+            NEW.status = 'FAILED',
+            NEW.status = 'INTERRUPTED',
+            CASE WHEN NEW.status = 'DONE' THEN MAX(COALESCE(NEW.finished_at, NEW.created_at) - NEW.created_at, 0) ELSE 0 END
+        )
+        ON CONFLICT(repo_url, day) DO UPDATE SET
+            done=done+excluded.done,
+            failed=failed+excluded.failed,
+            interrupted=interrupted+excluded.interrupted,
+            resolve_seconds=resolve_seconds+excluded.resolve_seconds;
+        INSERT INTO stats_signatures_daily(repo_url, day, signature, traces, done, failed, first_seen, last_seen)
+        SELECT NEW.repo_url, {STATS_DAY.format("COALESCE(NEW.finished_at, NEW.created_at)")}, NEW.error_signature, 1,
+               NEW.status = 'DONE', NEW.status = 'FAILED', NEW.created_at, NEW.created_at
+        WHERE COALESCE(NEW.error_signature, '') != '' AND NEW.status IN ('DONE', 'FAILED')
+        ON CONFLICT(repo_url, day, signature) DO UPDATE SET
+            traces=traces+1,
+            done=done+excluded.done,
+            failed=failed+excluded.failed,
+            first_seen=MIN(first_seen, excluded.first_seen),
+            last_seen=MAX(last_seen, excluded.last_seen);
+    END
+    """,
+    f"""
+    CREATE TRIGGER trg_stats_step_finished AFTER UPDATE OF status ON steps
+    WHEN OLD.status = 'RUNNING' AND NEW.status IN ('OK', 'FAIL') AND {_STEP_UNCOUNTED}
+    BEGIN
+        INSERT INTO stats_steps(repo_url, day, step_name, ok, failed, seconds)
+        SELECT
+            COALESCE((SELECT repo_url FROM traces WHERE trace_id = NEW.trace_id), ''),
+            {STATS_DAY.format("COALESCE(NEW.finished_at, NEW.started_at)")},
+            NEW.step_name,
+            NEW.status = 'OK',
+            NEW.status = 'FAIL',
+            MAX(COALESCE(NEW.finished_at, NEW.started_at) - NEW.started_at, 0)
+        WHERE 1
+        ON CONFLICT(repo_url, day, step_name) DO UPDATE SET
+            ok=ok+excluded.ok,
+            failed=failed+excluded.failed,
+            seconds=seconds+excluded.seconds;
+    END
+    """,
+]
+
+
+def _rollup_schema(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS stats_daily(
+            repo_url TEXT NOT NULL,
+            day TEXT NOT NULL,
+            started INTEGER NOT NULL DEFAULT 0,
+            done INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            interrupted INTEGER NOT NULL DEFAULT 0,
+            resolve_seconds INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY(repo_url, day)
+        ) WITHOUT ROWID
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_stats_daily_day ON stats_daily(day)")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS stats_steps(
+            repo_url TEXT NOT NULL,
+            day TEXT NOT NULL,
+            step_name TEXT NOT NULL,
+            ok INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            seconds INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY(repo_url, day, step_name)
+        ) WITHOUT ROWID
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_stats_steps_day ON stats_steps(day)")
+    _signature_rollup_schema(conn)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS stats_watermark(
+            traces_max INTEGER NOT NULL,
+            traces_done INTEGER NOT NULL,
+            steps_max INTEGER NOT NULL,
+            steps_done INTEGER NOT NULL
+        )
+        """
+    )
+
+
+def _signature_rollup_schema(conn):
+    # Signatures are counted per finishing day like the other rollups, so a time range scopes them too.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS stats_signatures_daily(
+            repo_url TEXT NOT NULL,
+            day TEXT NOT NULL,
+            signature TEXT NOT NULL,
+            traces INTEGER NOT NULL DEFAULT 0,
+            done INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            first_seen INTEGER NOT NULL,
+            last_seen INTEGER NOT NULL,
+            PRIMARY KEY(repo_url, day, signature)
+        ) WITHOUT ROWID
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_stats_signatures_daily_day ON stats_signatures_daily(day)")
+
+
+def _rollup_triggers(conn):
+    for name in ("trg_stats_trace_started", "trg_stats_trace_finished", "trg_stats_step_finished"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+    for sql in _ROLLUP_TRIGGERS:
+        conn.execute(sql)
+
+
+def _queue_rollup_backfill(conn):
+    # The rollups restart from zero and the watermark hands every existing row to the backfill, in the
+    # same transaction, so nothing is counted twice or missed while it catches up.
+    for table in ("stats_daily", "stats_steps", "stats_signatures_daily", "stats_watermark"):
+        conn.execute(f"DELETE FROM {table}")
+    conn.execute(
+        """
+        INSERT INTO stats_watermark(traces_max, traces_done, steps_max, steps_done)
+        VALUES((SELECT IFNULL(MAX(rowid), 0) FROM traces), 0, (SELECT IFNULL(MAX(id), 0) FROM steps), 0)
+        """
+    )
+    _queue_backfill("stats_rollups")(conn)
+
+
+_queue_rollup_backfill.backfill = "stats_rollups"
+
+
+def _batch_end(conn, sql, done, last, batch_size):
+    row = conn.execute(sql, (done, last, batch_size - 1)).fetchone()
+    return row[0] if row else last
+
+
+def _count_existing_rollups(conn, _cursor=None, batch_size=2000):
+    # The cursor lives in stats_watermark, where the triggers can read it.
+    row = conn.execute("SELECT traces_max, traces_done, steps_max, steps_done FROM stats_watermark").fetchone()
+    if row is None:
+        return None
+    traces_max, traces_done, steps_max, steps_done = row
+    if traces_done < traces_max:
+        end = _batch_end(
+            conn, "SELECT rowid FROM traces WHERE rowid > ? AND rowid <= ? ORDER BY rowid LIMIT 1 OFFSET ?", traces_done, traces_max, batch_size
+        )
+        chunk = (traces_done, end)
+        conn.execute(
+            f"""
+            INSERT INTO stats_daily(repo_url, day, started)
+            SELECT repo_url, {STATS_DAY.format("created_at")}, COUNT(*) FROM traces WHERE rowid > ? AND rowid <= ? GROUP BY 1, 2
+            ON CONFLICT(repo_url, day) DO UPDATE SET started=started+excluded.started
+            """,
+            chunk,
+        )
+        conn.execute(
+            f"""
+            INSERT INTO stats_daily(repo_url, day, done, failed, interrupted, resolve_seconds)
+            SELECT repo_url, {STATS_DAY.format("COALESCE(finished_at, created_at)")},
+                   SUM(status = 'DONE'), SUM(status = 'FAILED'), SUM(status = 'INTERRUPTED'),
+                   SUM(CASE WHEN status = 'DONE' THEN MAX(COALESCE(finished_at, created_at) - created_at, 0) ELSE 0 END)
+            FROM traces WHERE rowid > ? AND rowid <= ? AND status IN ('DONE', 'FAILED', 'INTERRUPTED') GROUP BY 1, 2
+            ON CONFLICT(repo_url, day) DO UPDATE SET
+                done=done+excluded.done,
+                failed=failed+excluded.failed,
+                interrupted=interrupted+excluded.interrupted,
+                resolve_seconds=resolve_seconds+excluded.resolve_seconds
+            """,
+            chunk,
+        )
+        conn.execute(
+            f"""
+            INSERT INTO stats_signatures_daily(repo_url, day, signature, traces, done, failed, first_seen, last_seen)
+            SELECT repo_url, {STATS_DAY.format("COALESCE(finished_at, created_at)")}, error_signature, COUNT(*),
+                   SUM(status = 'DONE'), SUM(status = 'FAILED'), MIN(created_at), MAX(created_at)
+            FROM traces
+            WHERE rowid > ? AND rowid <= ? AND COALESCE(error_signature, '') != '' AND status IN ('DONE', 'FAILED')
+            GROUP BY 1, 2, 3
+            ON CONFLICT(repo_url, day, signature) DO UPDATE SET
+                traces=traces+excluded.traces,
+                done=done+excluded.done,
+                failed=failed+excluded.failed,
+                first_seen=MIN(first_seen, excluded.first_seen),
+                last_seen=MAX(last_seen, excluded.last_seen)
+            """,
+            chunk,
+        )
+        conn.execute("UPDATE stats_watermark SET traces_done=?", (end,))
+        return [end, steps_done]
+    if steps_done < steps_max:
+        end = _batch_end(
+            conn, "SELECT id FROM steps WHERE id > ? AND id <= ? ORDER BY id LIMIT 1 OFFSET ?", steps_done, steps_max, batch_size
+        )
+        conn.execute(
+            f"""
+            INSERT INTO stats_steps(repo_url, day, step_name, ok, failed, seconds)
+            SELECT COALESCE(t.repo_url, ''), {STATS_DAY.format("COALESCE(s.finished_at, s.started_at)")}, s.step_name,
+                   SUM(s.status = 'OK'), SUM(s.status = 'FAIL'), SUM(MAX(COALESCE(s.finished_at, s.started_at) - s.started_at, 0))
+            FROM steps s LEFT JOIN traces t ON t.trace_id = s.trace_id
+            WHERE s.id > ? AND s.id <= ? AND s.status IN ('OK', 'FAIL') GROUP BY 1, 2, 3
+            ON CONFLICT(repo_url, day, step_name) DO UPDATE SET
+                ok=ok+excluded.ok,
+                failed=failed+excluded.failed,
+                seconds=seconds+excluded.seconds
+            """,
+            (steps_done, end),
+        )
+        conn.execute("UPDATE stats_watermark SET steps_done=?", (end,))
+        return [traces_max, end]
+    conn.execute("DELETE FROM stats_watermark")
+    return None
+
+
+# Each migration is a list of steps; every step commits on its own so a long index build on a big
+# database only holds the write lock for that one statement. Steps must be idempotent; a callable
+# step that returns something other than None has more work left and is called again with that
+# value in a fresh transaction.
+#
+# Rewriting existing rows is not done at startup: a migration only queues the backfill, and
+# run_backfills walks it in batches from the maintenance loop. Until a backfill is finished the
+# store reads around it (see TraceStore._backfills).
+MIGRATIONS = [
+    (1, "baseline schema", [_baseline]),
+    (
+        2,
+        "hot-path indexes",
+        [
+            "CREATE INDEX IF NOT EXISTS idx_traces_repo_status_created ON traces(repo_url, status, created_at, trace_id)",
+            "CREATE INDEX IF NOT EXISTS idx_steps_trace_started ON steps(trace_id, started_at, id)",
+            "DROP INDEX IF EXISTS idx_steps_trace",
+            "CREATE INDEX IF NOT EXISTS idx_bug_case_revisions_case_created ON bug_case_revisions(case_id, created_at)",
+            "CREATE INDEX IF NOT EXISTS idx_bug_cases_sig_quality ON bug_cases(signature, quality_score)",
+            """
+            CREATE INDEX IF NOT EXISTS idx_jobs_active ON jobs(status, priority, created_at)
+            WHERE status IN ('QUEUED', 'INTERRUPTED', 'RUNNING')
+            """,
+        ],
+    ),
+    (3, "content-addressed blobs for revision text", [_blob_schema, _queue_backfill("revision_blobs")]),
+    (
+        4,
+        "retention lookups",
+        ["CREATE INDEX IF NOT EXISTS idx_bug_case_revisions_trace ON bug_case_revisions(trace_id)"],
+    ),
+    (5, "minhash/lsh similarity index", [_minhash_schema, _queue_backfill("case_minhash")]),
+    (6, "trigram substring index", [_trigram_schema, _queue_backfill("case_trigram")]),
+    (7, "persisted trace features", [_queue_backfill("trace_features")]),
+    (8, "precomputed trace matches", [_trace_match_schema]),
+    (9, "analytics rollups", [_rollup_schema, _rollup_triggers, _queue_rollup_backfill]),
+    (
+        10,
+        "staged jobs",
+        ["CREATE INDEX IF NOT EXISTS idx_jobs_pending ON jobs(target_node) WHERE status = 'PENDING'"],
+    ),
+    (11, "background backfills", [_backfill_schema]),
+    (
+        12,
+        "signature rollups per day",
+        [_rollup_schema, _rollup_triggers, _queue_rollup_backfill, "DROP TABLE IF EXISTS stats_signatures"],
+    ),
+]
+
+BACKFILLS = [
+    ("revision_blobs", _move_revision_text_to_blobs),
+    ("case_minhash", _index_existing_cases),
+    ("case_trigram", _index_existing_trigrams),
+    ("trace_features", _extract_missing_trace_features),
+    ("stats_rollups", _count_existing_rollups),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn, migrations=MIGRATIONS):
+    conn.isolation_level = None
+    applied = []
+    # A new database has no rows to backfill.
+    fresh = not conn.execute("SELECT 1 FROM sqlite_master WHERE name='traces'").fetchone()
+    for version, _name, steps in migrations:
+        if schema_version(conn) >= version:
+            continue
+        for step in steps:
+            if fresh and getattr(step, "backfill", None):
+                continue
+            resume = _run_step(conn, version, step, None)
+            while resume is not None:
+                resume = _run_step(conn, version, step, resume)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if schema_version(conn) < version:
+                conn.execute(f"PRAGMA user_version={int(version)}")
+                applied.append(version)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    if applied:
+        conn.execute("PRAGMA optimize")
+    return applied
+
+
+def _run_step(conn, version, step, resume):
+    more = None
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Another process may have finished this migration while we waited for the lock.
+        if schema_version(conn) < version:
+            if callable(step):
+                more = step(conn) if resume is None else step(conn, resume)
+            else:
+                conn.execute(step)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return more
+
+
+def pending_backfills(conn):
+    return {r[0] for r in conn.execute("SELECT name FROM backfills")}
+
+
+def run_backfills(conn, stop=None, pause_seconds=0.0):
+    conn.isolation_level = None
+    finished = []
+    for name, step in BACKFILLS:
+        while stop is None or not stop.is_set():
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # The cursor is re-read under the lock, so several processes can share the work.
+                row = conn.execute("SELECT cursor FROM backfills WHERE name=?", (name,)).fetchone()
+                more = None
+                if row is not None:
+                    more = step(conn) if row[0] is None else step(conn, json.loads(row[0]))
+                    if more is None:
+                        conn.execute("DELETE FROM backfills WHERE name=?", (name,))
+                        finished.append(name)
+                    else:
+                        conn.execute(
+                            "UPDATE backfills SET cursor=?, updated_at=? WHERE name=?", (json.dumps(more), int(time.time()), name)
+                        )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            if more is None:
+                break
+            if pause_seconds > 0:
+                time.sleep(pause_seconds)
+    return finished
@@ -0,0 +1,83 @@
+import hashlib
+import random
+import re
+import struct
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 16
+LSH_ROWS = MINHASH_PERMUTATIONS // LSH_BANDS
+# Banding with 16x4 makes cases with Jaccard ~0.5 collide about half the time; candidates below this
+# estimated similarity are dropped.
+MIN_SIMILARITY = 0.4
+# A bucket holding more cases than this was produced by shingles nearly every case shares; it is
+# skipped like a stop word unless no selective bucket matched.
+MAX_BUCKET_SIZE = 64
+
+_PRIME = (1 << 61) - 1
+_MASK64 = (1 << 64) - 1
+_MAX32 = (1 << 32) - 1
+# Fixed seed: signatures are persisted, so every process must draw the same permutations.
+_rng = random.Random(20240601)
+_A = [_rng.randrange(1, _PRIME) for _ in range(MINHASH_PERMUTATIONS)]
+_B = [_rng.randrange(0, _PRIME) for _ in range(MINHASH_PERMUTATIONS)]
+_SIG_FORMAT = f"<{MINHASH_PERMUTATIONS}I"
+if np is not None:
+    _A_NP = np.array(_A, dtype=np.uint64)
+    _B_NP = np.array(_B, dtype=np.uint64)
+
+
+def case_shingles(exception_type, message_key, top_frames):
+    frames = [f.strip() for f in (top_frames or "").split(" | ") if f.strip()]
+    out = {"f:" + f for f in frames}
+    out.update("c:" + a + ">" + b for a, b in zip(frames, frames[1:]))
+    if exception_type:
+        out.add("e:" + exception_type)
+    for token in re.findall(r"(?<![<\w])[A-Za-z_][A-Za-z0-9_]+(?![>\w])", message_key or ""):
+        out.add("m:" + token.lower())
+    return out
+
+
+def minhash_signature(shingles):
+    if not shingles:
+        return None
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode("utf-8", errors="ignore"), digest_size=4).digest(), "little") for s in shingles]
+    if np is not None:
+        # uint64 arithmetic wraps exactly like the masked pure-Python path, so both produce identical signatures.
+        hv = np.array(hashes, dtype=np.uint64)[:, None]
+        with np.errstate(over="ignore"):
+            values = ((hv * _A_NP + _B_NP) % np.uint64(_PRIME)) & np.uint64(_MAX32)
+        return values.min(axis=0).astype("<u4").tobytes()
+    sig = [min(((a * h + b) & _MASK64) % _PRIME & _MAX32 for h in hashes) for a, b in zip(_A, _B)]
+    return struct.pack(_SIG_FORMAT, *sig)
+
+
+def lsh_buckets(repo_url, signature):
+    # Buckets are scoped to the repo, since similarity search never crosses repositories.
+    prefix = (repo_url or "").encode("utf-8", errors="ignore") + b"\0"
+    width = LSH_ROWS * 4
+    out = []
+    for band in range(LSH_BANDS):
+        digest = hashlib.blake2b(prefix + bytes([band]) + signature[band * width : (band + 1) * width], digest_size=8).digest()
+        out.append(int.from_bytes(digest, "little", signed=True))
+    return out
+
+
+def similarities(signature, candidates):
+    if not candidates:
+        return []
+    if np is not None:
+        query = np.frombuffer(signature, dtype="<u4")
+        matrix = np.frombuffer(b"".join(candidates), dtype="<u4").reshape(len(candidates), MINHASH_PERMUTATIONS)
+        return (matrix == query).mean(axis=1).tolist()
+    query = struct.unpack(_SIG_FORMAT, signature)
+    out = []
+    for cand in candidates:
+        values = struct.unpack(_SIG_FORMAT, cand)
+        out.append(sum(1 for x, y in zip(query, values) if x == y) / MINHASH_PERMUTATIONS)
+    return out
@@ -0,0 +1,344 @@
+import os
+import re
+import sqlite3
+import time
+
+from ai_ops.trace.blobs import REVISION_BLOB_FIELDS, release_blob
+
+ARCHIVE_NAME = re.compile(r"^traces-(\d{4}-\d{2})\.db$")
+
+# Tables rows are copied into; an archive holds nothing else.
+ARCHIVE_TABLES = ("traces", "steps", "bug_cases", "bug_case_revisions", "blobs")
+
+# Statuses a trace keeps once it has finished; running traces are never archived.
+RETENTION_STATUSES = ("DONE", "FAILED", "INTERRUPTED")
+
+# Traces still referenced by a job that may run again are never archived.
+ACTIVE_JOB = "SELECT 1 FROM jobs WHERE jobs.trace_id = traces.trace_id AND jobs.status IN ('QUEUED', 'INTERRUPTED', 'RUNNING')"
+
+
+class RetentionRule:
+    def __init__(self, days, repo_url="", status=""):
+        self.days = float(days)
+        self.repo_url = (repo_url or "").strip()
+        self.status = (status or "").strip().upper()
+
+    def specificity(self):
+        return (2 if self.repo_url else 0) + (1 if self.status else 0)
+
+    def match_sql(self):
+        where = []
+        params = []
+        if self.repo_url:
+            where.append("repo_url = ?")
+            params.append(self.repo_url)
+        if self.status:
+            where.append("status = ?")
+            params.append(self.status)
+        return (" AND ".join(where) or "1"), params
+
+
+class RetentionPolicy:
+    def __init__(self, default_days=0, rules=()):
+        self.rules = [RetentionRule(default_days)] + list(rules)
+        self.rules.sort(key=lambda r: r.specificity(), reverse=True)
+
+    @classmethod
+    def parse(cls, default_days=0, spec=""):
+        # "*=365,DONE=30,FAILED=180,<repo_url>=7,<repo_url>|FAILED=30"; 0 days keeps matching traces forever.
+        rules = []
+        for item in (spec or "").split(","):
+            key, sep, days = item.strip().rpartition("=")
+            key = key.strip()
+            if not sep or not key or not re.fullmatch(r"\d+(?:\.\d+)?", days.strip()):
+                continue
+            if key == "*":
+                default_days = days.strip()
+                continue
+            repo_url, bar, status = key.rpartition("|")
+            if not bar:
+                repo_url, status = ("", key) if re.fullmatch(r"[A-Za-z_]+", key) else (key, "")
+            if status and status.strip().upper() not in RETENTION_STATUSES:
+                # A rule for any other status would never match and silently keep those traces.
+                raise ValueError(f"invalid retention status: {status.strip()}")
+            rules.append(RetentionRule(days.strip(), repo_url=repo_url, status=status))
+        return cls(default_days, rules)
+
+    def enabled(self):
+        return any(r.days > 0 for r in self.rules)
+
+    def min_days(self):
+        return min((r.days for r in self.rules if r.days > 0), default=0)
+
+    def expired_filters(self, now=None):
+        # Each trace is governed by the most specific rule that matches it, so a broader rule excludes
+        # the rows of every more specific one.
+        now = time.time() if now is None else now
+        out = []
+        for i, rule in enumerate(self.rules):
+            if rule.days <= 0:
+                continue
+            match, params = rule.match_sql()
+            where = [f"({match})", "created_at < ?"]
+            params = params + [int(now - rule.days * 86400)]
+            for other in self.rules[:i]:
+                if other.specificity() > rule.specificity():
+                    other_match, other_params = other.match_sql()
+                    where.append(f"NOT ({other_match})")
+                    params.extend(other_params)
+            out.append((" AND ".join(where), params))
+        return out
+
+
+def archive_dir_for(db_path, archive_dir=""):
+    return os.path.abspath(archive_dir or os.path.join(os.path.dirname(os.path.abspath(db_path)), "archive"))
+
+
+def archive_path(archive_dir, month):
+    return os.path.join(archive_dir, f"traces-{month}.db")
+
+
+def list_archives(archive_dir):
+    if not os.path.isdir(archive_dir):
+        return []
+    out = []
+    for name in sorted(os.listdir(archive_dir)):
+        m = ARCHIVE_NAME.match(name)
+        if m:
+            out.append((m.group(1), os.path.join(archive_dir, name)))
+    return out
+
+
+def attach_archive(conn, archive_dir, month, schema="archive"):
+    path = archive_path(archive_dir, month)
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    conn.execute("ATTACH DATABASE ? AS " + schema, (path,))
+    return path
+
+
+class TraceArchiver:
+    def __init__(self, store, policy, archive_dir="", batch_size=200, pause_seconds=0.05):
+        self.store = store
+        self.policy = policy
+        self.archive_dir = archive_dir_for(store.db_path, archive_dir)
+        self.batch_size = max(int(batch_size), 1)
+        self.pause_seconds = max(float(pause_seconds), 0.0)
+        self._ready = set()
+
+    def run(self, now=None, max_batches=None, stop=None):
+        moved = self.archive_expired(now=now, max_batches=max_batches, stop=stop)
+        self.prune_jobs(now=now, stop=stop)
+        self.compact(stop=stop)
+        return moved
+
+    def archive_expired(self, now=None, max_batches=None, stop=None):
+        if not self.policy.enabled():
+            return 0
+        self.store.flush()
+        conn = self._open()
+        moved = 0
+        batches = 0
+        try:
+            for where, params in self.policy.expired_filters(now):
+                while max_batches is None or batches < max_batches:
+                    if stop is not None and stop.is_set():
+                        return moved
+                    rows = conn.execute(
+                        f"""
+                        SELECT trace_id, strftime('%Y-%m', created_at, 'unixepoch') FROM traces
+                        WHERE status != 'RUNNING' AND {where} AND NOT EXISTS ({ACTIVE_JOB})
+                        ORDER BY created_at LIMIT ?
+                        """,
+                        params + [self.batch_size],
+                    ).fetchall()
+                    if not rows:
+                        break
+                    by_month = {}
+                    for trace_id, month in rows:
+                        by_month.setdefault(month, []).append(trace_id)
+                    for month, trace_ids in sorted(by_month.items()):
+                        count = self._move(conn, month, trace_ids)
+                        moved += count
+                        if count:
+                            # Lists and counts change; bump the store version so ETags do not answer 304.
+                            self.store._emit("traces_archived", {"month": month, "trace_ids": trace_ids})
+                    batches += 1
+                    # Small transactions with a pause in between keep the write lock available to request threads.
+                    time.sleep(self.pause_seconds)
+        finally:
+            conn.close()
+        return moved
+
+    def prune_jobs(self, now=None, stop=None):
+        # Finished jobs are kept as long as the shortest retention rule, and as long as their trace is
+        # still in the live database; nothing reads them after that.
+        if not self.policy.enabled():
+            return 0
+        cutoff = int((time.time() if now is None else now) - self.policy.min_days() * 86400)
+        conn = self._open()
+        pruned = 0
+        try:
+            while stop is None or not stop.is_set():
+                rows = conn.execute(
+                    """
+                    SELECT job_id FROM jobs
+                    WHERE status IN ('DONE', 'FAILED') AND updated_at < ?
+                      AND NOT EXISTS (SELECT 1 FROM traces WHERE traces.trace_id = jobs.trace_id)
+                    LIMIT ?
+                    """,
+                    (cutoff, self.batch_size),
+                ).fetchall()
+                if not rows:
+                    break
+                marks = ",".join("?" for _ in rows)
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    pruned += conn.execute(
+                        f"DELETE FROM jobs WHERE job_id IN ({marks}) AND status IN ('DONE', 'FAILED')", [r[0] for r in rows]
+                    ).rowcount
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+                time.sleep(self.pause_seconds)
+        finally:
+            conn.close()
+        return pruned
+
+    def _open(self):
+        conn = self.store._open()
+        conn.isolation_level = None
+        # Background work waits for request threads rather than failing the batch on a busy lock.
+        conn.execute("PRAGMA busy_timeout=60000")
+        return conn
+
+    def _archive_ready(self, conn, month):
+        path = archive_path(self.archive_dir, month)
+        if path not in self._ready:
+            os.makedirs(self.archive_dir, exist_ok=True)
+            archive = sqlite3.connect(path, isolation_level=None)
+            try:
+                archive.execute("PRAGMA busy_timeout=60000")
+                archive.execute("PRAGMA journal_mode=WAL")
+                archive.execute("BEGIN IMMEDIATE")
+                try:
+                    _archive_schema(conn, archive)
+                    archive.execute("COMMIT")
+                except Exception:
+                    archive.execute("ROLLBACK")
+                    raise
+            finally:
+                archive.close()
+            self._ready.add(path)
+        return path
+
+    def _move(self, conn, month, trace_ids):
+        conn.execute("ATTACH DATABASE ? AS archive", (self._archive_ready(conn, month),))
+        try:
+            marks = ",".join("?" for _ in trace_ids)
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for table in ("traces", "steps"):
+                    cols = _columns(conn, table)
+                    conn.execute(
+                        f"INSERT OR IGNORE INTO archive.{table}({cols}) SELECT {cols} FROM main.{table} WHERE trace_id IN ({marks})",
+                        trace_ids,
+                    )
+                # Archived revisions keep a copy of their case row so the archive is a complete, queryable store.
+                cols = _columns(conn, "bug_cases")
+                conn.execute(
+                    f"""
+                    INSERT OR IGNORE INTO archive.bug_cases({cols}) SELECT {cols} FROM main.bug_cases
+                    WHERE case_id IN (SELECT case_id FROM main.bug_case_revisions WHERE trace_id IN ({marks}))
+                    """,
+                    trace_ids,
+                )
+                self._move_revisions(conn, marks, trace_ids)
+                conn.execute(f"DELETE FROM main.bug_case_revisions WHERE trace_id IN ({marks})", trace_ids)
+                # Precomputed matches are derived data and are not carried into the archive.
+                for table in ("trace_matches", "trace_match_state", "trace_lsh"):
+                    conn.execute(f"DELETE FROM main.{table} WHERE trace_id IN ({marks})", trace_ids)
+                conn.execute(f"DELETE FROM main.steps WHERE trace_id IN ({marks})", trace_ids)
+                moved = conn.execute(f"DELETE FROM main.traces WHERE trace_id IN ({marks})", trace_ids).rowcount
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.execute("DETACH DATABASE archive")
+        return moved
+
+    def _move_revisions(self, conn, marks, trace_ids):
+        cols = _columns(conn, "bug_case_revisions")
+        blob_cols = ", ".join(f"{f}_blob" for f in REVISION_BLOB_FIELDS)
+        rows = conn.execute(
+            f"SELECT revision_id, {blob_cols} FROM main.bug_case_revisions WHERE trace_id IN ({marks})",
+            trace_ids,
+        ).fetchall()
+        for row in rows:
+            inserted = conn.execute(
+                f"INSERT OR IGNORE INTO archive.bug_case_revisions({cols}) SELECT {cols} FROM main.bug_case_revisions WHERE revision_id=?",
+                (row[0],),
+            ).rowcount
+            for key in row[1:]:
+                if not key:
+                    continue
+                # A retried batch finds the revision already archived; only the main copy's reference is dropped then.
+                if inserted:
+                    conn.execute(
+                        """
+                        INSERT INTO archive.blobs(key, codec, size, data, refcount, created_at)
+                        SELECT key, codec, size, data, 1, created_at FROM main.blobs WHERE key=?
+                        ON CONFLICT(key) DO UPDATE SET refcount=refcount+1
+                        """,
+                        (key,),
+                    )
+                release_blob(conn, key)
+
+    def compact(self, stop=None, merge_pages=500, vacuum_pages=1000):
+        conn = self._open()
+        try:
+            # Incremental FTS segment merges instead of a single 'optimize' that would hold the write lock.
+            tables = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE name IN ('bug_cases_fts', 'bug_cases_trigram')")]
+            for table in tables:
+                while stop is None or not stop.is_set():
+                    before = conn.total_changes
+                    conn.execute(f"INSERT INTO {table}({table}, rank) VALUES('merge', ?)", (int(merge_pages),))
+                    if conn.total_changes - before < 2:
+                        break
+                    time.sleep(self.pause_seconds)
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                return
+            while stop is None or not stop.is_set():
+                if not conn.execute("PRAGMA freelist_count").fetchone()[0]:
+                    break
+                conn.execute(f"PRAGMA incremental_vacuum({int(vacuum_pages)})").fetchall()
+                time.sleep(self.pause_seconds)
+        finally:
+            conn.close()
+
+
+def _archive_schema(main, archive):
+    # Tables are created from the live definitions, so archives follow schema changes without running
+    # the migrations: no hot-path indexes, FTS, rollup triggers or backfills.
+    for table in ARCHIVE_TABLES:
+        existing = {r[1] for r in archive.execute(f"PRAGMA table_info({table})")}
+        if not existing:
+            archive.execute(main.execute("SELECT sql FROM main.sqlite_master WHERE type='table' AND name=?", (table,)).fetchone()[0])
+            continue
+        for _cid, name, col_type, _notnull, default, _pk in main.execute(f"PRAGMA main.table_info({table})"):
+            if name not in existing:
+                archive.execute(f"ALTER TABLE {table} ADD COLUMN {name} {col_type}" + (f" DEFAULT {default}" if default is not None else ""))
+    archive.execute("CREATE INDEX IF NOT EXISTS idx_traces_created ON traces(created_at, trace_id)")
+    archive.execute("CREATE INDEX IF NOT EXISTS idx_steps_trace ON steps(trace_id)")
+    archive.execute("CREATE INDEX IF NOT EXISTS idx_bug_case_revisions_trace ON bug_case_revisions(trace_id)")
+    # Archives created by earlier versions ran the full migrations.
+    for name in ("trg_stats_trace_started", "trg_stats_trace_finished", "trg_stats_step_finished"):
+        archive.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+
+def _columns(conn, table):
+    main = [r[1] for r in conn.execute(f"PRAGMA main.table_info({table})")]
+    archived = {r[1] for r in conn.execute(f"PRAGMA archive.table_info({table})")}
+    return ", ".join(c for c in main if c in archived)
@@ -1,103 +1,588 @@
+import base64
+import hashlib
+import json
 import os
 import re
-import hashlib
 import sqlite3
+import threading
 import time
 import uuid
+from collections import OrderedDict
+
+from ai_ops.trace.blobs import REVISION_BLOB_FIELDS, load_blobs, prepare_text, put_blob, resolve_codec
+from ai_ops.trace.features import extract_features, normalize_text, trusted_features
+from ai_ops.trace.migrations import migrate, pending_backfills, run_backfills, trigram_text
+from ai_ops.trace.minhash import MAX_BUCKET_SIZE, MIN_SIMILARITY, case_shingles, lsh_buckets, minhash_signature, similarities
+
+
+# Similar cases stored per finished trace; trace detail shows the first.
+TRACE_MATCH_LIMIT = 5
+
+# Per-resource versions kept for ETags; older entries fall back to the newest evicted version.
+RESOURCE_VERSION_LIMIT = 10000
+
+SQLITE_PROFILES = {
+    "safe": {"synchronous": "FULL", "cache_size": -8000, "mmap_size": 0},
+    "balanced": {"synchronous": "NORMAL", "cache_size": -32000, "mmap_size": 128 * 1024 * 1024},
+    "fast": {"synchronous": "OFF", "cache_size": -64000, "mmap_size": 256 * 1024 * 1024},
+}
+
+
+def sqlite_pragmas(profile="safe", synchronous=None, cache_size=None, mmap_size=None):
+    settings = dict(SQLITE_PROFILES.get((profile or "safe").strip().lower()) or SQLITE_PROFILES["safe"])
+    if synchronous:
+        settings["synchronous"] = str(synchronous).strip().upper()
+    if cache_size:
+        settings["cache_size"] = int(cache_size)
+    if mmap_size is not None and int(mmap_size) >= 0:
+        settings["mmap_size"] = int(mmap_size)
+    if settings["synchronous"] not in ("OFF", "NORMAL", "FULL", "EXTRA"):
+        raise ValueError(f"invalid synchronous mode: {settings['synchronous']}")
+    return [
+        "PRAGMA foreign_keys=ON",
+        f"PRAGMA synchronous={settings['synchronous']}",
+        f"PRAGMA cache_size={int(settings['cache_size'])}",
+        f"PRAGMA mmap_size={int(settings['mmap_size'])}",
+        "PRAGMA temp_store=MEMORY",
+    ]
+
+
+JOB_KEYS = [
+    "job_id",
+    "kind",
+    "priority",
+    "payload",
+    "status",
+    "trace_id",
+    "attempts",
+    "created_at",
+    "updated_at",
+    "lease_owner",
+    "lease_expires_at",
+    "fence",
+    "target_node",
+    "trace_status",
+]
+JOB_SELECT = (
+    "j.job_id, j.kind, j.priority, j.payload, j.status, j.trace_id, j.attempts, j.created_at, j.updated_at, "
+    "j.lease_owner, j.lease_expires_at, j.fence, j.target_node, t.status"
+)
+
+
+def _changed_resources(event_type, data):
+    out = [("trace", trace_id) for trace_id in data.get("trace_ids") or ()]
+    if data.get("trace_id"):
+        out.append(("trace", data["trace_id"]))
+    if data.get("case_id"):
+        out.extend([("case", data["case_id"]), ("cases",)])
+    if event_type == "traces_archived":
+        out.append(("archive",))
+    return out
 
 
 class TraceStore:
-    def __init__(self, db_path):
+    def __init__(
+        self,
+        db_path,
+        count_cache_ttl=30,
+        pragmas=None,
+        cached_statements=256,
+        write_mode="direct",
+        group_commit_ms=0,
+        max_write_batch=256,
+        flush_on_read=True,
+        blob_codec="auto",
+        feature_cache_size=1024,
+    ):
         self.db_path = os.path.abspath(db_path)
+        self.blob_codec = resolve_codec(blob_codec)
+        self.pragmas = list(pragmas) if pragmas is not None else sqlite_pragmas()
+        self.cached_statements = int(cached_statements)
+        self._local = threading.local()
+        self.write_mode = (write_mode or "direct").strip().lower()
+        if self.write_mode not in ("direct", "sync", "async"):
+            raise ValueError(f"invalid write mode: {self.write_mode}")
+        self.flush_on_read = bool(flush_on_read)
+        self._listeners = []
+        self._data_version = 0
+        self._versions = OrderedDict()
+        self._version_floor = 0
+        self._version_lock = threading.Lock()
+        self._version_conn = None
+        self.count_cache_ttl = float(count_cache_ttl)
+        self._count_cache = {}
+        self._count_lock = threading.Lock()
+        self.feature_cache_size = max(int(feature_cache_size), 0)
+        self._feature_cache = OrderedDict()
+        self._feature_lock = threading.Lock()
         self._init_db()
+        self._writer = None
+        if self.write_mode != "direct":
+            self._writer = GroupCommitWriter(self._open, max_batch=max_write_batch, max_delay=float(group_commit_ms) / 1000.0)
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+    def data_version(self, *resources):
+        # Without arguments the version of the whole store; otherwise the last change to any of the
+        # given resources, e.g. ("trace", trace_id), ("case", case_id), ("cases",) or ("archive",).
+        with self._version_lock:
+            if not resources:
+                return self._data_version
+            return max(self._versions.get(r, self._version_floor) for r in resources)
+
+    def flush(self, timeout=None):
+        if self._writer is not None:
+            return self._writer.flush(timeout)
+        return True
+
+    # Only the high-volume trace and step statements go through _write, and with it the group-commit
+    # writer. Methods that read back what they write or need several statements in one transaction
+    # (jobs, leases, idempotency keys, bug cases, trace matches) use their own connection; the ones
+    # that touch trace or step rows (interrupt_trace, refresh_trace_matches) flush the writer first so
+    # they are ordered after every queued write.
+    def _write(self, sql, params, event=None):
+        # event is (event_type, data); it is emitted once the statement has committed, so listeners and
+        # the data version never run ahead of what readers can see.
+        on_commit = (lambda: self._emit(*event)) if event is not None else None
+        if self._writer is None:
+            with self._connect() as conn:
+                conn.execute(sql, params)
+            if on_commit is not None:
+                on_commit()
+            return
+        ticket = self._writer.submit(sql, params, on_commit=on_commit)
+        if self.write_mode == "sync":
+            ticket.wait()
+
+    def _sync_reads(self):
+        if self._writer is not None and self.flush_on_read:
+            self._writer.flush()
+
+    def _emit(self, event_type, data):
+        with self._version_lock:
+            self._data_version += 1
+            for resource in _changed_resources(event_type, data):
+                self._versions[resource] = self._data_version
+                self._versions.move_to_end(resource)
+            while len(self._versions) > RESOURCE_VERSION_LIMIT:
+                _resource, version = self._versions.popitem(last=False)
+                self._version_floor = max(self._version_floor, version)
+        for callback in list(self._listeners):
+            try:
+                callback(event_type, data)
+            except Exception:
+                pass
 
     def new_trace_id(self):
         return str(uuid.uuid4())
 
-    def create_trace(self, trace_id, repo_url, code_host, error_signature, error_excerpt):
+    def create_trace(self, trace_id, repo_url, code_host, error_signature, error_excerpt, features=None):
+        if not features and error_excerpt:
+            features = self._extract_query_features(error_excerpt)
+        now = int(time.time())
+        self._write(
+            """
+            INSERT INTO traces(trace_id, created_at, repo_url, code_host, error_signature, error_excerpt, status, features)
+            VALUES(?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                trace_id,
+                now,
+                repo_url,
+                code_host,
+                error_signature,
+                error_excerpt,
+                "RUNNING",
+                json.dumps(features, ensure_ascii=False) if features else None,
+            ),
+            event=("trace_started", {"trace_id": trace_id, "repo_url": repo_url, "code_host": code_host, "status": "RUNNING", "at": now}),
+        )
+
+    def finish_trace_ok(self, trace_id, mr_url, commit_sha):
+        now = int(time.time())
+        self._write(
+            """
+            UPDATE traces
+            SET finished_at=?, status=?, mr_url=?, commit_sha=?
+            WHERE trace_id=?
+            """,
+            (now, "DONE", mr_url, commit_sha, trace_id),
+            event=("trace_finished", {"trace_id": trace_id, "status": "DONE", "mr_url": mr_url, "commit_sha": commit_sha, "at": now}),
+        )
+        self._precompute_trace_matches(trace_id)
+
+    def finish_trace_fail(self, trace_id, failure_step, failure_message):
+        now = int(time.time())
+        self._write(
+            """
+            UPDATE traces
+            SET finished_at=?, status=?, failure_step=?, failure_message=?
+            WHERE trace_id=?
+            """,
+            (now, "FAILED", failure_step, failure_message, trace_id),
+            event=(
+                "trace_finished",
+                {"trace_id": trace_id, "status": "FAILED", "failure_step": failure_step, "failure_message": failure_message, "at": now},
+            ),
+        )
+        self._precompute_trace_matches(trace_id)
+
+    def _precompute_trace_matches(self, trace_id):
+        # Trace detail reads the stored result; a failure here only means it is computed on first view.
+        # Write-behind callers are not made to wait for the writer, so those traces are computed lazily.
+        if self.write_mode == "async":
+            return
+        try:
+            self.refresh_trace_matches(trace_id)
+        except Exception:
+            pass
+
+    def start_step(self, trace_id, step_name, message=""):
+        now = int(time.time())
+        self._write(
+            """
+            INSERT INTO steps(trace_id, step_name, started_at, status, message)
+            VALUES(?, ?, ?, ?, ?)
+            """,
+            (trace_id, step_name, now, "RUNNING", message[:2000]),
+            event=("step_started", {"trace_id": trace_id, "step_name": step_name, "status": "RUNNING", "at": now}),
+        )
+
+    def finish_step_ok(self, trace_id, step_name, message="", duration=None):
+        now = int(time.time())
+        self._write(
+            """
+            UPDATE steps
+            SET finished_at=?, status=?, message=?
+            WHERE trace_id=? AND step_name=? AND status='RUNNING'
+            """,
+            (now, "OK", message[:2000], trace_id, step_name),
+            event=(
+                "step_finished",
+                {"trace_id": trace_id, "step_name": step_name, "status": "OK", "message": message[:2000], "at": now, "duration": duration},
+            ),
+        )
+
+    def finish_step_fail(self, trace_id, step_name, message, duration=None):
         now = int(time.time())
+        self._write(
+            """
+            UPDATE steps
+            SET finished_at=?, status=?, message=?
+            WHERE trace_id=? AND step_name=? AND status='RUNNING'
+            """,
+            (now, "FAIL", (message or "")[:2000], trace_id, step_name),
+            event=(
+                "step_finished",
+                {
+                    "trace_id": trace_id,
+                    "step_name": step_name,
+                    "status": "FAIL",
+                    "message": (message or "")[:2000],
+                    "at": now,
+                    "duration": duration,
+                },
+            ),
+        )
+
+    def interrupt_trace(self, trace_id, failure_step="", message="", unsafe_steps=(), recoverable=True):
+        now = int(time.time())
+        message = (message or "")[:2000]
+        self.flush()
         with self._connect() as conn:
+            rows = conn.execute("SELECT step_name, status FROM steps WHERE trace_id=? ORDER BY id", (trace_id,)).fetchall()
+            running = [r[0] for r in rows if r[1] == "RUNNING"]
+            reached_unsafe = any(r[0] in unsafe_steps for r in rows) or failure_step in unsafe_steps
+            status = "INTERRUPTED" if recoverable and not reached_unsafe else "FAILED"
+            failure_step = failure_step or (running[-1] if running else (rows[-1][0] if rows else "RUN_JOB"))
             conn.execute(
+                "UPDATE steps SET finished_at=?, status=?, message=? WHERE trace_id=? AND status='RUNNING'",
+                (now, "FAIL", message, trace_id),
+            )
+            updated = conn.execute(
                 """
-                INSERT INTO traces(trace_id, created_at, repo_url, code_host, error_signature, error_excerpt, status)
-                VALUES(?, ?, ?, ?, ?, ?, ?)
+                UPDATE traces
+                SET finished_at=?, status=?, failure_step=?, failure_message=?
+                WHERE trace_id=? AND status='RUNNING'
                 """,
-                (
-                    trace_id,
-                    now,
-                    repo_url,
-                    code_host,
-                    error_signature,
-                    error_excerpt,
-                    "RUNNING",
-                ),
-            )
+                (now, status, failure_step, message, trace_id),
+            ).rowcount
+        if not updated:
+            return None
+        self._emit(
+            "trace_finished",
+            {"trace_id": trace_id, "status": status, "failure_step": failure_step, "failure_message": message, "at": now},
+        )
+        return status
 
-    def finish_trace_ok(self, trace_id, mr_url, commit_sha):
+    def running_trace_ids(self):
+        self._sync_reads()
+        with self._connect() as conn:
+            rows = conn.execute("SELECT trace_id FROM traces WHERE status='RUNNING' ORDER BY created_at").fetchall()
+        return [r[0] for r in rows]
+
+    def save_job(self, job_id, kind, priority, payload, target_node=""):
         now = int(time.time())
         with self._connect() as conn:
             conn.execute(
                 """
-                UPDATE traces
-                SET finished_at=?, status=?, mr_url=?, commit_sha=?
-                WHERE trace_id=?
+                INSERT OR REPLACE INTO jobs(job_id, kind, priority, payload, status, trace_id, attempts, created_at, updated_at, target_node)
+                VALUES(?, ?, ?, ?, 'QUEUED', '', 0, ?, ?, ?)
                 """,
-                (now, "DONE", mr_url, commit_sha, trace_id),
+                (job_id, kind, int(priority), json.dumps(payload, ensure_ascii=False), now, now, target_node or ""),
             )
 
-    def finish_trace_fail(self, trace_id, failure_step, failure_message):
+    def stage_job(self, job_id, kind, priority, payload, key="", ttl_seconds=0, owner=""):
+        # Persists a job that is not claimable yet (a PR comment batch still inside its coalesce window)
+        # together with the delivery key in one transaction. Returns (task that owns the key, staged);
+        # staged is False when another request or node accepted this delivery first and nothing was written.
         now = int(time.time())
         with self._connect() as conn:
+            if key:
+                conn.execute("DELETE FROM idempotency_keys WHERE key=? AND expires_at < ?", (key, now))
+                claimed = conn.execute(
+                    "INSERT OR IGNORE INTO idempotency_keys(key, task_id, created_at, expires_at) VALUES(?, ?, ?, ?)",
+                    (key, job_id, now, now + int(ttl_seconds)),
+                ).rowcount
+                if not claimed:
+                    return conn.execute("SELECT task_id FROM idempotency_keys WHERE key=?", (key,)).fetchone()[0], False
             conn.execute(
                 """
-                UPDATE traces
-                SET finished_at=?, status=?, failure_step=?, failure_message=?
-                WHERE trace_id=?
+                INSERT INTO jobs(job_id, kind, priority, payload, status, trace_id, attempts, created_at, updated_at, target_node)
+                VALUES(?, ?, ?, ?, 'PENDING', '', 0, ?, ?, ?)
+                ON CONFLICT(job_id) DO UPDATE SET payload=excluded.payload, updated_at=excluded.updated_at
+                WHERE jobs.status='PENDING'
                 """,
-                (now, "FAILED", failure_step, failure_message, trace_id),
+                (job_id, kind, int(priority), json.dumps(payload, ensure_ascii=False), now, now, owner or ""),
             )
+        return job_id, True
 
-    def start_step(self, trace_id, step_name, message=""):
+    def promote_pending_jobs(self, live_owners=None):
+        # Staged jobs whose owner is gone (or every staged job, for a single node restarting) become
+        # ordinary queued jobs.
+        where = "status='PENDING'"
+        params = []
+        if live_owners is not None:
+            marks = ",".join("?" for _ in live_owners) or "''"
+            where += f" AND target_node NOT IN ({marks})"
+            params.extend(live_owners)
+        with self._connect() as conn:
+            return conn.execute(
+                f"UPDATE jobs SET status='QUEUED', target_node='', updated_at=? WHERE {where}", [int(time.time())] + params
+            ).rowcount
+
+    def mark_job(self, job_id, status, trace_id=None, fence=None):
         now = int(time.time())
+        sets = ["status=?", "updated_at=?"]
+        params = [status, now]
+        if trace_id is not None:
+            sets.append("trace_id=?")
+            params.append(trace_id)
+        if status == "RUNNING":
+            sets.append("attempts=attempts+1")
+        else:
+            sets.append("lease_expires_at=NULL")
+        if status in ("DONE", "FAILED"):
+            sets.append("payload=''")
+        where = "job_id=?"
+        params.append(job_id)
+        if fence is not None:
+            where += " AND fence=?"
+            params.append(int(fence))
         with self._connect() as conn:
+            return conn.execute(f"UPDATE jobs SET {', '.join(sets)} WHERE {where}", params).rowcount
+
+    def claim_job(self, owner, lease_seconds, live_nodes=None, steal_after=0):
+        self._sync_reads()
+        now = time.time()
+        where = "j.status IN ('QUEUED', 'INTERRUPTED')"
+        params = []
+        if live_nodes is not None:
+            # Jobs routed to another live node wait for it, unless they have waited longer than steal_after.
+            marks = ",".join("?" for _ in live_nodes) or "''"
+            where += f" AND (j.target_node IN ('', ?) OR j.target_node NOT IN ({marks}) OR j.updated_at <= ?)"
+            params.extend([owner] + list(live_nodes) + [int(now - float(steal_after))])
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                f"""
+                SELECT {JOB_SELECT}
+                FROM jobs j LEFT JOIN traces t ON t.trace_id = j.trace_id
+                WHERE j.status IN ('QUEUED', 'INTERRUPTED', 'RUNNING')
+                  AND (({where}) OR (j.status = 'RUNNING' AND j.lease_expires_at IS NOT NULL AND j.lease_expires_at < ?))
+                ORDER BY j.priority, j.target_node = ? DESC, j.created_at
+                LIMIT 1
+                """,
+                params + [now, owner],
+            ).fetchone()
+            if not row:
+                conn.rollback()
+                return None
+            job = self._row_to_job(row)
             conn.execute(
                 """
-                INSERT INTO steps(trace_id, step_name, started_at, status, message)
-                VALUES(?, ?, ?, ?, ?)
+                UPDATE jobs
+                SET status='RUNNING', lease_owner=?, lease_expires_at=?, fence=fence+1, attempts=attempts+1, updated_at=?
+                WHERE job_id=?
                 """,
-                (trace_id, step_name, now, "RUNNING", message[:2000]),
+                (owner, now + float(lease_seconds), int(now), job["job_id"]),
             )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        job["previous_owner"] = job["lease_owner"]
+        job["lease_owner"] = owner
+        job["fence"] += 1
+        job["attempts"] += 1
+        return job
 
-    def finish_step_ok(self, trace_id, step_name, message=""):
+    def attach_job_trace(self, job_id, trace_id, fence):
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE jobs SET trace_id=?, updated_at=? WHERE job_id=? AND fence=?",
+                (trace_id, int(time.time()), job_id, int(fence)),
+            ).rowcount
+
+    def renew_job_lease(self, job_id, owner, fence, lease_seconds):
+        with self._connect() as conn:
+            return bool(
+                conn.execute(
+                    """
+                    UPDATE jobs SET lease_expires_at=?
+                    WHERE job_id=? AND lease_owner=? AND fence=? AND status='RUNNING'
+                    """,
+                    (time.time() + float(lease_seconds), job_id, owner, int(fence)),
+                ).rowcount
+            )
+
+    def job_fence_ok(self, job_id, fence):
+        with self._connect() as conn:
+            row = conn.execute("SELECT fence, status FROM jobs WHERE job_id=?", (job_id,)).fetchone()
+        return bool(row) and row[0] == int(fence) and row[1] == "RUNNING"
+
+    def get_job(self, job_id):
+        self._sync_reads()
+        with self._connect() as conn:
+            row = conn.execute(
+                f"SELECT {JOB_SELECT} FROM jobs j LEFT JOIN traces t ON t.trace_id = j.trace_id WHERE j.job_id=?",
+                (job_id,),
+            ).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def count_jobs(self, statuses):
+        statuses = list(statuses)
+        marks = ",".join("?" for _ in statuses)
+        with self._connect() as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM jobs WHERE status IN ({marks})", statuses).fetchone()[0]
+
+    def list_jobs(self, statuses):
+        self._sync_reads()
+        statuses = list(statuses)
+        if not statuses:
+            return []
+        marks = ",".join("?" for _ in statuses)
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"""
+                SELECT {JOB_SELECT}
+                FROM jobs j LEFT JOIN traces t ON t.trace_id = j.trace_id
+                WHERE j.status IN ({marks})
+                ORDER BY j.priority, j.created_at
+                """,
+                statuses,
+            ).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def _row_to_job(self, row):
+        job = dict(zip(JOB_KEYS, row))
+        try:
+            job["payload"] = json.loads(job["payload"] or "{}")
+        except ValueError:
+            job["payload"] = {}
+        return job
+
+    def find_idempotency_key(self, key):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT task_id FROM idempotency_keys WHERE key=? AND expires_at >= ?",
+                (key, int(time.time())),
+            ).fetchone()
+        return row[0] if row else None
+
+    def claim_idempotency_key(self, key, task_id, ttl_seconds):
         now = int(time.time())
         with self._connect() as conn:
+            conn.execute("DELETE FROM idempotency_keys WHERE key=? AND expires_at < ?", (key, now))
+            conn.execute(
+                "INSERT OR IGNORE INTO idempotency_keys(key, task_id, created_at, expires_at) VALUES(?, ?, ?, ?)",
+                (key, task_id, now, now + int(ttl_seconds)),
+            )
+            row = conn.execute("SELECT task_id FROM idempotency_keys WHERE key=?", (key,)).fetchone()
+            # Amortized purge keeps the table bounded by the TTL without a background sweeper.
             conn.execute(
                 """
-                UPDATE steps
-                SET finished_at=?, status=?, message=?
-                WHERE trace_id=? AND step_name=? AND status='RUNNING'
+                DELETE FROM idempotency_keys
+                WHERE rowid IN (SELECT rowid FROM idempotency_keys WHERE expires_at < ? ORDER BY expires_at LIMIT 100)
                 """,
-                (now, "OK", message[:2000], trace_id, step_name),
+                (now,),
             )
+        return row[0]
 
-    def finish_step_fail(self, trace_id, step_name, message):
-        now = int(time.time())
+    def release_idempotency_key(self, key, task_id):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM idempotency_keys WHERE key=? AND task_id=?", (key, task_id))
+
+    def job_loads(self):
+        with self._connect() as conn:
+            rows = conn.execute(
+                """
+                SELECT COALESCE(NULLIF(lease_owner, ''), target_node), COUNT(*)
+                FROM jobs
+                WHERE status IN ('QUEUED', 'INTERRUPTED', 'RUNNING')
+                GROUP BY 1
+                """
+            ).fetchall()
+        return {r[0]: r[1] for r in rows if r[0]}
+
+    def heartbeat_node(self, node_id):
+        now = time.time()
         with self._connect() as conn:
             conn.execute(
                 """
-                UPDATE steps
-                SET finished_at=?, status=?, message=?
-                WHERE trace_id=? AND step_name=? AND status='RUNNING'
+                INSERT INTO nodes(node_id, started_at, last_seen) VALUES(?, ?, ?)
+                ON CONFLICT(node_id) DO UPDATE SET last_seen=excluded.last_seen
                 """,
-                (now, "FAIL", (message or "")[:2000], trace_id, step_name),
+                (node_id, now, now),
             )
 
+    def remove_node(self, node_id):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM nodes WHERE node_id=?", (node_id,))
+
+    def live_nodes(self, ttl_seconds):
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT node_id FROM nodes WHERE last_seen >= ? ORDER BY node_id",
+                (time.time() - float(ttl_seconds),),
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def db_data_version(self):
+        with self._version_lock:
+            if self._version_conn is None:
+                self._version_conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            return self._version_conn.execute("PRAGMA data_version").fetchone()[0]
+
     def get_trace(self, trace_id):
+        self._sync_reads()
         with self._connect() as conn:
             row = conn.execute(
                 """
                 SELECT trace_id, created_at, finished_at, repo_url, code_host,
-                       error_signature, error_excerpt, status, failure_step, failure_message, mr_url, commit_sha
+                       error_signature, error_excerpt, status, failure_step, failure_message, mr_url, commit_sha, features
                 FROM traces WHERE trace_id=?
                 """,
                 (trace_id,),
@@ -118,9 +603,26 @@ class TraceStore:
             "mr_url",
             "commit_sha",
         ]
-        return dict(zip(keys, row))
+        trace = dict(zip(keys, row[:-1]))
+        trace["features"] = self._load_features(row[-1])
+        return trace
+
+    def _trace_row(self, row):
+        trace = dict(row)
+        if "features" in trace:
+            trace["features"] = self._load_features(trace["features"])
+        return trace
+
+    def _load_features(self, raw):
+        if not raw:
+            return None
+        try:
+            return trusted_features(json.loads(raw))
+        except ValueError:
+            return None
 
     def list_steps(self, trace_id):
+        self._sync_reads()
         with self._connect() as conn:
             conn.row_factory = sqlite3.Row
             rows = conn.execute(
@@ -134,49 +636,148 @@ class TraceStore:
             ).fetchall()
             return [dict(r) for r in rows]
 
-    def search_similar_cases(self, repo_url, query_text, limit=5):
+    def search_similar_cases(self, repo_url, query_text, limit=5, features=None):
         repo_url = (repo_url or "").strip()
         query_text = (query_text or "").strip()
-        if not repo_url or not query_text:
+        if not repo_url or not (query_text or features):
             return []
 
-        features = self._extract_query_features(query_text)
+        features = features or self._extract_query_features(query_text)
+        with self._connect() as conn:
+            return self._similar_cases(conn, repo_url, features, limit)[0]
+
+    def _similar_cases(self, conn, repo_url, features, limit):
+        # Returns (cases, via_fts); via_fts means neither the exact signature nor the LSH index matched,
+        # so any new case in the repo may change the answer.
         signature = features.get("signature") or ""
         normalized_query = features.get("normalized_query") or ""
         exception_type = features.get("exception_type") or ""
 
+        if signature:
+            rows = conn.execute(
+                """
+                SELECT case_id, signature, exception_type, message_key, top_frames, quality_score, status, updated_at
+                FROM bug_cases
+                WHERE repo_url=? AND signature=?
+                ORDER BY quality_score DESC, updated_at DESC
+                LIMIT ?
+                """,
+                (repo_url, signature, int(limit)),
+            ).fetchall()
+            results = [self._row_to_case(r) for r in rows]
+        else:
+            results = []
+        # Near duplicates (an extra frame, a reordered chain) fill the remaining slots from the LSH index.
+        # While older cases are still being indexed the result counts as a full-text fallback, so it is
+        # recomputed once the index is complete.
+        partial = "case_minhash" in self._backfills
+        if len(results) < int(limit) and not partial:
+            seen = {r["case_id"] for r in results}
+            results += self._similar_by_minhash(conn, repo_url, features, int(limit) - len(results), seen)
+        if results:
+            return results, partial
+
+        tokens = self._fts_query_tokens(exception_type, normalized_query)
+        if not tokens:
+            return [], True
+        match = " ".join(tokens)
+        rows = conn.execute(
+            """
+            SELECT c.case_id, c.signature, c.exception_type, c.message_key, c.top_frames,
+                   c.quality_score, c.status, c.updated_at
+            FROM bug_cases_fts
+            JOIN bug_cases c ON c.case_id=bug_cases_fts.case_id
+            WHERE c.repo_url=? AND bug_cases_fts.text MATCH ?
+            ORDER BY bm25(bug_cases_fts) ASC, c.quality_score DESC, c.updated_at DESC
+            LIMIT ?
+            """,
+            (repo_url, match, max(int(limit), 1)),
+        ).fetchall()
+        return [self._row_to_case(r) for r in rows], True
+
+    def get_trace_matches(self, trace, limit=1):
+        repo_url = (trace.get("repo_url") or "").strip()
+        excerpt = (trace.get("error_excerpt") or "").strip()
+        features = trace.get("features") or (self._extract_query_features(excerpt) if excerpt else None)
+        if not repo_url or not features:
+            return []
+        limit = min(max(int(limit), 1), TRACE_MATCH_LIMIT)
+        self._sync_reads()
         with self._connect() as conn:
-            if signature:
+            if conn.execute("SELECT 1 FROM trace_match_state WHERE trace_id=?", (trace["trace_id"],)).fetchone():
                 rows = conn.execute(
                     """
-                    SELECT case_id, signature, exception_type, message_key, top_frames, quality_score, status, updated_at
-                    FROM bug_cases
-                    WHERE repo_url=? AND signature=?
-                    ORDER BY quality_score DESC, updated_at DESC
+                    SELECT c.case_id, c.signature, c.exception_type, c.message_key, c.top_frames,
+                           c.quality_score, c.status, c.updated_at
+                    FROM trace_matches m JOIN bug_cases c ON c.case_id=m.case_id
+                    WHERE m.trace_id=?
+                    ORDER BY m.rank
                     LIMIT ?
                     """,
-                    (repo_url, signature, int(limit)),
+                    (trace["trace_id"], limit),
                 ).fetchall()
-                if rows:
-                    return [self._row_to_case(r) for r in rows]
+                return [self._row_to_case(r) for r in rows]
+        # Traces from before precomputation, or invalidated by a newer case, are computed on first view.
+        return self._store_trace_matches(trace["trace_id"], repo_url, features)[:limit]
 
-            tokens = self._fts_query_tokens(exception_type, normalized_query)
-            if not tokens:
-                return []
-            match = " ".join(tokens)
-            rows = conn.execute(
+    def refresh_trace_matches(self, trace_id):
+        self.flush()
+        with self._connect() as conn:
+            row = conn.execute("SELECT repo_url, error_excerpt, features FROM traces WHERE trace_id=?", (trace_id,)).fetchone()
+        if not row or not row[0]:
+            return []
+        features = self._load_features(row[2]) or (self._extract_query_features(row[1]) if row[1] else None)
+        if not features:
+            return []
+        return self._store_trace_matches(trace_id, row[0], features)
+
+    def _store_trace_matches(self, trace_id, repo_url, features):
+        minhash = minhash_signature(
+            case_shingles(features.get("exception_type") or "", features.get("message_key") or "", features.get("top_frames") or "")
+        )
+        conn = self._connect()
+        try:
+            # Computed under the write lock, so a case recorded concurrently either is seen here or
+            # invalidates the stored result after it is written.
+            conn.execute("BEGIN IMMEDIATE")
+            results, via_fts = self._similar_cases(conn, repo_url, features, TRACE_MATCH_LIMIT)
+            conn.execute("DELETE FROM trace_matches WHERE trace_id=?", (trace_id,))
+            conn.executemany(
+                "INSERT INTO trace_matches(trace_id, rank, case_id) VALUES(?, ?, ?)",
+                [(trace_id, rank, r["case_id"]) for rank, r in enumerate(results)],
+            )
+            conn.execute(
                 """
-                SELECT c.case_id, c.signature, c.exception_type, c.message_key, c.top_frames,
-                       c.quality_score, c.status, c.updated_at
-                FROM bug_cases_fts
-                JOIN bug_cases c ON c.case_id=bug_cases_fts.case_id
-                WHERE c.repo_url=? AND bug_cases_fts.text MATCH ?
-                ORDER BY bm25(bug_cases_fts) ASC, c.quality_score DESC, c.updated_at DESC
-                LIMIT ?
+                INSERT OR REPLACE INTO trace_match_state(trace_id, repo_url, signature, via_fts, computed_at)
+                VALUES(?, ?, ?, ?, ?)
                 """,
-                (repo_url, match, max(int(limit), 1)),
-            ).fetchall()
-            return [self._row_to_case(r) for r in rows]
+                (trace_id, repo_url, features.get("signature") or "", int(via_fts), int(time.time())),
+            )
+            if minhash is not None:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO trace_lsh(bucket, trace_id) VALUES(?, ?)",
+                    [(bucket, trace_id) for bucket in lsh_buckets(repo_url, minhash)],
+                )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return results
+
+    def _invalidate_trace_matches(self, conn, case_id, repo_url, signature, minhash):
+        # Only traces whose stored top matches this case can change are marked stale: those already
+        # listing it, those with the same signature or an LSH bucket in common, and those that had
+        # fallen back to full-text search.
+        stale = {r[0] for r in conn.execute("SELECT trace_id FROM trace_matches WHERE case_id=?", (case_id,))}
+        if signature:
+            stale.update(
+                r[0] for r in conn.execute("SELECT trace_id FROM trace_match_state WHERE repo_url=? AND signature=?", (repo_url, signature))
+            )
+        stale.update(r[0] for r in conn.execute("SELECT trace_id FROM trace_match_state WHERE repo_url=? AND via_fts=1", (repo_url,)))
+        if minhash is not None:
+            for bucket in lsh_buckets(repo_url, minhash):
+                stale.update(r[0] for r in conn.execute("SELECT trace_id FROM trace_lsh WHERE bucket=?", (bucket,)))
+        conn.executemany("DELETE FROM trace_match_state WHERE trace_id=?", [(t,) for t in stale])
 
     def record_bug_case_revision(
         self,
@@ -192,6 +793,7 @@ class TraceStore:
         changed_files_json="",
         diff_text="",
         preflight_ok=0,
+        features=None,
     ):
         repo_url = (repo_url or "").strip()
         code_host = (code_host or "").strip()
@@ -199,19 +801,31 @@ class TraceStore:
         trigger_text = trigger_text or ""
         now = int(time.time())
 
-        features = self._extract_query_features(trigger_text)
+        features = features or self._extract_query_features(trigger_text)
         signature = features.get("signature") or ""
         exception_type = features.get("exception_type") or ""
         message_key = features.get("message_key") or ""
         top_frames = features.get("top_frames") or ""
         normalized_query = features.get("normalized_query") or ""
 
+        # Large text goes to content-addressed, compressed blobs; compress before taking the write lock.
+        texts = {
+            "trigger_text": trigger_text[:20000],
+            "pr_body": (pr_body or "")[:20000],
+            "changed_files_json": (changed_files_json or "")[:20000],
+            "diff_text": (diff_text or "")[:200000],
+        }
+        prepared = {field: prepare_text(texts[field], self.blob_codec) for field in REVISION_BLOB_FIELDS}
+        minhash = minhash_signature(case_shingles(exception_type, message_key, top_frames))
+
         with self._connect() as conn:
+            # "+updated_at" keeps the planner on the (repo_url, signature) index; without stats it would
+            # otherwise walk every case in the repo through idx_bug_cases_repo_updated to avoid a sort.
             row = conn.execute(
                 """
                 SELECT case_id FROM bug_cases
                 WHERE repo_url=? AND signature=?
-                ORDER BY updated_at DESC
+                ORDER BY +updated_at DESC
                 LIMIT 1
                 """,
                 (repo_url, signature),
@@ -251,27 +865,38 @@ class TraceStore:
                     ),
                 )
 
+            self._index_case_minhash(conn, case_id, repo_url, minhash)
+            self._invalidate_trace_matches(conn, case_id, repo_url, signature, minhash)
+            inline = {}
+            for field, (text, encoded) in prepared.items():
+                inline[field] = text
+                inline[f"{field}_blob"] = put_blob(conn, encoded) if encoded is not None else None
             conn.execute(
                 """
                 INSERT INTO bug_case_revisions(
                     case_id, trace_id, trigger_type, trigger_text, pr_url, pr_title, pr_body, commit_sha,
-                    changed_files_json, diff_text, preflight_ok, created_at
+                    changed_files_json, diff_text, preflight_ok, created_at,
+                    trigger_text_blob, pr_body_blob, changed_files_json_blob, diff_text_blob
                 )
-                VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 """,
                 (
                     case_id,
                     trace_id,
                     trigger_type,
-                    trigger_text[:20000],
+                    inline["trigger_text"],
                     (pr_url or "")[:2000],
                     (pr_title or "")[:500],
-                    (pr_body or "")[:20000],
+                    inline["pr_body"],
                     (commit_sha or "")[:200],
-                    (changed_files_json or "")[:20000],
-                    (diff_text or "")[:200000],
+                    inline["changed_files_json"],
+                    inline["diff_text"],
                     int(1 if preflight_ok else 0),
                     now,
+                    inline["trigger_text_blob"],
+                    inline["pr_body_blob"],
+                    inline["changed_files_json_blob"],
+                    inline["diff_text_blob"],
                 ),
             )
 
@@ -281,216 +906,144 @@ class TraceStore:
                 "INSERT INTO bug_cases_fts(case_id, text) VALUES(?, ?)",
                 (case_id, fts_text[:20000]),
             )
+            if self._trigram:
+                case_rowid = conn.execute("SELECT rowid FROM bug_cases WHERE case_id=?", (case_id,)).fetchone()[0]
+                conn.execute(
+                    "INSERT OR REPLACE INTO bug_cases_trigram(rowid, case_id, text) VALUES(?, ?, ?)",
+                    (case_rowid, case_id, trigram_text(exception_type, message_key, top_frames)),
+                )
+        self._emit("bug_case_updated", {"case_id": case_id, "repo_url": repo_url, "trace_id": trace_id, "signature": signature, "at": now})
         return case_id
 
+    def _open(self, check_same_thread=True):
+        conn = sqlite3.connect(self.db_path, cached_statements=self.cached_statements, check_same_thread=check_same_thread)
+        for pragma in self.pragmas:
+            conn.execute(pragma)
+        return conn
+
     def _connect(self):
-        conn = sqlite3.connect(self.db_path)
-        conn.execute("PRAGMA journal_mode=WAL;")
-        conn.execute("PRAGMA foreign_keys=ON;")
+        # One connection per thread: PRAGMAs run once and the statement cache survives between calls.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._open()
+        conn.row_factory = None
         return conn
 
-    def _ensure_column(self, conn, table, column, col_type):
-        rows = conn.execute(f"PRAGMA table_info({table})").fetchall()
-        existing = {r[1] for r in rows} if rows else set()
-        if column in existing:
-            return
-        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {col_type}")
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn is not None:
+            conn.close()
+        with self._version_lock:
+            if self._version_conn is not None:
+                self._version_conn.close()
+                self._version_conn = None
 
     def _init_db(self):
         os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
-        with self._connect() as conn:
-            conn.execute(
-                """
-                CREATE TABLE IF NOT EXISTS traces(
-                    trace_id TEXT PRIMARY KEY,
-                    created_at INTEGER NOT NULL,
-                    finished_at INTEGER,
-                    repo_url TEXT NOT NULL,
-                    code_host TEXT NOT NULL,
-                    error_signature TEXT,
-                    error_excerpt TEXT,
-                    status TEXT NOT NULL,
-                    failure_step TEXT,
-                    failure_message TEXT,
-                    mr_url TEXT,
-                    commit_sha TEXT
-                )
-                """
-            )
-            conn.execute(
-                """
-                CREATE TABLE IF NOT EXISTS steps(
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    trace_id TEXT NOT NULL,
-                    step_name TEXT NOT NULL,
-                    started_at INTEGER NOT NULL,
-                    finished_at INTEGER,
-                    status TEXT NOT NULL,
-                    message TEXT,
-                    FOREIGN KEY(trace_id) REFERENCES traces(trace_id)
-                )
-                """
-            )
-            conn.execute(
-                """
-                CREATE TABLE IF NOT EXISTS bug_cases(
-                    case_id TEXT PRIMARY KEY,
-                    repo_url TEXT NOT NULL,
-                    code_host TEXT NOT NULL,
-                    signature TEXT NOT NULL,
-                    exception_type TEXT,
-                    message_key TEXT,
-                    top_frames TEXT,
-                    status TEXT NOT NULL,
-                    quality_score REAL NOT NULL DEFAULT 0,
-                    created_at INTEGER NOT NULL,
-                    updated_at INTEGER NOT NULL
-                )
-                """
-            )
-            conn.execute(
-                """
-                CREATE INDEX IF NOT EXISTS idx_bug_cases_repo_sig
-                ON bug_cases(repo_url, signature)
-                """
-            )
-            conn.execute(
-                """
-                CREATE TABLE IF NOT EXISTS bug_case_revisions(
-                    revision_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    case_id TEXT NOT NULL,
-                    trace_id TEXT,
-                    trigger_type TEXT NOT NULL,
-                    trigger_text TEXT,
-                    pr_url TEXT,
-                    pr_title TEXT,
-                    pr_body TEXT,
-                    commit_sha TEXT,
-                    changed_files_json TEXT,
-                    diff_text TEXT,
-                    preflight_ok INTEGER NOT NULL DEFAULT 0,
-                    created_at INTEGER NOT NULL,
-                    FOREIGN KEY(case_id) REFERENCES bug_cases(case_id)
-                )
-                """
-            )
-            conn.execute(
-                """
-                CREATE VIRTUAL TABLE IF NOT EXISTS bug_cases_fts
-                USING fts5(case_id UNINDEXED, text)
-                """
+        conn = self._open()
+        try:
+            # Only takes effect on a new database; existing ones switch on their next full VACUUM.
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("PRAGMA journal_mode=WAL")
+            migrate(conn)
+            self._trigram = bool(conn.execute("SELECT 1 FROM sqlite_master WHERE name='bug_cases_trigram'").fetchone())
+            self._backfills = pending_backfills(conn)
+        finally:
+            conn.close()
+
+    def pending_backfills(self):
+        return sorted(self._backfills)
+
+    def run_backfills(self, stop=None, pause_seconds=0.0):
+        if not self._backfills:
+            return []
+        conn = self._open()
+        try:
+            conn.execute("PRAGMA busy_timeout=60000")
+            finished = run_backfills(conn, stop=stop, pause_seconds=pause_seconds)
+            self._backfills = pending_backfills(conn)
+        finally:
+            conn.close()
+        return finished
+
+    def _index_case_minhash(self, conn, case_id, repo_url, signature):
+        old = conn.execute("SELECT repo_url, signature FROM case_minhash WHERE case_id=?", (case_id,)).fetchone()
+        if old and old[0] == repo_url and old[1] == signature:
+            return
+        if old:
+            conn.executemany(
+                "DELETE FROM case_lsh WHERE bucket=? AND case_id=?",
+                [(bucket, case_id) for bucket in lsh_buckets(old[0], old[1])],
             )
-            self._ensure_column(conn, "bug_case_revisions", "pr_title", "TEXT")
-            self._ensure_column(conn, "bug_case_revisions", "pr_body", "TEXT")
+        if signature is None:
+            conn.execute("DELETE FROM case_minhash WHERE case_id=?", (case_id,))
+            return
+        conn.execute("INSERT OR REPLACE INTO case_minhash(case_id, repo_url, signature) VALUES(?, ?, ?)", (case_id, repo_url, signature))
+        conn.executemany(
+            "INSERT OR IGNORE INTO case_lsh(bucket, case_id) VALUES(?, ?)",
+            [(bucket, case_id) for bucket in lsh_buckets(repo_url, signature)],
+        )
+
+    def _similar_by_minhash(self, conn, repo_url, features, limit, exclude=()):
+        signature = minhash_signature(
+            case_shingles(features.get("exception_type") or "", features.get("message_key") or "", features.get("top_frames") or "")
+        )
+        if signature is None or limit <= 0:
+            return []
+        candidates = set()
+        crowded = set()
+        for bucket in lsh_buckets(repo_url, signature):
+            members = conn.execute(
+                "SELECT case_id FROM case_lsh WHERE bucket=? LIMIT ?", (bucket, MAX_BUCKET_SIZE + 1)
+            ).fetchall()
+            target = crowded if len(members) > MAX_BUCKET_SIZE else candidates
+            target.update(r[0] for r in members[:MAX_BUCKET_SIZE])
+        candidates = (candidates or crowded) - set(exclude)
+        if not candidates:
+            return []
+        ids = sorted(candidates)
+        rows = conn.execute(
+            f"SELECT case_id, signature FROM case_minhash WHERE case_id IN ({','.join('?' for _ in ids)}) AND repo_url=?",
+            ids + [repo_url],
+        ).fetchall()
+        scores = similarities(signature, [r[1] for r in rows])
+        ranked = sorted(((score, r[0]) for score, r in zip(scores, rows) if score >= MIN_SIMILARITY), reverse=True)[:limit]
+        if not ranked:
+            return []
+        ids = [case_id for _score, case_id in ranked]
+        found = conn.execute(
+            f"""
+            SELECT case_id, signature, exception_type, message_key, top_frames, quality_score, status, updated_at
+            FROM bug_cases WHERE case_id IN ({",".join("?" for _ in ids)})
+            """,
+            ids,
+        ).fetchall()
+        by_id = {r[0]: self._row_to_case(r) for r in found}
+        return [by_id[case_id] for case_id in ids if case_id in by_id]
 
     def _row_to_case(self, row):
         keys = ["case_id", "signature", "exception_type", "message_key", "top_frames", "quality_score", "status", "updated_at"]
         return dict(zip(keys, row))
 
     def _extract_query_features(self, text):
-        raw = text or ""
-        normalized = self._normalize_text(raw)
-        exception_type, message = self._extract_exception_line(normalized)
-        message_key = self._message_key(message)
-        frames = self._extract_frames(raw)
-        top_frames = " | ".join(frames[:5])
-        fingerprint = " ".join(frames[:8])
-        signature_base = f"{exception_type}\n{message_key}\n{fingerprint}".strip()
-        signature = hashlib.sha256(signature_base.encode("utf-8", errors="ignore")).hexdigest() if signature_base else ""
-        normalized_query = self._normalize_query_text(exception_type, message_key, frames)
-        if not normalized_query:
-            normalized_query = re.sub(r"\s+", " ", normalized).strip()[:500]
-        if not signature and normalized_query:
-            signature = hashlib.sha256(normalized_query.encode("utf-8", errors="ignore")).hexdigest()
-        return {
-            "exception_type": exception_type,
-            "message_key": message_key,
-            "top_frames": top_frames,
-            "signature": signature,
-            "normalized_query": normalized_query,
-        }
-
-    def _exception_simple_name(self, exception_type):
-        s = (exception_type or "").strip()
-        if not s:
-            return ""
-        s = s.split(":", 1)[0].strip()
-        s = s.split(".")[-1]
-        s = s.split("$")[-1]
-        return s.strip()
-
-    def _extract_exception_line(self, normalized_text):
-        lines = [ln.strip() for ln in (normalized_text or "").splitlines() if ln.strip()]
-        if not lines:
-            return "", ""
-        for ln in reversed(lines[-50:]):
-            m = re.match(r"^([A-Za-z_][A-Za-z0-9_.$]*(?:Error|Exception))\s*:\s*(.*)$", ln)
-            if m:
-                return self._exception_simple_name(m.group(1)), (m.group(2) or "").strip()
-        for ln in reversed(lines[-50:]):
-            m = re.search(r"([A-Za-z_][A-Za-z0-9_.$]*(?:Error|Exception))\s*:\s*(.*)$", ln)
-            if m:
-                return self._exception_simple_name(m.group(1)), (m.group(2) or "").strip()
-        last = lines[-1]
-        m = re.search(r"([A-Za-z_][A-Za-z0-9_.$]*(?:Error|Exception))\b", last)
-        if m:
-            return self._exception_simple_name(m.group(1)), ""
-        return "", ""
-
-    def _extract_frames(self, raw_text):
-        frames = []
-        raw = raw_text or ""
-        pattern = re.compile(r'File\s+"([^"]+)",\s+line\s+(\d+),\s+in\s+([A-Za-z_][A-Za-z0-9_]*)')
-        for m in pattern.finditer(raw):
-            file_path = m.group(1) or ""
-            func = m.group(3) or ""
-            file_name = os.path.basename(file_path.replace("\\", "/"))
-            if not file_name:
-                continue
-            frames.append(f"{file_name}:{func}")
-        java_pattern = re.compile(r"^\s*at\s+([A-Za-z0-9_.$]+)\(([A-Za-z0-9_.+$-]+):(\d+)\)\s*$", re.MULTILINE)
-        for m in java_pattern.finditer(raw):
-            full = (m.group(1) or "").strip()
-            file_name = (m.group(2) or "").strip()
-            if file_name.lower() in ("unknown source", "native method"):
-                continue
-            func = full.split(".")[-1] if full else ""
-            if not file_name or not func:
-                continue
-            frames.append(f"{file_name}:{func}")
-        return frames
-
-    def _normalize_text(self, text):
-        s = text or ""
-        s = s.replace("\r\n", "\n").replace("\r", "\n")
-        s = re.sub(r"\b[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\b", "<uuid>", s, flags=re.IGNORECASE)
-        s = re.sub(r"\b0x[0-9a-f]+\b", "<hex>", s, flags=re.IGNORECASE)
-        s = re.sub(r"\b\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?\b", "<ts>", s)
-        s = re.sub(r"[A-Za-z]:\\\\[^\s\"']+", "<path>", s)
-        s = re.sub(r"(/[^ \n\t\"']+)+", "<path>", s)
-        s = re.sub(r"\b\d{3,}\b", "<num>", s)
-        return s
-
-    def _message_key(self, message):
-        s = (message or "").strip()
-        if not s:
-            return ""
-        s = self._normalize_text(s)
-        s = re.sub(r"['\"].*?['\"]", "<str>", s)
-        s = re.sub(r"\s+", " ", s).strip()
-        return s[:160]
-
-    def _normalize_query_text(self, exception_type, message_key, frames):
-        parts = []
-        if exception_type:
-            parts.append(exception_type)
-        if message_key:
-            parts.append(message_key)
-        if frames:
-            parts.append(" ".join(frames[:3]))
-        text = " ".join(parts)
-        text = re.sub(r"\s+", " ", text).strip()
-        return text[:500]
+        if self.feature_cache_size <= 0:
+            return extract_features(text)
+        key = hashlib.sha256((text or "").encode("utf-8", errors="replace")).digest()
+        with self._feature_lock:
+            cached = self._feature_cache.get(key)
+            if cached is not None:
+                self._feature_cache.move_to_end(key)
+                return dict(cached)
+        features = extract_features(text)
+        with self._feature_lock:
+            self._feature_cache[key] = features
+            self._feature_cache.move_to_end(key)
+            while len(self._feature_cache) > self.feature_cache_size:
+                self._feature_cache.popitem(last=False)
+        return dict(features)
 
     def _build_fts_text(self, exception_type, normalized_query, top_frames):
         s = " ".join([exception_type or "", normalized_query or "", top_frames or ""])
@@ -509,15 +1062,63 @@ class TraceStore:
             return False
         return bool(re.fullmatch(r"[0-9a-f]{64}", s.strip(), flags=re.IGNORECASE))
 
+    def _encode_cursor(self, payload):
+        raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+        return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+    def _decode_cursor(self, cursor):
+        s = (cursor or "").strip()
+        try:
+            raw = base64.urlsafe_b64decode(s + "=" * (-len(s) % 4))
+            payload = json.loads(raw.decode("utf-8"))
+        except Exception:
+            raise ValueError("invalid cursor")
+        if not isinstance(payload, dict):
+            raise ValueError("invalid cursor")
+        key = payload.get("k")
+        if key is not None and (not isinstance(key, list) or len(key) != 2 or not isinstance(key[0], int)):
+            raise ValueError("invalid cursor")
+        if not isinstance(payload.get("o", 0), int):
+            raise ValueError("invalid cursor")
+        return payload
+
+    def _count(self, conn, sql, params, mode):
+        mode = (mode or "approx").strip().lower()
+        if mode == "none":
+            return None
+        if mode != "approx" or self.count_cache_ttl <= 0:
+            return int(conn.execute(sql, params).fetchone()[0])
+        key = (sql, tuple(params))
+        now = time.monotonic()
+        with self._count_lock:
+            cached = self._count_cache.get(key)
+        if cached and now - cached[1] < self.count_cache_ttl:
+            return cached[0]
+        count = int(conn.execute(sql, params).fetchone()[0])
+        with self._count_lock:
+            if len(self._count_cache) >= 256:
+                self._count_cache.clear()
+            self._count_cache[key] = (count, now)
+        return count
+
     def _fts_free_text_tokens(self, text):
         base = (text or "").strip()
-        base = self._normalize_text(base)
+        base = normalize_text(base)
         base = re.sub(r"[^\w<>\- ]+", " ", base)
         tokens = [t.strip() for t in base.split() if t and t not in ("<ts>", "<uuid>", "<hex>", "<path>", "<num>", "<str>")]
         if len(tokens) > 16:
             tokens = tokens[:16]
         return tokens
 
+    def _free_text_match(self, q):
+        # Substring terms (part of a class name, a dotted package, file.py:func) go to the trigram index;
+        # terms shorter than a trigram can only be matched as whole words.
+        use_trigram = self._trigram and "case_trigram" not in self._backfills
+        terms = [t for t in (q or "").split() if len(t) >= 3][:16] if use_trigram else []
+        if terms:
+            return "bug_cases_trigram", " AND ".join('"' + t.replace('"', '""') + '"' for t in terms)
+        return "bug_cases_fts", " ".join(self._fts_free_text_tokens(q))
+
     def query_bug_cases(self, repo_url=None, q=None, limit=50, offset=0):
         repo_url = (repo_url or "").strip()
         q = (q or "").strip()
@@ -542,10 +1143,9 @@ class TraceStore:
                 return [dict(r) for r in rows], int(total)
 
             if q:
-                tokens = self._fts_free_text_tokens(q)
-                if tokens:
-                    match = " ".join(tokens)
-                    where = ["bug_cases_fts.text MATCH ?"]
+                fts_table, match = self._free_text_match(q)
+                if match:
+                    where = [f"{fts_table}.text MATCH ?"]
                     params = [match]
                     if repo_url:
                         where.insert(0, "c.repo_url = ?")
@@ -553,18 +1153,18 @@ class TraceStore:
                     where_sql = " AND ".join(where)
                     total = conn.execute(
                         f"""
-                        SELECT COUNT(*) FROM bug_cases_fts
-                        JOIN bug_cases c ON c.case_id=bug_cases_fts.case_id
+                        SELECT COUNT(*) FROM {fts_table}
+                        JOIN bug_cases c ON c.case_id={fts_table}.case_id
                         WHERE {where_sql}
                         """,
                         params,
                     ).fetchone()[0]
                     rows = conn.execute(
                         f"""
-                        SELECT c.* FROM bug_cases_fts
-                        JOIN bug_cases c ON c.case_id=bug_cases_fts.case_id
+                        SELECT c.* FROM {fts_table}
+                        JOIN bug_cases c ON c.case_id={fts_table}.case_id
                         WHERE {where_sql}
-                        ORDER BY bm25(bug_cases_fts) ASC, c.quality_score DESC, c.updated_at DESC
+                        ORDER BY bm25({fts_table}) ASC, c.quality_score DESC, c.updated_at DESC
                         LIMIT ? OFFSET ?
                         """,
                         params + [limit, offset],
@@ -602,6 +1202,82 @@ class TraceStore:
         items, _total = self.query_bug_cases(repo_url=repo_url, q=None, limit=limit, offset=offset)
         return items
 
+    def page_bug_cases(self, repo_url=None, q=None, limit=50, cursor=None, total="approx"):
+        repo_url = (repo_url or "").strip()
+        q = (q or "").strip()
+        limit = max(int(limit), 1)
+        state = self._decode_cursor(cursor) if cursor else {}
+
+        fts_table, match = self._free_text_match(q) if q and not self._is_sha256(q) else ("", "")
+        if match:
+            # bm25 ranking has no stable sort key, so ranked search pages by position.
+            offset = max(int(state.get("o") or 0), 0)
+            where = [f"{fts_table}.text MATCH ?"]
+            params = [match]
+            if repo_url:
+                where.insert(0, "c.repo_url = ?")
+                params.insert(0, repo_url)
+            where_sql = " AND ".join(where)
+            with self._connect() as conn:
+                conn.row_factory = sqlite3.Row
+                rows = conn.execute(
+                    f"""
+                    SELECT c.* FROM {fts_table}
+                    JOIN bug_cases c ON c.case_id={fts_table}.case_id
+                    WHERE {where_sql}
+                    ORDER BY bm25({fts_table}) ASC, c.quality_score DESC, c.updated_at DESC
+                    LIMIT ? OFFSET ?
+                    """,
+                    params + [limit + 1, offset],
+                ).fetchall()
+                count = self._count(
+                    conn,
+                    f"""
+                    SELECT COUNT(*) FROM {fts_table}
+                    JOIN bug_cases c ON c.case_id={fts_table}.case_id
+                    WHERE {where_sql}
+                    """,
+                    params,
+                    total,
+                )
+            items = [dict(r) for r in rows[:limit]]
+            next_cursor = self._encode_cursor({"o": offset + limit}) if len(rows) > limit else None
+            return {"items": items, "total": count, "next_cursor": next_cursor}
+
+        where = []
+        params = []
+        if repo_url:
+            where.append("repo_url = ?")
+            params.append(repo_url)
+        if q and self._is_sha256(q):
+            where.append("signature = ?")
+            params.append(q)
+        elif q:
+            like = f"%{q.lower()}%"
+            where.append("(LOWER(exception_type) LIKE ? OR LOWER(message_key) LIKE ? OR signature LIKE ?)")
+            params.extend([like, like, q])
+        count_where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+        page_params = list(params)
+        after = state.get("k")
+        if after:
+            where.append("(updated_at, case_id) < (?, ?)")
+            page_params.extend([int(after[0]), str(after[1])])
+        where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute(
+                f"SELECT * FROM bug_cases {where_sql} ORDER BY updated_at DESC, case_id DESC LIMIT ?",
+                page_params + [limit + 1],
+            ).fetchall()
+            count = self._count(conn, f"SELECT COUNT(*) FROM bug_cases {count_where_sql}", params, total)
+        items = [dict(r) for r in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = items[-1]
+            next_cursor = self._encode_cursor({"k": [last["updated_at"], last["case_id"]]})
+        return {"items": items, "total": count, "next_cursor": next_cursor}
+
     def get_bug_case(self, case_id):
         with self._connect() as conn:
             conn.row_factory = sqlite3.Row
@@ -612,9 +1288,17 @@ class TraceStore:
         with self._connect() as conn:
             conn.row_factory = sqlite3.Row
             rows = conn.execute("SELECT * FROM bug_case_revisions WHERE case_id = ? ORDER BY created_at DESC", (case_id,)).fetchall()
-            return [dict(row) for row in rows]
+            revisions = [dict(row) for row in rows]
+            blobs = load_blobs(conn, [r[f"{field}_blob"] for r in revisions for field in REVISION_BLOB_FIELDS])
+        for revision in revisions:
+            for field in REVISION_BLOB_FIELDS:
+                key = revision.pop(f"{field}_blob")
+                if key:
+                    revision[field] = blobs.get(key, "")
+        return revisions
 
     def query_traces(self, repo_url=None, status=None, limit=50, offset=0):
+        self._sync_reads()
         repo_url = (repo_url or "").strip()
         status = (status or "").strip().upper()
         limit = max(int(limit), 1)
@@ -637,12 +1321,224 @@ class TraceStore:
                 f"SELECT * FROM traces {where_sql} ORDER BY created_at DESC LIMIT ? OFFSET ?",
                 params + [limit, offset],
             ).fetchall()
-            return [dict(r) for r in rows], int(total)
+            return [self._trace_row(r) for r in rows], int(total)
 
     def list_traces(self, limit=50, offset=0):
         items, _total = self.query_traces(limit=limit, offset=offset)
         return items
 
+    def page_traces(self, repo_url=None, status=None, limit=50, cursor=None, total="approx"):
+        self._sync_reads()
+        repo_url = (repo_url or "").strip()
+        status = (status or "").strip().upper()
+        limit = max(int(limit), 1)
+        after = self._decode_cursor(cursor).get("k") if cursor else None
+
+        where = []
+        params = []
+        if repo_url:
+            where.append("repo_url = ?")
+            params.append(repo_url)
+        if status:
+            where.append("status = ?")
+            params.append(status)
+        count_where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+        page_params = list(params)
+        if after:
+            where.append("(created_at, trace_id) < (?, ?)")
+            page_params.extend([int(after[0]), str(after[1])])
+        where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute(
+                f"SELECT * FROM traces {where_sql} ORDER BY created_at DESC, trace_id DESC LIMIT ?",
+                page_params + [limit + 1],
+            ).fetchall()
+            count = self._count(conn, f"SELECT COUNT(*) FROM traces {count_where_sql}", params, total)
+        items = [self._trace_row(r) for r in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = items[-1]
+            next_cursor = self._encode_cursor({"k": [last["created_at"], last["trace_id"]]})
+        return {"items": items, "total": count, "next_cursor": next_cursor}
+
+    # Export iterators may be resumed from a different worker thread for each batch (never two at once),
+    # so their connections skip the same-thread check.
+    def iter_traces(self, repo_url=None, status=None, since=None, until=None, include_steps=False, batch_size=500):
+        self._sync_reads()
+        where, params = self._export_filters("t", "created_at", repo_url, status, since, until)
+        sql = f"SELECT t.* FROM traces t {where} ORDER BY t.created_at ASC, t.trace_id ASC"
+        conn = self._open(check_same_thread=False)
+        try:
+            conn.row_factory = sqlite3.Row
+            cur = conn.execute(sql, params)
+            while True:
+                rows = cur.fetchmany(max(int(batch_size), 1))
+                if not rows:
+                    break
+                items = [self._trace_row(r) for r in rows]
+                if include_steps:
+                    steps = self._steps_for_traces(conn, [item["trace_id"] for item in items])
+                    for item in items:
+                        item["steps"] = steps.get(item["trace_id"], [])
+                for item in items:
+                    yield item
+        finally:
+            conn.close()
+
+    def iter_steps(self, repo_url=None, status=None, since=None, until=None, batch_size=500):
+        self._sync_reads()
+        where, params = self._export_filters("t", "created_at", repo_url, status, since, until)
+        sql = f"""
+            SELECT s.id, s.trace_id, s.step_name, s.started_at, s.finished_at, s.status, s.message, t.repo_url
+            FROM steps s
+            JOIN traces t ON t.trace_id=s.trace_id
+            {where}
+            ORDER BY s.id ASC
+        """
+        conn = self._open(check_same_thread=False)
+        try:
+            conn.row_factory = sqlite3.Row
+            cur = conn.execute(sql, params)
+            while True:
+                rows = cur.fetchmany(max(int(batch_size), 1))
+                if not rows:
+                    break
+                for r in rows:
+                    yield dict(r)
+        finally:
+            conn.close()
+
+    def iter_bug_cases(self, repo_url=None, status=None, since=None, until=None, batch_size=500):
+        where, params = self._export_filters("c", "updated_at", repo_url, status, since, until)
+        sql = f"SELECT c.* FROM bug_cases c {where} ORDER BY c.updated_at ASC, c.case_id ASC"
+        conn = self._open(check_same_thread=False)
+        try:
+            conn.row_factory = sqlite3.Row
+            cur = conn.execute(sql, params)
+            while True:
+                rows = cur.fetchmany(max(int(batch_size), 1))
+                if not rows:
+                    break
+                for r in rows:
+                    yield dict(r)
+        finally:
+            conn.close()
+
+    def _export_filters(self, alias, time_column, repo_url, status, since, until):
+        where = []
+        params = []
+        if (repo_url or "").strip():
+            where.append(f"{alias}.repo_url = ?")
+            params.append(repo_url.strip())
+        if (status or "").strip():
+            where.append(f"{alias}.status = ?")
+            params.append(status.strip().upper())
+        if since is not None:
+            where.append(f"{alias}.{time_column} >= ?")
+            params.append(int(since))
+        if until is not None:
+            where.append(f"{alias}.{time_column} < ?")
+            params.append(int(until))
+        return (f"WHERE {' AND '.join(where)}" if where else ""), params
+
+    def _steps_for_traces(self, conn, trace_ids):
+        grouped = {}
+        if not trace_ids:
+            return grouped
+        placeholders = ",".join("?" for _ in trace_ids)
+        rows = conn.execute(
+            f"""
+            SELECT trace_id, step_name, started_at, finished_at, status, message
+            FROM steps
+            WHERE trace_id IN ({placeholders})
+            ORDER BY trace_id ASC, started_at ASC, id ASC
+            """,
+            list(trace_ids),
+        ).fetchall()
+        for r in rows:
+            step = dict(r)
+            grouped.setdefault(step.pop("trace_id"), []).append(step)
+        return grouped
+
+    def stats(self, repo_url=None, since=None, until=None, top_signatures=20):
+        # Reads only the rollup tables, so the cost follows the number of (repo, day, step) buckets in range.
+        now = int(time.time())
+        until = now + 1 if until is None else int(until)
+        since = until - 30 * 86400 if since is None else int(since)
+        first_day = time.strftime("%Y-%m-%d", time.gmtime(since))
+        last_day = time.strftime("%Y-%m-%d", time.gmtime(max(until - 1, since)))
+        repo_url = (repo_url or "").strip()
+        repo_where = "repo_url = ? AND " if repo_url else ""
+        params = ([repo_url] if repo_url else []) + [first_day, last_day]
+        trace_cols = "SUM(started), SUM(done), SUM(failed), SUM(interrupted), SUM(resolve_seconds)"
+
+        self._sync_reads()
+        with self._connect() as conn:
+            daily = conn.execute(
+                f"SELECT day, {trace_cols} FROM stats_daily WHERE {repo_where}day BETWEEN ? AND ? GROUP BY day ORDER BY day",
+                params,
+            ).fetchall()
+            repos = conn.execute(
+                f"""
+                SELECT repo_url, {trace_cols} FROM stats_daily WHERE {repo_where}day BETWEEN ? AND ?
+                GROUP BY repo_url ORDER BY SUM(started) DESC, repo_url
+                """,
+                params,
+            ).fetchall()
+            steps = conn.execute(
+                f"""
+                SELECT step_name, SUM(ok), SUM(failed), SUM(seconds) FROM stats_steps WHERE {repo_where}day BETWEEN ? AND ?
+                GROUP BY step_name ORDER BY step_name
+                """,
+                params,
+            ).fetchall()
+            signatures = conn.execute(
+                f"""
+                SELECT repo_url, signature, SUM(traces), SUM(done), SUM(failed), MIN(first_seen), MAX(last_seen)
+                FROM stats_signatures_daily WHERE {repo_where}day BETWEEN ? AND ?
+                GROUP BY repo_url, signature ORDER BY SUM(traces) DESC, MAX(last_seen) DESC LIMIT ?
+                """,
+                params + [max(int(top_signatures), 0)],
+            ).fetchall()
+
+        def trace_counts(row):
+            started, done, failed, interrupted, resolve_seconds = (int(v or 0) for v in row)
+            return {
+                "started": started,
+                "done": done,
+                "failed": failed,
+                "interrupted": interrupted,
+                "mttr_seconds": (resolve_seconds / done) if done else None,
+            }
+
+        totals = trace_counts([sum(int(r[i] or 0) for r in daily) for i in range(1, 6)])
+        step_items = []
+        for step_name, ok, failed, seconds in steps:
+            finished = int(ok or 0) + int(failed or 0)
+            step_items.append(
+                {
+                    "step_name": step_name,
+                    "ok": int(ok or 0),
+                    "failed": int(failed or 0),
+                    "failure_rate": (int(failed or 0) / finished) if finished else None,
+                    "avg_seconds": (int(seconds or 0) / finished) if finished else None,
+                }
+            )
+        keys = ["repo_url", "signature", "traces", "done", "failed", "first_seen", "last_seen"]
+        return {
+            "since": since,
+            "until": until,
+            "totals": totals,
+            "daily": [dict(trace_counts(r[1:]), day=r[0]) for r in daily],
+            "repos": [dict(trace_counts(r[1:]), repo_url=r[0]) for r in repos],
+            "steps": step_items,
+            "signatures": [dict(zip(keys, r)) for r in signatures],
+            # False while the rollups are still counting rows that existed before the upgrade.
+            "complete": "stats_rollups" not in self._backfills,
+        }
+
     def debug_retrieval(self, query_text):
         features = self._extract_query_features(query_text)
         exception_type = features.get("exception_type") or ""
@@ -683,21 +1579,166 @@ class TraceStore:
 
 
 
+class WriteTicket:
+    __slots__ = ("sql", "params", "seq", "error", "done", "on_commit")
+
+    def __init__(self, sql, params, seq, on_commit=None):
+        self.sql = sql
+        self.params = params
+        self.seq = seq
+        self.on_commit = on_commit
+        self.error = None
+        self.done = threading.Event()
+
+    def wait(self, timeout=None):
+        if not self.done.wait(timeout):
+            raise TimeoutError("trace write was not committed in time")
+        if self.error is not None:
+            raise self.error
+
+
+class GroupCommitWriter:
+    def __init__(self, connect, max_batch=256, max_delay=0.0):
+        self.connect = connect
+        self.max_batch = max(int(max_batch), 1)
+        self.max_delay = max(float(max_delay), 0.0)
+        self._cond = threading.Condition()
+        self._pending = []
+        self._seq = 0
+        self._committed = 0
+        self._closed = False
+        self.batches = 0
+        self.writes = 0
+        self._thread = threading.Thread(target=self._loop, name="trace-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, sql, params, on_commit=None):
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("trace writer is closed")
+            self._seq += 1
+            ticket = WriteTicket(sql, params, self._seq, on_commit)
+            self._pending.append(ticket)
+            self._cond.notify_all()
+            return ticket
+
+    def flush(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + float(timeout)
+        with self._cond:
+            target = self._seq
+            while self._committed < target:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout=10.0):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+    def _take_batch(self):
+        with self._cond:
+            while not self._pending and not self._closed:
+                self._cond.wait()
+            if self.max_delay:
+                # Give concurrent writers a moment to join this commit.
+                deadline = time.monotonic() + self.max_delay
+                while not self._closed and len(self._pending) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            batch = self._pending[: self.max_batch]
+            del self._pending[: self.max_batch]
+            return batch
+
+    def _loop(self):
+        conn = self.connect()
+        conn.isolation_level = None
+        try:
+            while True:
+                batch = self._take_batch()
+                if not batch:
+                    return
+                self._commit(conn, batch)
+                # Callbacks run before flush() and wait() return, in commit order; they must not write.
+                for ticket in batch:
+                    if ticket.error is None and ticket.on_commit is not None:
+                        try:
+                            ticket.on_commit()
+                        except Exception:
+                            pass
+                with self._cond:
+                    self._committed = batch[-1].seq
+                    self.batches += 1
+                    self.writes += len(batch)
+                    self._cond.notify_all()
+                for ticket in batch:
+                    ticket.done.set()
+        finally:
+            conn.close()
+
+    def _commit(self, conn, batch):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for ticket in batch:
+                conn.execute(ticket.sql, ticket.params)
+            conn.execute("COMMIT")
+            return
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+        # Replay one by one so a single bad write only fails its own caller.
+        for ticket in batch:
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute(ticket.sql, ticket.params)
+                conn.execute("COMMIT")
+            except Exception as e:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                ticket.error = e
+
+
+class JobInterrupted(Exception):
+    def __init__(self, step_name):
+        super().__init__(f"interrupted before {step_name}")
+        self.step_name = step_name
+
+
+class LeaseLost(Exception):
+    def __init__(self, step_name):
+        super().__init__(f"job lease lost before {step_name}")
+        self.step_name = step_name
+
+
 class StepScope:
-    def __init__(self, store, trace_id, step_name, message=""):
+    def __init__(self, store, trace_id, step_name, message="", cancel_event=None, fence=None):
         self.store = store
         self.trace_id = trace_id
         self.step_name = step_name
         self.message = message
+        self.cancel_event = cancel_event
+        self.fence = fence
+        self.started = None
 
     def __enter__(self):
+        if self.fence is not None and not self.fence():
+            raise LeaseLost(self.step_name)
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise JobInterrupted(self.step_name)
         self.store.start_step(self.trace_id, self.step_name, self.message)
+        self.started = time.monotonic()
         return self
 
     def __exit__(self, exc_type, exc, tb):
+        duration = time.monotonic() - self.started if self.started is not None else None
         if exc is None:
-            self.store.finish_step_ok(self.trace_id, self.step_name, self.message)
+            self.store.finish_step_ok(self.trace_id, self.step_name, self.message, duration=duration)
             return False
-        self.store.finish_step_fail(self.trace_id, self.step_name, str(exc))
+        self.store.finish_step_fail(self.trace_id, self.step_name, str(exc), duration=duration)
         return False
 
@@ -54,15 +54,16 @@ class GitService:
         }
 
     @staticmethod
-    def clone(repo_url, dest_dir, env=None, disable_proxy=False):
+    def clone(repo_url, dest_dir, env=None, disable_proxy=False, reference=None):
         dest_dir = os.path.abspath(dest_dir)
         os.makedirs(os.path.dirname(dest_dir) or ".", exist_ok=True)
         merged_env = None
         if env:
             merged_env = os.environ.copy()
             merged_env.update(env)
+        reference_args = ["--reference-if-able", reference, "--dissociate"] if reference else []
         return subprocess.run(
-            GitService._git_prefix(disable_proxy=disable_proxy) + ["clone", repo_url, dest_dir],
+            GitService._git_prefix(disable_proxy=disable_proxy) + ["clone"] + reference_args + [repo_url, dest_dir],
             capture_output=True,
             text=True,
             encoding="utf-8",
@@ -1,7 +1,10 @@
+import hashlib
 import json
 import os
 import re
 import shutil
+import subprocess
+import threading
 import time
 import urllib.parse
 import urllib.error
@@ -11,12 +14,18 @@ import uuid
 from ai_ops import config
 from ai_ops.vcs.git_service import GitService
 
+# Names produced by allocate(): "[<repo-slug>-]ws-<unix-ts>-<8 hex>".
+WORKSPACE_NAME = re.compile(r"^(?:.+-)?ws-\d+-[0-9a-f]{8}$")
+
 
 class WorkspaceManager:
     _gitlab_username = None
+    _cache_locks = {}
+    _cache_locks_guard = threading.Lock()
 
     def __init__(self, base_dir=None):
         self.base_dir = os.path.abspath(base_dir or config.WORKSPACES_DIR)
+        self.cache_dir = os.path.join(self.base_dir, ".repo-cache")
         os.makedirs(self.base_dir, exist_ok=True)
 
     def _get_gitlab_username(self):
@@ -68,6 +77,21 @@ class WorkspaceManager:
                     time.sleep(0.25)
             shutil.rmtree(abs_path, ignore_errors=True)
 
+    def sweep(self, keep=()):
+        keep = {os.path.abspath(p) for p in keep}
+        removed = []
+        try:
+            names = os.listdir(self.base_dir)
+        except OSError:
+            return removed
+        for name in names:
+            path = os.path.join(self.base_dir, name)
+            if not WORKSPACE_NAME.match(name) or path in keep or not os.path.isdir(path):
+                continue
+            self.release(path)
+            removed.append(path)
+        return removed
+
     def clone_into(self, repo_url, dest_dir, code_host=None):
         host = (code_host or "").strip().lower()
         url = (repo_url or "").strip()
@@ -82,14 +106,49 @@ class WorkspaceManager:
                 env, askpass_path = GitService._build_askpass_env(config.GITLAB_TOKEN)
                 if getattr(config, "GITLAB_DISABLE_PROXY", True):
                     env.update(GitService._proxyless_env())
+                disable_proxy = getattr(config, "GITLAB_DISABLE_PROXY", True)
                 try:
-                    return GitService.clone(auth_url, dest_dir, env=env, disable_proxy=getattr(config, "GITLAB_DISABLE_PROXY", True))
+                    reference = self._repo_cache(auth_url, env=env, disable_proxy=disable_proxy)
+                    return GitService.clone(auth_url, dest_dir, env=env, disable_proxy=disable_proxy, reference=reference)
                 finally:
                     try:
                         os.remove(askpass_path)
                     except OSError:
                         pass
-        return GitService.clone(url, dest_dir)
+        return GitService.clone(url, dest_dir, reference=self._repo_cache(url))
+
+    def _repo_cache(self, repo_url, env=None, disable_proxy=False):
+        if not config.REPO_CACHE_ENABLED:
+            return None
+        parsed = urllib.parse.urlparse(repo_url)
+        key_url = parsed._replace(netloc=parsed.hostname or parsed.netloc).geturl() if parsed.username else repo_url
+        digest = hashlib.sha1(key_url.encode("utf-8")).hexdigest()[:12]
+        path = os.path.join(self.cache_dir, f"{self._repo_slug(repo_url)}-{digest}.git")
+        with self._cache_locks_guard:
+            lock = self._cache_locks.setdefault(path, threading.Lock())
+        try:
+            with lock:
+                if not os.path.isdir(path):
+                    os.makedirs(self.cache_dir, exist_ok=True)
+                    tmp = f"{path}.tmp-{uuid.uuid4().hex[:8]}"
+                    try:
+                        GitService(cwd=self.cache_dir).run(["clone", "--mirror", repo_url, tmp], env=env, disable_proxy=disable_proxy)
+                        os.replace(tmp, path)
+                    finally:
+                        shutil.rmtree(tmp, ignore_errors=True)
+                elif time.time() - self._cache_fetched_at(path) >= config.REPO_CACHE_REFRESH_SECONDS:
+                    GitService(cwd=path).run(["fetch", "--prune", "origin"], env=env, disable_proxy=disable_proxy)
+            return path
+        except (subprocess.CalledProcessError, OSError):
+            return None
+
+    def _cache_fetched_at(self, path):
+        for name in ("FETCH_HEAD", "HEAD"):
+            try:
+                return os.path.getmtime(os.path.join(path, name))
+            except OSError:
+                continue
+        return 0.0
 
     def _repo_slug(self, repo_url):
         url = (repo_url or "").strip()
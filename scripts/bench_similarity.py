@@ -0,0 +1,94 @@
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from ai_ops.trace import minhash
+from ai_ops.trace.trace_store import TraceStore
+
+REPO = "https://example.com/r.git"
+
+
+def _case(rng, modules, funcs):
+    frames = [f"{rng.choice(modules)}.py:{rng.choice(funcs)}" for _ in range(5)]
+    return rng.choice(("ValueError", "KeyError", "TypeError", "RuntimeError")), f"bad value <num> in {rng.choice(funcs)}", frames
+
+
+def _near_duplicate(rng, case, funcs):
+    exception_type, message_key, frames = case
+    frames = list(frames)
+    if rng.random() < 0.5:
+        frames.insert(rng.randrange(len(frames)), f"wrapper.py:{rng.choice(funcs)}")
+        frames = frames[:5]
+    else:
+        i = rng.randrange(len(frames) - 1)
+        frames[i], frames[i + 1] = frames[i + 1], frames[i]
+    return exception_type, message_key, frames
+
+
+def populate(store, cases, batch=5000):
+    conn = store._connect()
+    now = int(time.time())
+    for start in range(0, len(cases), batch):
+        with conn:
+            for case_id, (exception_type, message_key, frames) in cases[start : start + batch]:
+                top_frames = " | ".join(frames)
+                conn.execute(
+                    """
+                    INSERT INTO bug_cases(case_id, repo_url, code_host, signature, exception_type, message_key, top_frames,
+                                          status, quality_score, created_at, updated_at)
+                    VALUES(?, ?, 'github', ?, ?, ?, ?, 'DONE', 0.0, ?, ?)
+                    """,
+                    (case_id, REPO, case_id, exception_type, message_key, top_frames, now, now),
+                )
+                signature = minhash.minhash_signature(minhash.case_shingles(exception_type, message_key, top_frames))
+                store._index_case_minhash(conn, case_id, REPO, signature)
+
+
+def main():
+    p = argparse.ArgumentParser(description="Measure MinHash/LSH top-k latency and near-duplicate recall in TraceStore.")
+    p.add_argument("--cases", type=int, default=100000)
+    p.add_argument("--queries", type=int, default=1000)
+    p.add_argument("--limit", type=int, default=5)
+    p.add_argument("--seed", type=int, default=7)
+    args = p.parse_args()
+
+    rng = random.Random(args.seed)
+    modules = [f"mod{i}" for i in range(max(args.cases // 20, 50))]
+    funcs = [f"fn{i}" for i in range(200)]
+    cases = [(str(uuid.UUID(int=rng.getrandbits(128))), _case(rng, modules, funcs)) for _ in range(args.cases)]
+    workdir = tempfile.mkdtemp(prefix="ai-ops-minhash-")
+    try:
+        store = TraceStore(os.path.join(workdir, "traces.db"))
+        started = time.perf_counter()
+        populate(store, cases)
+        print(f"indexed {args.cases} cases in {time.perf_counter() - started:.1f}s (numpy={'yes' if minhash.np is not None else 'no'})")
+
+        conn = store._connect()
+        latencies = []
+        hits = 0
+        for _ in range(args.queries):
+            case_id, case = rng.choice(cases)
+            exception_type, message_key, frames = _near_duplicate(rng, case, funcs)
+            features = {"exception_type": exception_type, "message_key": message_key, "top_frames": " | ".join(frames)}
+            t0 = time.perf_counter()
+            found = store._similar_by_minhash(conn, REPO, features, args.limit)
+            latencies.append(time.perf_counter() - t0)
+            hits += any(r["case_id"] == case_id for r in found)
+        latencies.sort()
+        p50 = latencies[len(latencies) // 2] * 1000
+        p99 = latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] * 1000
+        print(f"top-{args.limit} queries={args.queries} p50={p50:.3f}ms p99={p99:.3f}ms near-duplicate recall={hits / args.queries:.1%}")
+        store.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
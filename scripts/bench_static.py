@@ -0,0 +1,69 @@
+import argparse
+import http.client
+import os
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from ai_ops.server.http_server import UI_DIR, ApiHandler
+from ai_ops.server.static_assets import StaticAssetCache
+
+
+def _worker(port, path, headers, count, results):
+    sent = 0
+    received = 0
+    for _ in range(count):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+        conn.request("GET", path, headers=headers)
+        resp = conn.getresponse()
+        received += len(resp.read())
+        conn.close()
+        sent += 1
+    results.append((sent, received))
+
+
+def bench(port, path, headers, requests, concurrency):
+    per_thread = max(requests // concurrency, 1)
+    results = []
+    threads = [threading.Thread(target=_worker, args=(port, path, headers, per_thread, results)) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    total = sum(r[0] for r in results)
+    received = sum(r[1] for r in results)
+    return total / elapsed, received / elapsed / 1024 / 1024
+
+
+def main():
+    p = argparse.ArgumentParser(description="Throughput benchmark for the static UI path.")
+    p.add_argument("--requests", type=int, default=2000)
+    p.add_argument("--concurrency", type=int, default=8)
+    p.add_argument("--paths", default="/,/app.js,/styles.css,/missing/route")
+    args = p.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ApiHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+
+    variants = [
+        ("identity", {}),
+        ("gzip", {"Accept-Encoding": "gzip"}),
+        ("br", {"Accept-Encoding": "br, gzip"}),
+    ]
+    for mode, reload in (("cached", False), ("mtime-reload", True)):
+        ApiHandler.static_assets = StaticAssetCache(UI_DIR, reload=reload, reload_interval=0)
+        for path in [s.strip() for s in args.paths.split(",") if s.strip()]:
+            for name, headers in variants:
+                rps, mbps = bench(port, path, headers, args.requests, args.concurrency)
+                print(f"{mode:<13} {path:<16} {name:<9} {rps:10.1f} req/s {mbps:8.2f} MiB/s")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
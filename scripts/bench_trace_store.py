@@ -0,0 +1,108 @@
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from ai_ops.trace.trace_store import SQLITE_PROFILES, TraceStore, sqlite_pragmas
+
+STEPS = ("CREATE_FIX_BRANCH", "AI_PROPOSE_PATCH", "APPLY_PATCH", "PREFLIGHT_CHECK", "GIT_COMMIT_PUSH")
+
+
+class ConnectPerCallStore(TraceStore):
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA foreign_keys=ON;")
+        return conn
+
+
+def _write_traces(store, count, trace_ids):
+    for _ in range(count):
+        trace_id = store.new_trace_id()
+        store.create_trace(trace_id, "https://example.com/r.git", "github", "sig", "ValueError: boom")
+        for step in STEPS:
+            store.start_step(trace_id, step)
+            store.finish_step_ok(trace_id, step)
+        store.finish_trace_ok(trace_id, "", "")
+        trace_ids.append(trace_id)
+
+
+def _read_traces(store, trace_ids, count, latencies):
+    for _ in range(count):
+        trace_id = random.choice(trace_ids)
+        started = time.perf_counter()
+        store.get_trace(trace_id)
+        store.list_steps(trace_id)
+        latencies.append(time.perf_counter() - started)
+
+
+def _run_threads(target, threads, *args):
+    workers = [threading.Thread(target=target, args=args) for _ in range(threads)]
+    started = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return time.perf_counter() - started
+
+
+def bench(name, factory, threads, args):
+    workdir = tempfile.mkdtemp(prefix="ai-ops-bench-")
+    try:
+        store = factory(os.path.join(workdir, "traces.db"))
+        trace_ids = []
+        started = time.perf_counter()
+        _run_threads(_write_traces, threads, store, args.traces, trace_ids)
+        store.flush()
+        elapsed = time.perf_counter() - started
+        writes = len(trace_ids) * (2 + 2 * len(STEPS))
+        latencies = []
+        _run_threads(_read_traces, threads, store, trace_ids, args.reads, latencies)
+        latencies.sort()
+        p50 = latencies[len(latencies) // 2] * 1000
+        p99 = latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] * 1000
+        writer = getattr(store, "_writer", None)
+        batch = f"  avg batch={writer.writes / max(writer.batches, 1):5.1f}" if writer else ""
+        print(
+            f"{name:<28} threads={threads:<3} writes/s={writes / elapsed:9.1f}  "
+            f"read p50={p50:6.3f}ms  p99={p99:6.3f}ms{batch}"
+        )
+        store.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    p = argparse.ArgumentParser(description="Compare TraceStore write throughput and read latency per connection strategy.")
+    p.add_argument("--threads", default="1,4,16")
+    p.add_argument("--traces", type=int, default=100, help="traces written per thread")
+    p.add_argument("--reads", type=int, default=500, help="trace reads per thread")
+    p.add_argument("--profiles", default="safe")
+    p.add_argument("--write-modes", default="direct,sync,async")
+    p.add_argument("--group-commit-ms", type=float, default=0.0)
+    args = p.parse_args()
+
+    profiles = [x.strip() for x in args.profiles.split(",") if x.strip() in SQLITE_PROFILES]
+    modes = [x.strip() for x in args.write_modes.split(",") if x.strip()]
+    for threads in [int(x) for x in args.threads.split(",") if x.strip()]:
+        bench("connect-per-call", ConnectPerCallStore, threads, args)
+        for profile in profiles:
+            for mode in modes:
+                factory = lambda path, profile=profile, mode=mode: TraceStore(
+                    path,
+                    pragmas=sqlite_pragmas(profile),
+                    write_mode=mode,
+                    group_commit_ms=args.group_commit_ms,
+                )
+                bench(f"thread-local/{profile}/{mode}", factory, threads, args)
+
+
+if __name__ == "__main__":
+    main()
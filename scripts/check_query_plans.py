@@ -0,0 +1,187 @@
+import argparse
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from ai_ops.trace.migrations import BACKFILLS, SCHEMA_VERSION, schema_version
+from ai_ops.trace.retention import RetentionPolicy, TraceArchiver
+from ai_ops.trace.trace_store import TraceStore
+
+REPO = "https://example.com/r.git"
+ERROR = 'Traceback (most recent call last):\n  File "/srv/app/main.py", line 10, in run\nValueError: bad value 12345'
+STEPS = ("CREATE_FIX_BRANCH", "AI_PROPOSE_PATCH", "APPLY_PATCH")
+
+# Plans may walk an index in order when the query stops after LIMIT rows, and unfiltered counts may
+# walk a covering index; anything else that reads a whole table fails the check. The nodes table
+# holds one row per live process, so scanning it is cheaper than any index; stats_daily holds one
+# row per repo and day, and the planner may scan it when the requested range covers most of it;
+# stats_watermark holds at most one row.
+# A partial index only holds the rows its WHERE selects, so walking one is not a table scan.
+FULL_SCAN = re.compile(r"\bSCAN (\w+)(.*)$")
+SMALL_TABLES = ("nodes", "stats_daily", "stats_watermark", "sqlite_master")
+# Statements FTS5 issues against its own shadow tables.
+FTS_INTERNAL = re.compile(r"\b(?:FROM|INTO|UPDATE) 'main'\.'")
+
+
+class RecordingStore(TraceStore):
+    def __init__(self, *args, **kwargs):
+        self.statements = []
+        super().__init__(*args, **kwargs)
+
+    def _open(self, *args, **kwargs):
+        conn = super()._open(*args, **kwargs)
+        conn.set_trace_callback(self.statements.append)
+        return conn
+
+
+def _seed(store, traces):
+    for i in range(traces):
+        trace_id = store.new_trace_id()
+        repo_url = REPO if i % 2 == 0 else f"https://example.com/other-{i % 7}.git"
+        store.create_trace(trace_id, repo_url, "github", "sig", ERROR)
+        for step in STEPS:
+            store.start_step(trace_id, step)
+            store.finish_step_ok(trace_id, step)
+        if i % 3:
+            store.finish_trace_ok(trace_id, "", "")
+        else:
+            store.finish_trace_fail(trace_id, STEPS[-1], "boom")
+        store.record_bug_case_revision(trace_id, repo_url, "github", "ERROR", ERROR + f"\nrun {i % 5}")
+        store.save_job(f"job-{i}", "ERROR", 1, {"kind": "ERROR", "repo_url": repo_url})
+        if i % 10:
+            store.mark_job(f"job-{i}", "DONE", trace_id=trace_id)
+        store.claim_idempotency_key(f"key-{i}", f"task-{i}", 3600)
+    return trace_id
+
+
+def _exercise(store, trace_id):
+    case = store.query_bug_cases(repo_url=REPO)[0][0]
+    store.get_trace_matches(store.get_trace(trace_id))
+    store.refresh_trace_matches(trace_id)
+    store.get_trace_matches(store.get_trace(trace_id))
+    store.list_steps(trace_id)
+    store.running_trace_ids()
+    store.query_traces(repo_url=REPO, status="OK")
+    store.query_traces(repo_url=REPO)
+    store.query_traces(status="FAILED")
+    store.query_traces()
+    for filters in ({}, {"repo_url": REPO}, {"status": "OK"}, {"repo_url": REPO, "status": "FAILED"}):
+        page = store.page_traces(limit=5, total="exact", **filters)
+        store.page_traces(limit=5, cursor=page["next_cursor"], total="exact", **filters)
+    store.search_similar_cases(REPO, ERROR)
+    store.search_similar_cases(REPO, "KeyError: missing")
+    store.debug_retrieval(ERROR)
+    store.query_bug_cases(repo_url=REPO, q=case["signature"])
+    store.query_bug_cases(repo_url=REPO, q="ValueError")
+    store.page_bug_cases(repo_url=REPO, limit=5, total="exact")
+    store.page_bug_cases(repo_url=REPO, q="ValueError", limit=5, total="exact")
+    store.get_bug_case(case["case_id"])
+    store.get_bug_case_revisions(case["case_id"])
+    job = store.claim_job("node-0", 30)
+    store.renew_job_lease(job["job_id"], "node-0", job["fence"], 30)
+    store.job_fence_ok(job["job_id"], job["fence"])
+    store.mark_job(job["job_id"], "DONE", fence=job["fence"])
+    store.get_job(job["job_id"])
+    store.count_jobs(("QUEUED", "RUNNING"))
+    store.list_jobs(("QUEUED",))
+    store.job_loads()
+    store.find_idempotency_key("key-1")
+    store.claim_idempotency_key("key-new", "task-new", 3600)
+    store.stats()
+    store.stats(repo_url=REPO, since=0)
+    store.stage_job("staged-1", "PR_COMMENT", 0, {"kind": "PR_COMMENT"}, key="delivery-1", ttl_seconds=3600, owner="node-9")
+    store.promote_pending_jobs(live_owners=["node-0"])
+    store.promote_pending_jobs()
+    store.heartbeat_node("node-0")
+    store.live_nodes(30)
+    # Backfills queued by an upgrade walk their tables by key.
+    with store._connect() as conn:
+        conn.executemany("INSERT OR IGNORE INTO backfills(name, cursor, updated_at) VALUES(?, NULL, 0)", [(name,) for name, _step in BACKFILLS])
+    store._backfills = {name for name, _step in BACKFILLS}
+    store.run_backfills()
+    TraceArchiver(store, RetentionPolicy.parse(30), pause_seconds=0).prune_jobs()
+
+
+def _violations(plan, sql, partial_indexes=()):
+    bad = []
+    limited = re.search(r"\bLIMIT\b", sql, re.IGNORECASE) is not None
+    for detail in plan:
+        m = FULL_SCAN.search(detail)
+        if not m:
+            continue
+        rest = m.group(2)
+        if m.group(1) in SMALL_TABLES:
+            continue
+        if "VIRTUAL TABLE" in rest or "COVERING INDEX" in rest:
+            continue
+        if "USING INDEX" in rest and limited:
+            continue
+        if any(f"USING INDEX {name}" in rest for name in partial_indexes):
+            continue
+        bad.append(detail)
+    return bad
+
+
+def _check(db_path, statements, verbose):
+    seen = set()
+    failures = 0
+    conn = sqlite3.connect(db_path)
+    try:
+        partial_indexes = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='index' AND sql LIKE '% WHERE %'")]
+        for sql in statements:
+            sql = " ".join(sql.split())
+            if not re.match(r"(SELECT|UPDATE|DELETE|WITH)\b", sql, re.IGNORECASE) or sql in seen or FTS_INTERNAL.search(sql):
+                continue
+            seen.add(sql)
+            plan = [r[3] for r in conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()]
+            bad = _violations(plan, sql, partial_indexes)
+            failures += bool(bad)
+            if bad or verbose:
+                print(("FULL SCAN " if bad else "ok        ") + sql[:160])
+                for detail in plan:
+                    print(f"    {detail}")
+    finally:
+        conn.close()
+    return len(seen), failures
+
+
+def main():
+    p = argparse.ArgumentParser(description="Fail if a hot TraceStore query plans a full table scan.")
+    p.add_argument("--traces", type=int, default=200)
+    p.add_argument("-v", "--verbose", action="store_true", help="print every plan, not just failures")
+    args = p.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="ai-ops-plans-")
+    try:
+        store = RecordingStore(os.path.join(workdir, "traces.db"))
+        trace_id = _seed(store, args.traces)
+        with store._connect() as conn:
+            version = schema_version(conn)
+        if version != SCHEMA_VERSION:
+            print(f"schema version {version}, expected {SCHEMA_VERSION}")
+            return 1
+        del store.statements[:]
+        _exercise(store, trace_id)
+        statements = list(store.statements)
+        failed = False
+        # Plans are checked as a fresh database sees them and again once ANALYZE has collected statistics.
+        for label in ("no stats", "analyzed"):
+            if label == "analyzed":
+                with store._connect() as conn:
+                    conn.execute("ANALYZE")
+            checked, failures = _check(store.db_path, statements, args.verbose)
+            print(f"{label}: {checked} queries checked, {failures} with full scans")
+            failed = failed or failures > 0
+        store.close()
+        return 1 if failed else 0
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
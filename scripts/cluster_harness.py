@@ -0,0 +1,142 @@
+import argparse
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+SIMULATED_STEPS = ("CREATE_FIX_BRANCH", "AI_PROPOSE_PATCH", "PREFLIGHT_CHECK", "GIT_COMMIT_PUSH", "CREATE_PR")
+
+
+def run_node(args):
+    from ai_ops.core.orchestrator import RETRY_UNSAFE_STEPS
+    from ai_ops.server.http_server import TaskRunner
+    from ai_ops.trace.trace_store import JobInterrupted, LeaseLost, StepScope
+
+    step_seconds = args.job_seconds / len(SIMULATED_STEPS)
+
+    class SimulatedRunner(TaskRunner):
+        def _run_job(self, job):
+            task_id = job["task_id"]
+            trace_id = self.store.new_trace_id()
+            self.store.create_trace(trace_id, job["repo_url"], "github", "", "")
+            self._job_started(task_id, trace_id)
+            fence = self._fence_check(task_id)
+            try:
+                for step in SIMULATED_STEPS:
+                    cancel_event = None if step in RETRY_UNSAFE_STEPS else self._cancel
+                    with StepScope(self.store, trace_id, step, cancel_event=cancel_event, fence=fence):
+                        time.sleep(step_seconds)
+                self.store.finish_trace_ok(trace_id, "", "")
+                self._mark_job(task_id, "DONE")
+            except LeaseLost:
+                return
+            except JobInterrupted as e:
+                self._interrupt(task_id, trace_id, e.step_name, str(e))
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda _signum, _frame: stop.set())
+    runner = SimulatedRunner()
+    print("ready", flush=True)
+    stop.wait()
+    runner.shutdown(drain_seconds=0, checkpoint_seconds=0)
+
+
+def run_cluster(args, nodes):
+    workdir = tempfile.mkdtemp(prefix="ai-ops-cluster-")
+    db_path = os.path.join(workdir, "traces.db")
+    env = dict(os.environ)
+    env.update(
+        {
+            "CLUSTER_MODE": "true",
+            "TRACE_DB_PATH": db_path,
+            "MAX_CONCURRENT_TASKS": str(args.workers),
+            "JOB_POLL_SECONDS": "0.05",
+            "JOB_LEASE_SECONDS": str(args.lease_seconds),
+            "JOB_HEARTBEAT_SECONDS": str(args.lease_seconds / 4),
+            "AFFINITY_ROUTING": "false" if args.no_affinity else "true",
+        }
+    )
+    from ai_ops.server.affinity import JobRouter
+    from ai_ops.trace.trace_store import TraceStore
+
+    store = TraceStore(db_path)
+    procs = []
+    for n in range(nodes):
+        cmd = [sys.executable, os.path.abspath(__file__), "--node", f"node-{n}", "--job-seconds", str(args.job_seconds)]
+        procs.append(subprocess.Popen(cmd, env=dict(env, NODE_ID=f"node-{n}"), stdout=subprocess.PIPE, text=True))
+    for proc in procs:
+        proc.stdout.readline()
+
+    router = None if args.no_affinity else JobRouter(store, node_ttl=args.lease_seconds)
+    started = time.perf_counter()
+    for i in range(args.jobs):
+        task_id = f"job-{i:05d}"
+        repo_url = f"https://example.com/r/{i % args.repos}.git"
+        target_node = router.route(repo_url) if router else ""
+        store.save_job(task_id, "ERROR", 1, {"kind": "ERROR", "task_id": task_id, "repo_url": repo_url}, target_node=target_node)
+    killed = False
+    while store.count_jobs(("QUEUED", "RUNNING", "INTERRUPTED")):
+        time.sleep(0.02)
+        if args.kill and not killed and nodes > 1 and store.count_jobs(("DONE",)) >= args.jobs // 3:
+            procs[0].kill()
+            killed = True
+    elapsed = time.perf_counter() - started
+    for proc in procs:
+        if proc.poll() is None:
+            proc.terminate()
+        proc.wait()
+
+    done = store.count_jobs(("DONE",))
+    failed = store.count_jobs(("FAILED",))
+    with store._connect() as conn:
+        pushes = conn.execute("SELECT COUNT(*) FROM steps WHERE step_name='GIT_COMMIT_PUSH' AND status='OK'").fetchone()[0]
+        owners = conn.execute("SELECT COUNT(DISTINCT lease_owner) FROM jobs").fetchone()[0]
+        # A node clones a repo cold the first time it sees it; every later job for that repo on that node is warm.
+        cold = conn.execute(
+            """
+            SELECT COUNT(DISTINCT t.repo_url || '|' || j.lease_owner)
+            FROM jobs j JOIN traces t ON t.trace_id = j.trace_id
+            WHERE j.status = 'DONE'
+            """
+        ).fetchone()[0]
+    shutil.rmtree(workdir, ignore_errors=True)
+    warm = 1.0 - cold / done if done else 0.0
+    return elapsed, done, failed, pushes, owners, warm
+
+
+def main():
+    p = argparse.ArgumentParser(description="Run several clustered TaskRunner processes against one SQLite queue.")
+    p.add_argument("--nodes", default="1,2,4")
+    p.add_argument("--jobs", type=int, default=40)
+    p.add_argument("--job-seconds", type=float, default=0.25)
+    p.add_argument("--workers", type=int, default=1)
+    p.add_argument("--repos", type=int, default=8)
+    p.add_argument("--no-affinity", action="store_true", help="route jobs to any node instead of by repo")
+    p.add_argument("--lease-seconds", type=float, default=2.0)
+    p.add_argument("--kill", action="store_true", help="kill node-0 part way through to exercise lease takeover")
+    p.add_argument("--node", default="")
+    args = p.parse_args()
+
+    if args.node:
+        run_node(args)
+        return
+
+    baseline = None
+    for nodes in [int(n) for n in args.nodes.split(",") if n.strip()]:
+        elapsed, done, failed, pushes, owners, warm = run_cluster(args, nodes)
+        rate = done / elapsed if elapsed else 0.0
+        baseline = baseline or rate
+        print(
+            f"nodes={nodes:<3} jobs={done}/{args.jobs} failed={failed} pushes={pushes} owners={owners} "
+            f"{elapsed:7.2f}s {rate:7.2f} jobs/s speedup={rate / baseline:5.2f}x warm-cache={warm:6.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import argparse
+import json
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from ai_ops import config
+from ai_ops.trace.retention import RetentionPolicy, TraceArchiver, archive_dir_for, attach_archive, list_archives
+from ai_ops.trace.trace_store import TraceStore
+
+
+def main():
+    p = argparse.ArgumentParser(description="Archive expired traces, compact the trace database and query monthly archives.")
+    p.add_argument("--db", default=config.TRACE_DB_PATH)
+    p.add_argument("--archive-dir", default=config.TRACE_ARCHIVE_DIR)
+    p.add_argument("--days", type=float, default=config.TRACE_RETENTION_DAYS)
+    p.add_argument("--rules", default=config.TRACE_RETENTION_RULES)
+    p.add_argument("--batch", type=int, default=config.TRACE_RETENTION_BATCH)
+    p.add_argument(
+        "--run", action="store_true", help="finish pending migration backfills, archive expired traces, then merge FTS segments and run incremental vacuum"
+    )
+    p.add_argument("--vacuum", action="store_true", help="one-off full VACUUM that switches an existing database to incremental auto-vacuum")
+    p.add_argument("--list", action="store_true", help="list monthly archive databases")
+    p.add_argument("--month", default="", help="attach this archive month (YYYY-MM) as schema 'archive' for --sql")
+    p.add_argument("--sql", default="", help="read-only query to run against the live database")
+    args = p.parse_args()
+
+    archive_dir = archive_dir_for(args.db, args.archive_dir)
+    if args.vacuum:
+        conn = sqlite3.connect(args.db, isolation_level=None)
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.close()
+        print(f"vacuumed {args.db}: {os.path.getsize(args.db)} bytes")
+    if args.run:
+        store = TraceStore(args.db)
+        for name in store.run_backfills():
+            print(f"backfilled {name}")
+        archiver = TraceArchiver(store, RetentionPolicy.parse(args.days, args.rules), archive_dir=archive_dir, batch_size=args.batch)
+        moved = archiver.run()
+        store.close()
+        print(f"archived {moved} traces into {archive_dir}")
+    if args.list:
+        for month, path in list_archives(archive_dir):
+            print(f"{month}  {os.path.getsize(path):>12}  {path}")
+    if args.sql:
+        conn = sqlite3.connect(f"file:{os.path.abspath(args.db)}?mode=ro", uri=True)
+        conn.row_factory = sqlite3.Row
+        if args.month:
+            attach_archive(conn, archive_dir, args.month)
+        for row in conn.execute(args.sql):
+            print(json.dumps(dict(row), ensure_ascii=False))
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()